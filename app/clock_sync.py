@@ -0,0 +1,60 @@
+import os
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+# With several workers/nodes sharing parties (PUBSUB_URL), timestamps cross
+# processes, so the wall clock (NTP-disciplined) replaces the monotonic one
+_clock = time.time if os.getenv("PUBSUB_URL") else time.monotonic
+
+
+def server_now() -> float:
+    """The server clock shared with clients: monotonic seconds (wall clock with several workers)."""
+    return _clock()
+
+
+def ntp_sample(t0: float, t1: float, t2: float, t3: float) -> Tuple[float, float]:
+    """
+    Classic NTP offset/round-trip from one ping/pong exchange.
+
+    t0: client send, t1: server receive, t2: server send, t3: client receive.
+    Returns (offset, rtt) where server_time ~= client_time + offset.
+    """
+    rtt = (t3 - t0) - (t2 - t1)
+    offset = ((t1 - t0) + (t2 - t3)) / 2
+    return offset, rtt
+
+
+class ClockEstimator:
+    """
+    Per-connection estimate of the client's clock offset.
+
+    Clients run the NTP-style exchange (`clock_ping` / `clock_pong`) and
+    report their latest sample with the next ping. The sample with the
+    lowest round-trip among the recent ones is the least affected by
+    queueing, so that one is trusted.
+    """
+
+    def __init__(self, window: int = 8):
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self.offset: Optional[float] = None
+        self.rtt: Optional[float] = None
+
+    def add_sample(self, offset: float, rtt: float):
+        if rtt < 0:
+            return
+        self.samples.append((offset, rtt))
+        self.offset, self.rtt = min(self.samples, key=lambda s: s[1])
+
+    def to_server_time(self, client_time: float | None) -> Optional[float]:
+        """Converts a client timestamp (seconds) to server time, if the offset is known."""
+        if client_time is None or self.offset is None:
+            return None
+        return client_time + self.offset
+
+    def stats(self) -> dict:
+        return {
+            "offset": round(self.offset, 4) if self.offset is not None else None,
+            "rtt": round(self.rtt, 4) if self.rtt is not None else None,
+            "samples": len(self.samples),
+        }
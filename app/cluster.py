@@ -0,0 +1,349 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from app.delta_sync import DeltaTracker
+from app.outbound import SharedMessage, encode_message
+from app.structured_log import get_logger
+from app.wire import JSON_CODEC
+
+log = get_logger("cluster")
+
+# Channel names on the bus are prefixed, so several deployments can share a broker
+PUBSUB_PREFIX = os.getenv("PUBSUB_PREFIX", "torbware")
+# Every worker re-announces its full presence this often; one that stays
+# silent for PRESENCE_TIMEOUT is considered gone (its parties and users with it)
+PRESENCE_INTERVAL = float(os.getenv("CLUSTER_PRESENCE_INTERVAL", "5"))
+PRESENCE_TIMEOUT = float(os.getenv("CLUSTER_PRESENCE_TIMEOUT", str(3 * PRESENCE_INTERVAL)))
+
+
+def _pack(header: Dict, body: bytes | str = b"") -> bytes:
+    if isinstance(body, str):
+        body = body.encode()
+    return json.dumps(header, separators=(",", ":")).encode() + b"\n" + body
+
+
+def _unpack(data: bytes):
+    header, _, body = data.partition(b"\n")
+    return json.loads(header), body
+
+
+class RemoteClock:
+    """Clock of a forwarded message: its times were already converted to server time by the worker it came from."""
+
+    __slots__ = ("offset", "rtt")
+
+    def __init__(self, offset: Optional[float], rtt: Optional[float]):
+        self.offset = offset
+        self.rtt = rtt
+
+    def to_server_time(self, t: Optional[float]) -> Optional[float]:
+        return t
+
+
+class RemoteConnection:
+    """
+    Stands in for the connection of a user served by another worker while
+    the party owner handles a message forwarded from there. Replies go back
+    through the bus to all of the user's connections.
+    """
+
+    __slots__ = ("user_id", "origin", "clock", "_send")
+
+    def __init__(self, user_id: str, origin: str, clock: RemoteClock, send: Callable[[str, dict], None]):
+        self.user_id = user_id
+        self.origin = origin
+        self.clock = clock
+        self._send = send
+
+    def send(self, message: dict):
+        self._send(self.user_id, message)
+
+    def record_pong(self, sent_at):
+        pass
+
+
+class _Peer:
+    __slots__ = ("entries", "seq", "last_seen")
+
+    def __init__(self):
+        self.entries: Dict[str, Any] = {}
+        self.seq = 0
+        self.last_seen = time.monotonic()
+
+
+class Cluster:
+    """
+    Lets several workers (processes or nodes) serve the same parties over
+    a pub/sub backend (app/pubsub.py).
+
+    - Parties live on the worker that created them (their owner); the
+      party directory comes from presence, so every worker knows where a
+      party is. Messages of a member served elsewhere are forwarded to the
+      owner, which handles them as usual with a RemoteConnection.
+    - Topic broadcasts (party, user) are published on the bus once and
+      delivered by every worker to its local subscribers; the lobby is
+      built locally from everyone's presence.
+    - Presence: each worker publishes the deltas of its own lobby entries
+      (users, parties) plus a periodic full snapshot that doubles as its
+      heartbeat.
+
+    With a backend that is not `distributed` every method is a cheap no-op
+    and the app behaves as a single process.
+    """
+
+    def __init__(self, backend, prefix: str = PUBSUB_PREFIX):
+        self.backend = backend
+        self.distributed = backend.distributed
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.prefix = prefix
+        # Callbacks wired by the app
+        self.deliver: Callable[[str, SharedMessage, Set[str]], None] = lambda topic, message, exclude: None
+        self.on_command: Callable[..., Awaitable[None]] = None
+        self.on_member_left: Callable[[str, str], None] = lambda party_id, user_id: None
+        self.on_party_gone: Callable[[str], None] = lambda party_id: None
+        self.on_users_gone: Callable[[Set[str]], Awaitable[None]] = None
+        self.on_presence: Callable[[], None] = lambda: None
+
+        self._local = DeltaTracker()  # This worker's own lobby entries
+        self._seq = 0
+        self._peers: Dict[str, _Peer] = {}
+        self._party_owner: Dict[str, str] = {}  # party id -> worker id
+        self._user_workers: Dict[str, Set[str]] = {}  # user id -> workers serving them
+        self._names: Dict[str, str] = {}  # user id -> name, for users served elsewhere
+        self._commands: asyncio.Queue = None
+        self._tasks = []
+        self.counters = {"topic_out": 0, "topic_in": 0, "forwarded": 0, "commands": 0,
+                         "presence_out": 0, "presence_in": 0, "peers_lost": 0}
+
+    # --- Channels ---
+
+    def _channel(self, kind: str, name: str = "") -> str:
+        return f"{self.prefix}:{kind}:{name}" if name else f"{self.prefix}:{kind}"
+
+    # --- Lifecycle ---
+
+    async def start(self):
+        await self.backend.start(self._on_bus_message)
+        if not self.distributed:
+            return
+        self._commands = asyncio.Queue()
+        for channel in (self._channel("presence"), self._channel("control"), self._channel("worker", self.worker_id)):
+            self.backend.subscribe(channel)
+        self._tasks = [asyncio.create_task(self._run_commands()), asyncio.create_task(self._run_presence())]
+        self._publish_presence(hello=True)  # Peers answer with their full presence
+
+    async def close(self):
+        if self.distributed:
+            self.backend.publish(self._channel("presence"), _pack({"o": self.worker_id, "bye": True}))
+            for task in self._tasks:
+                task.cancel()
+        await self.backend.close()
+
+    # --- Topics ---
+
+    def watch(self, topic: str):
+        """A local user subscribed to a topic: receive its messages from other workers."""
+        if self.distributed:
+            self.backend.subscribe(self._channel("topic", topic))
+
+    def unwatch(self, topic: str):
+        if self.distributed:
+            self.backend.unsubscribe(self._channel("topic", topic))
+
+    def publish_topic(self, topic: str, message: SharedMessage, exclude: Iterable[str] = ()):
+        """Sends an already locally delivered topic message to the other workers."""
+        if not self.distributed:
+            return
+        self.counters["topic_out"] += 1
+        header = {"o": self.worker_id}
+        if exclude:
+            header["x"] = list(exclude)
+        # The JSON body is the one local writers use too, so it is encoded once
+        self.backend.publish(self._channel("topic", topic), _pack(header, encode_message(message, JSON_CODEC)))
+
+    def is_remote_user(self, user_id: str) -> bool:
+        """Whether another worker serves (some connection of) this user."""
+        return self.distributed and user_id in self._user_workers
+
+    # --- Party directory and forwarding ---
+
+    def party_owner(self, party_id: Optional[str]) -> Optional[str]:
+        return self._party_owner.get(party_id) if party_id else None
+
+    def user_name(self, user_id: str) -> Optional[str]:
+        return self._names.get(user_id)
+
+    def forward(self, owner: str, user_id: str, name: str, msg_type: str, payload: Dict, clock=None):
+        """Hands a party message of a local user to the worker owning the party."""
+        self.counters["forwarded"] += 1
+        header = {"k": "msg", "o": self.worker_id, "u": user_id, "n": name, "t": msg_type}
+        if clock is not None:
+            header["off"] = clock.offset
+            header["rtt"] = clock.rtt
+        self.backend.publish(self._channel("worker", owner), _pack(header, json.dumps(payload)))
+
+    def member_left(self, party_id: str, user_id: str):
+        if self.distributed:
+            self.backend.publish(self._channel("control"), _pack({"k": "left", "o": self.worker_id, "p": party_id, "u": user_id}))
+
+    def party_closed(self, party_id: str):
+        if self.distributed:
+            self.backend.publish(self._channel("control"), _pack({"k": "closed", "o": self.worker_id, "p": party_id}))
+
+    # --- Presence ---
+
+    def merge_entries(self, local: Dict) -> Dict:
+        """
+        Lobby entries of the whole cluster from this worker's own ones,
+        publishing what changed locally since the last call.
+        """
+        if not self.distributed:
+            return local
+        changes = self._local.update(local)
+        if changes:
+            self._publish_presence(changes)
+        merged: Dict = {}
+        for peer in self._peers.values():
+            merged.update(peer.entries)
+        merged.update(local)
+        return merged
+
+    def _publish_presence(self, changes: Optional[Dict] = None, hello: bool = False):
+        """Publishes local presence changes, or the full local presence when `changes` is None."""
+        self._seq += 1
+        self.counters["presence_out"] += 1
+        header = {"o": self.worker_id, "seq": self._seq}
+        if hello:
+            header["hello"] = True
+        if changes is None:
+            header["full"] = True
+            changes = self._local.snapshot or {}
+        self.backend.publish(self._channel("presence"), _pack(header, json.dumps(changes, separators=(",", ":"))))
+
+    async def _run_presence(self):
+        while True:
+            await asyncio.sleep(PRESENCE_INTERVAL)
+            self._publish_presence()
+            deadline = time.monotonic() - PRESENCE_TIMEOUT
+            for worker_id in [w for w, peer in self._peers.items() if peer.last_seen < deadline]:
+                log.warning("peer_lost", f"Worker {worker_id} sem presença há {PRESENCE_TIMEOUT:.0f}s, removendo",
+                            worker_id=worker_id, timeout=PRESENCE_TIMEOUT)
+                self.counters["peers_lost"] += 1
+                await self._drop_peer(worker_id)
+
+    def _on_presence(self, header: Dict, body: bytes):
+        worker_id = header["o"]
+        if header.get("bye"):
+            asyncio.get_running_loop().create_task(self._drop_peer(worker_id))
+            return
+        self.counters["presence_in"] += 1
+        peer = self._peers.get(worker_id)
+        if peer is None:
+            peer = self._peers[worker_id] = _Peer()
+        peer.last_seen = time.monotonic()
+        data = json.loads(body) if body else {}
+        if header.get("full"):
+            changes = {k: v for k, v in data.items() if peer.entries.get(k) != v}
+            for k in peer.entries.keys() - data.keys():
+                changes[k] = None
+        else:
+            changes = data
+            if header["seq"] != peer.seq + 1:
+                # Missed a delta: ask that worker for its full presence
+                self.backend.publish(self._channel("worker", worker_id), _pack({"k": "presence", "o": self.worker_id}))
+        peer.seq = header["seq"]
+        self._apply(worker_id, peer, changes)
+        if header.get("hello"):
+            self._publish_presence()
+        if changes:
+            self.on_presence()
+
+    def _apply(self, worker_id: str, peer: _Peer, changes: Dict):
+        gone_users = set()
+        for key, value in changes.items():
+            kind, _, ident = key.partition(":")
+            if value is None:
+                peer.entries.pop(key, None)
+                if kind == "party":
+                    if self._party_owner.get(ident) == worker_id:
+                        del self._party_owner[ident]
+                        self.on_party_gone(ident)
+                else:
+                    workers = self._user_workers.get(ident)
+                    if workers is not None:
+                        workers.discard(worker_id)
+                        if not workers:
+                            del self._user_workers[ident]
+                            self._names.pop(ident, None)
+                            gone_users.add(ident)
+            else:
+                peer.entries[key] = value
+                if kind == "party":
+                    self._party_owner[ident] = worker_id
+                else:
+                    self._user_workers.setdefault(ident, set()).add(worker_id)
+                    self._names[ident] = value.get("name", "Unknown")
+        if gone_users and self.on_users_gone is not None:
+            asyncio.get_running_loop().create_task(self.on_users_gone(gone_users))
+
+    async def _drop_peer(self, worker_id: str):
+        peer = self._peers.pop(worker_id, None)
+        if peer is not None:
+            self._apply(worker_id, peer, dict.fromkeys(peer.entries))
+            self.on_presence()
+
+    # --- Incoming ---
+
+    def _on_bus_message(self, channel: str, data: bytes):
+        header, body = _unpack(data)
+        if header.get("o") == self.worker_id:
+            return  # Our own publish, already delivered locally
+        kind = channel[len(self.prefix) + 1:]
+        if kind.startswith("topic:"):
+            self.counters["topic_in"] += 1
+            message = SharedMessage(json.loads(body))
+            message._encoded[JSON_CODEC.name] = (body.decode(), len(body))  # Relayed as received
+            self.deliver(kind[6:], message, set(header.get("x", ())))
+        elif kind == "presence":
+            self._on_presence(header, body)
+        elif kind == "control":
+            if header["k"] == "left":
+                self.on_member_left(header["p"], header["u"])
+            elif header["k"] == "closed" and self._party_owner.get(header["p"]) == header["o"]:
+                del self._party_owner[header["p"]]
+                self.on_party_gone(header["p"])
+        elif header.get("k") == "msg":
+            self._commands.put_nowait((header, body))
+        elif header.get("k") == "presence":
+            self._publish_presence()
+
+    async def _run_commands(self):
+        # One consumer, so a user's forwarded messages are handled in order
+        while True:
+            header, body = await self._commands.get()
+            self.counters["commands"] += 1
+            user_id = header["u"]
+            self._names[user_id] = header.get("n") or self._names.get(user_id, "Unknown")
+            self._user_workers.setdefault(user_id, set()).add(header["o"])
+            try:
+                await self.on_command(header["o"], user_id, header["t"], json.loads(body),
+                                      RemoteClock(header.get("off"), header.get("rtt")))
+            except Exception as e:
+                log.exception("forwarded_command_failed",
+                              f"Erro ao tratar mensagem encaminhada {header['t']} de {user_id}: {e}",
+                              msg_type=header["t"], user_id=user_id, origin=header["o"])
+
+    def stats(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "distributed": self.distributed,
+            "peers": len(self._peers),
+            "remote_parties": len(self._party_owner),
+            "remote_users": len(self._user_workers),
+            **self.counters,
+            "backend": self.backend.stats(),
+        }
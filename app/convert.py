@@ -4,6 +4,12 @@ import json
 from pathlib import Path
 from typing import Optional
 
+from app.metrics import timed_job
+from app.structured_log import get_logger
+
+log = get_logger("convert")
+
+@timed_job("conversion")
 def convert_to_aac(src_path: str, dest_dir: str, bitrate: int = 128) -> Optional[str]:
     """Convert any audio file to AAC (M4A) using ffmpeg for universal compatibility.
     Falls back to MP3 if AAC conversion fails.
@@ -38,25 +44,24 @@ def convert_to_aac(src_path: str, dest_dir: str, bitrate: int = 128) -> Optional
             str(dest_path)
         ]
         
-        print(f"Converting {src_path} to AAC...")
+        log.info("conversion_started", f"Converting {src_path} to AAC...", src=src_path, codec="aac")
         result = subprocess.run(cmd, check=True, capture_output=True, text=True)
         
         # Verify the output file was created and has content
         if dest_path.exists() and dest_path.stat().st_size > 0:
-            print(f"✅ Successfully converted to {dest_path} ({dest_path.stat().st_size} bytes)")
+            log.info("conversion_done", f"✅ Successfully converted to {dest_path} ({dest_path.stat().st_size} bytes)",
+                     dest=str(dest_path), codec="aac", bytes=dest_path.stat().st_size)
             return str(dest_path)
         else:
-            print(f"❌ AAC conversion failed: output file is empty or doesn't exist")
+            log.error("conversion_failed", "❌ AAC conversion failed: output file is empty or doesn't exist", src=src_path, codec="aac")
             
     except subprocess.CalledProcessError as e:
-        print(f"❌ AAC conversion failed: {e}")
-        if e.stderr:
-            print(f"AAC Error details: {e.stderr}")
+        log.error("conversion_failed", f"❌ AAC conversion failed: {e}", src=src_path, codec="aac", stderr=e.stderr)
     except Exception as e:
-        print(f"❌ Unexpected error during AAC conversion: {e}")
+        log.exception("conversion_failed", f"❌ Unexpected error during AAC conversion: {e}", src=src_path, codec="aac")
     
     # If AAC failed, try MP3 as fallback
-    print("🔄 AAC conversion failed, trying MP3 fallback...")
+    log.warning("conversion_fallback", "🔄 AAC conversion failed, trying MP3 fallback...", src=src_path)
     return convert_to_mp3_fallback(src_path, dest_dir, bitrate)
 
 def get_audio_info(file_path: str) -> dict:
@@ -69,7 +74,7 @@ def get_audio_info(file_path: str) -> dict:
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
         return json.loads(result.stdout)
     except Exception as e:
-        print(f"Failed to get audio info: {e}")
+        log.warning("audio_info_failed", f"Failed to get audio info: {e}", path=file_path)
         return {}
 
 # Keep the old function name for backward compatibility
@@ -101,21 +106,20 @@ def convert_to_mp3_fallback(src_path: str, dest_dir: str, bitrate: int = 192) ->
             str(dest_path)
         ]
         
-        print(f"Converting {src_path} to MP3 (fallback)...")
+        log.info("conversion_started", f"Converting {src_path} to MP3 (fallback)...", src=src_path, codec="mp3")
         result = subprocess.run(cmd, check=True, capture_output=True, text=True)
         
         if dest_path.exists() and dest_path.stat().st_size > 0:
-            print(f"✅ Successfully converted to MP3: {dest_path} ({dest_path.stat().st_size} bytes)")
+            log.info("conversion_done", f"✅ Successfully converted to MP3: {dest_path} ({dest_path.stat().st_size} bytes)",
+                     dest=str(dest_path), codec="mp3", bytes=dest_path.stat().st_size)
             return str(dest_path)
         else:
-            print(f"❌ MP3 conversion failed: output file is empty or doesn't exist")
+            log.error("conversion_failed", "❌ MP3 conversion failed: output file is empty or doesn't exist", src=src_path, codec="mp3")
             return None
             
     except subprocess.CalledProcessError as e:
-        print(f"❌ MP3 conversion failed: {e}")
-        if e.stderr:
-            print(f"Error details: {e.stderr}")
+        log.error("conversion_failed", f"❌ MP3 conversion failed: {e}", src=src_path, codec="mp3", stderr=e.stderr)
         return None
     except Exception as e:
-        print(f"❌ Unexpected error during MP3 conversion: {e}")
+        log.exception("conversion_failed", f"❌ Unexpected error during MP3 conversion: {e}", src=src_path, codec="mp3")
         return None
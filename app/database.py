@@ -1,8 +1,20 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from datetime import datetime
+import os
 
-engine = create_engine("sqlite:///./library.db", connect_args={"check_same_thread": False})
+from app.metrics import instrument_engine
+from app.structured_log import get_logger
+
+log = get_logger("database")
+
+# SQLAlchemy URL of the library database
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./library.db")
+# Where uploaded/imported audio files live (served by /stream)
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+instrument_engine(engine) # Query counts/timings for GET /metrics
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -43,7 +55,14 @@ class PlaylistTrack(Base):
     playlist = relationship("Playlist", back_populates="tracks")
     track = relationship("Track")
 
+class SoloStateSnapshot(Base):
+    """Estado solo de um usuário desconectado, descartado da memória (app/solo_states.py)"""
+    __tablename__ = "solo_states"
+    user_id = Column(String, primary_key=True)
+    state = Column(Text, nullable=False)  # JSON de PlayerState.to_snapshot()
+    saved_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
 def init_db():
     """Inicializa o banco de dados criando todas as tabelas"""
     Base.metadata.create_all(bind=engine)
-    print("Banco de dados inicializado com sucesso!")
+    log.info("db_initialized", "Banco de dados inicializado com sucesso!")
@@ -0,0 +1,88 @@
+import os
+from typing import Dict, Optional
+
+# SYNC_DELTAS=0 restores the old behaviour (full snapshot on every sync),
+# handy for comparing bandwidth before/after on a live server.
+SYNC_DELTAS_ENABLED = os.getenv("SYNC_DELTAS", "1") != "0"
+
+_MISSING = object()
+
+# Full-state messages whose payload is the tracked snapshot itself, so a
+# delta can be merged straight into it. (The lobby's state_update is not:
+# it is reshaped into users/parties lists.)
+FLAT_SNAPSHOT_TYPES = {"party_sync", "solo_state_update"}
+
+
+class DeltaTracker:
+    """
+    Remembers the last snapshot published for one state stream (a party or
+    a solo player) and turns each new snapshot into a field-level delta.
+
+    `version` increases by one every time the published state changes, so a
+    client that sees a delta whose `base_version` is not the version it holds
+    knows it missed something and asks for a full snapshot.
+    """
+
+    __slots__ = ("version", "snapshot")
+
+    def __init__(self):
+        self.version: int = 0
+        self.snapshot: Optional[Dict] = None
+
+    def update(self, snapshot: Dict) -> Dict:
+        """Record a new snapshot and return the fields that changed (empty if none)."""
+        previous = self.snapshot
+        if previous is None:
+            changes = dict(snapshot)
+        else:
+            changes = {k: v for k, v in snapshot.items() if previous.get(k, _MISSING) != v}
+            for k in previous.keys() - snapshot.keys():
+                changes[k] = None
+        if changes:
+            self.version += 1
+            self.snapshot = snapshot
+        return changes
+
+    def full_payload(self) -> Dict:
+        payload = dict(self.snapshot or {})
+        payload["version"] = self.version
+        return payload
+
+    def delta_payload(self, changes: Dict, **extra) -> Dict:
+        payload = {
+            "version": self.version,
+            "base_version": self.version - 1,
+            "changes": changes,
+        }
+        payload.update(extra)
+        return payload
+
+
+def merge_state_messages(pending: Dict, new: Dict, full_type: str) -> Optional[Dict]:
+    """
+    Combine an unsent state message with a newer one for the same stream.
+
+    Returns the message that should replace the pending one, or None if they
+    cannot be combined (the newer one must then be queued separately).
+    Never mutates its arguments: messages are shared between recipients.
+    """
+    if new["type"] == full_type:
+        return new
+
+    new_payload = new["payload"]
+    pending_payload = pending["payload"]
+    if new_payload.get("base_version") != pending_payload.get("version"):
+        return None
+
+    if pending["type"] == full_type:
+        if full_type not in FLAT_SNAPSHOT_TYPES:
+            return None
+        merged = dict(pending_payload)
+        merged.update(new_payload["changes"])
+        merged["version"] = new_payload["version"]
+        return {"type": full_type, "payload": merged}
+
+    merged = dict(new_payload)
+    merged["base_version"] = pending_payload["base_version"]
+    merged["changes"] = {**pending_payload["changes"], **new_payload["changes"]}
+    return {"type": new["type"], "payload": merged}
@@ -0,0 +1,73 @@
+import os
+from collections import deque
+from typing import Deque, Dict
+
+from app.metrics import metrics
+from app.sync_telemetry import percentile
+
+# Seconds between server pings on each connection (0 disables heartbeats)
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "15"))
+# A connection that sends nothing (pongs included) for this long is dropped
+HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "45"))
+# Close code for dropped silent connections (4000-4999 are for applications)
+HEARTBEAT_CLOSE_CODE = 4408
+
+# Pong round-trips kept for the percentiles
+HEARTBEAT_RTT_WINDOW = 1024
+# Seconds, for pong round-trips
+RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+pings_sent = metrics.counter("ws_heartbeat_pings_total", "Heartbeat pings sent")
+pongs_received = metrics.counter("ws_heartbeat_pongs_total", "Heartbeat pongs received")
+zombie_disconnects = metrics.counter("ws_zombie_disconnects_total",
+                                     "Connections dropped for going silent past the heartbeat timeout")
+heartbeat_rtt = metrics.histogram("ws_heartbeat_rtt_seconds", "Round-trip time of heartbeat pings", RTT_BUCKETS)
+pings_sent.inc(0)
+pongs_received.inc(0)
+zombie_disconnects.inc(0)
+
+
+class HeartbeatStats:
+    """
+    Process-wide heartbeat metrics: pings sent, pongs received, round-trip
+    times and zombies, i.e. connections that went silent past their
+    liveness deadline and were reaped. Also exported by GET /metrics.
+    """
+
+    def __init__(self, window: int = HEARTBEAT_RTT_WINDOW):
+        self.pings = 0
+        self.pongs = 0
+        self.zombies_reaped = 0
+        self.rtt: Deque[float] = deque(maxlen=window)
+
+    def record_ping(self):
+        self.pings += 1
+        pings_sent.inc()
+
+    def record_zombie(self):
+        self.zombies_reaped += 1
+        zombie_disconnects.inc()
+
+    def record_pong(self, rtt: float):
+        self.pongs += 1
+        pongs_received.inc()
+        if rtt >= 0:
+            self.rtt.append(rtt)
+            heartbeat_rtt.observe(rtt)
+
+    def stats(self) -> Dict:
+        rtts = sorted(self.rtt)
+        fmt = lambda v: round(v, 4) if v is not None else None
+        return {
+            "interval": HEARTBEAT_INTERVAL,
+            "timeout": HEARTBEAT_TIMEOUT,
+            "pings": self.pings,
+            "pongs": self.pongs,
+            "zombies_reaped": self.zombies_reaped,
+            "rtt_p50": fmt(percentile(rtts, 50)),
+            "rtt_p95": fmt(percentile(rtts, 95)),
+            "rtt_max": fmt(rtts[-1] if rtts else None),
+        }
+
+
+heartbeat_stats = HeartbeatStats()
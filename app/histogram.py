@@ -0,0 +1,62 @@
+from bisect import bisect_left
+from typing import Dict, Optional, Sequence
+
+# Seconds: from a trivial handler (tens of µs) to one stuck on I/O
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Messages queued to connections by one handler
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: constant memory and an O(log buckets) observe(),
+    so it can sit on every message. Buckets are upper bounds (`le`, as in
+    Prometheus), plus an implicit +Inf one; percentiles are estimated as the
+    upper bound of the bucket they fall in (capped at the largest value seen).
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) pairs, ending with +Inf."""
+        total = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            total += n
+            yield bound, total
+
+    def stats(self, scale: float = 1.0, digits: int = 3) -> Dict:
+        """Summary with values multiplied by `scale` (e.g. 1000 for milliseconds)."""
+        fmt = lambda v: None if v is None else round(v * scale, digits)
+        return {
+            "count": self.count,
+            "mean": fmt(self.sum / self.count if self.count else None),
+            "p50": fmt(self.percentile(50)),
+            "p95": fmt(self.percentile(95)),
+            "p99": fmt(self.percentile(99)),
+            "max": fmt(self.max if self.count else None),
+        }
@@ -1,10 +1,15 @@
-import yt_dlp
 import uuid
 from pathlib import Path
 from app.convert import convert_to_aac
-from app.database import SessionLocal, Track
+from app.database import SessionLocal, Track, MEDIA_DIR
+from app.metrics import timed_job
+from app.structured_log import get_logger
+from app.track_cache import track_cache
 
+log = get_logger("importer")
 
+
+@timed_job("import")
 def import_from_youtube(url: str) -> Track:
     """
     Importa uma track do YouTube usando yt-dlp, converte para AAC e salva no banco de dados.
@@ -18,8 +23,10 @@ def import_from_youtube(url: str) -> Track:
     Raises:
         Exception: Se falhar no download, conversão ou salvamento
     """
-    temp_dir = Path("media/temp")
-    temp_dir.mkdir(exist_ok=True)
+    import yt_dlp  # Heavy import (hundreds of modules): loaded by the first import job, not at server startup
+
+    temp_dir = Path(MEDIA_DIR) / "temp"
+    temp_dir.mkdir(parents=True, exist_ok=True)
     
     # Gerar nome único para arquivo temporário
     temp_filename = f"{uuid.uuid4()}"
@@ -53,7 +60,7 @@ def import_from_youtube(url: str) -> Track:
                 actual_temp_file = actual_temp_files[0]
         
         # Converter para AAC
-        converted_path = convert_to_aac(str(actual_temp_file), "media")
+        converted_path = convert_to_aac(str(actual_temp_file), MEDIA_DIR)
         if not converted_path:
             raise Exception("Falha na conversão para AAC")
         
@@ -71,6 +78,7 @@ def import_from_youtube(url: str) -> Track:
             db.add(track)
             db.commit()
             db.refresh(track)
+            track_cache.put(track) # Replaces a cached "missing" answer for this id
             return track
         finally:
             db.close()
@@ -81,4 +89,4 @@ def import_from_youtube(url: str) -> Track:
             try:
                 temp_file.unlink()
             except Exception as e:
-                print(f"Erro ao remover arquivo temporário {temp_file}: {e}")
+                log.warning("temp_cleanup_failed", f"Erro ao remover arquivo temporário {temp_file}: {e}", path=str(temp_file))
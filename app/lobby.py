@@ -0,0 +1,77 @@
+import asyncio
+import os
+from typing import Callable, Dict, Optional
+
+from app.delta_sync import DeltaTracker
+from app.profiling import profiler
+
+# Lobby updates are flushed at most once per interval (milliseconds)
+LOBBY_FLUSH_INTERVAL = float(os.getenv("LOBBY_FLUSH_INTERVAL_MS", "250")) / 1000
+
+
+class LobbyBroadcaster:
+    """
+    Rate-limited, coalesced lobby (`state_update`) broadcasts.
+
+    Events only call `mark_dirty()`. At most once per interval the lobby is
+    rebuilt a single time and published as a delta against the previous
+    flush, so N events between flushes cost one snapshot instead of N full
+    broadcasts to every client.
+
+    The lobby is kept as a flat mapping of "user:<id>" / "party:<id>" keys,
+    which is what the deltas carry (a value of None means removed).
+    """
+
+    def __init__(self, build_entries: Callable[[], Dict], publish: Callable[[dict], None],
+                 interval: float = LOBBY_FLUSH_INTERVAL):
+        self.build_entries = build_entries
+        self.publish = publish
+        self.interval = interval
+        self.tracker = DeltaTracker()
+        self.requests = 0
+        self.flushes = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._last_flush = float("-inf")
+
+    def mark_dirty(self):
+        self.requests += 1
+        if self._handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, self._last_flush + self.interval - loop.time())
+        self._handle = loop.call_later(delay, self.flush)
+
+    @profiler.profiled("lobby flush") # What broadcast_state_update() costs ends up here
+    def flush(self):
+        self._handle = None
+        self._last_flush = asyncio.get_running_loop().time()
+        self.flushes += 1
+        changes = self.tracker.update(self.build_entries())
+        if changes:
+            self.publish({
+                "type": "state_update_delta",
+                "payload": self.tracker.delta_payload(changes),
+            })
+
+    def snapshot_message(self) -> dict:
+        """
+        Full lobby as of the last flush, for clients that just connected or
+        reported a gap. Later deltas apply on top of its version.
+        """
+        entries = self.tracker.snapshot or {}
+        users = []
+        parties = []
+        for key, value in entries.items():
+            (users if key.startswith("user:") else parties).append(value)
+        return {
+            "type": "state_update",
+            "payload": {"users": users, "parties": parties, "version": self.tracker.version},
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "version": self.tracker.version,
+            "requests": self.requests,
+            "flushes": self.flushes,
+            "interval_ms": round(self.interval * 1000),
+        }
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Deque, Dict, Optional
+
+from app.metrics import metrics
+from app.structured_log import get_logger
+
+log = get_logger("loop_watchdog")
+
+# A callback holding the event loop longer than this gets its stack captured
+# (milliseconds). 0 (the default) turns the watchdog off: meant for staging.
+LOOP_WATCHDOG_THRESHOLD_MS = float(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", "0"))
+# Stalls kept for GET /stats/loop
+LOOP_WATCHDOG_HISTORY = int(os.getenv("LOOP_WATCHDOG_HISTORY", "50"))
+# Innermost frames kept per captured stack
+LOOP_WATCHDOG_STACK_DEPTH = 40
+
+stalls_total = metrics.counter("event_loop_stalls_total", "Event loop stalls past LOOP_WATCHDOG_THRESHOLD_MS")
+
+
+class LoopWatchdog:
+    """
+    Detects callbacks that block the event loop and shows what they were.
+
+    The loop re-arms a tick every `threshold / 2`; a side thread checks how
+    long ago the last tick ran. Past the threshold the loop is stuck in one
+    callback, so the thread grabs the loop thread's current stack (it is
+    the blocking code, still running) along with the tag of the task
+    running it: the WebSocket message type or HTTP route, set through
+    tag(). The stall's total duration is filled in once the loop ticks
+    again. Stalls are logged and kept for GET /stats/loop.
+    """
+
+    def __init__(self, threshold: float, history: int = LOOP_WATCHDOG_HISTORY):
+        self.threshold = threshold
+        self.enabled = threshold > 0
+        self.interval = threshold / 2
+        self.stalls: Deque[Dict] = deque(maxlen=history)
+        self._tags: Dict[asyncio.Task, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_tick = time.monotonic()
+        self._pending: Optional[Dict] = None  # Stall captured, loop not back yet
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.max_lag = 0.0
+
+    def start(self):
+        """Called from the running loop (app startup)."""
+        if not self.enabled or self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._loop.call_later(self.interval, self._tick)
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        log.info("watchdog_started", f"🐶 Watchdog do event loop ativo (limite {self.threshold * 1000:.0f}ms)",
+                 threshold_ms=round(self.threshold * 1000))
+
+    def stop(self):
+        self._stop.set()
+
+    @contextmanager
+    def _tagged(self, task: asyncio.Task, tag: str):
+        previous = self._tags.get(task)
+        self._tags[task] = tag
+        try:
+            yield
+        finally:
+            if previous is None:
+                self._tags.pop(task, None)
+            else:
+                self._tags[task] = previous
+
+    def tag(self, tag: str):
+        """Labels whatever the current task runs inside the block (no-op when disabled)."""
+        if not self.enabled:
+            return nullcontext()
+        task = asyncio.current_task()
+        return self._tagged(task, tag) if task is not None else nullcontext()
+
+    # --- Loop side ---
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = now - self._last_tick - self.interval
+        if lag > self.max_lag:
+            self.max_lag = lag
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            pending["duration_ms"] = round((now - pending["_since"]) * 1000, 1)
+            del pending["_since"]
+            log.warning("loop_unblocked",
+                        f"🐶 Event loop liberado após {pending['duration_ms']:.0f}ms ({pending['tag'] or 'sem tag'})",
+                        duration_ms=pending["duration_ms"], tag=pending["tag"])
+        self._last_tick = now
+        self._loop.call_later(self.interval, self._tick)
+
+    # --- Watchdog thread ---
+
+    def _watch(self):
+        captured_tick = None
+        while not self._stop.wait(self.interval / 2):
+            last_tick = self._last_tick
+            blocked = time.monotonic() - last_tick - self.interval
+            if blocked < self.threshold or captured_tick == last_tick:
+                continue
+            captured_tick = last_tick  # One capture per stall
+            self._capture(last_tick + self.interval, blocked)
+
+    def _capture(self, since: float, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_stack(frame, limit=LOOP_WATCHDOG_STACK_DEPTH) if frame is not None else []
+        task = asyncio.current_task(self._loop)
+        stall = {
+            "at": time.time(),
+            "tag": self._tags.get(task) if task is not None else None,
+            "task": task.get_name() if task is not None else None,
+            "blocked_ms_at_capture": round(blocked * 1000, 1),
+            "duration_ms": None,  # Filled in when the loop runs again
+            "stack": [line.rstrip() for line in stack],
+            "_since": since,
+        }
+        self._pending = stall
+        self.stalls.append(stall)
+        stalls_total.inc()
+        log.warning("loop_blocked", f"🐶 Event loop bloqueado há {blocked * 1000:.0f}ms ({stall['tag'] or 'sem tag'}):\n"
+                    + "".join(stack[-8:]).rstrip(), blocked_ms=round(blocked * 1000), tag=stall["tag"])
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "stalls": int(stalls_total.value()),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "recent": [{k: v for k, v in stall.items() if not k.startswith("_")} for stall in reversed(self.stalls)],
+        }
+
+
+class WatchdogTagMiddleware:
+    """ASGI middleware tagging each HTTP request / WebSocket task with its method and path."""
+
+    def __init__(self, app, watchdog: LoopWatchdog):
+        self.app = app
+        self.watchdog = watchdog
+
+    async def __call__(self, scope, receive, send):
+        if not self.watchdog.enabled or scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        with self.watchdog.tag(f"{scope.get('method', 'WS')} {scope['path']}"):
+            await self.app(scope, receive, send)
+
+
+loop_watchdog = LoopWatchdog(LOOP_WATCHDOG_THRESHOLD_MS / 1000)
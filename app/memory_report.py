@@ -0,0 +1,83 @@
+import os
+import sys
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, Optional
+
+# Items measured per collection; larger collections are extrapolated
+MEMORY_SAMPLE_SIZE = int(os.getenv("MEMORY_SAMPLE_SIZE", "200"))
+
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+
+
+def _owned(obj) -> bool:
+    """Objects whose attributes are followed: our own classes only, not asyncio/starlette internals."""
+    module = type(obj).__module__
+    return module in ("main", "__main__") or module.startswith("app.")
+
+
+def _slot_values(obj):
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name not in ("__dict__", "__weakref__") and hasattr(obj, name):
+                yield getattr(obj, name)
+
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """
+    Approximate bytes reachable from `obj`, each object counted once.
+    Follows builtin containers (deques included) and the attributes of the
+    app's own classes; anything else is counted shallowly.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, _CONTAINERS):
+            stack.extend(obj)
+        elif _owned(obj):
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            stack.extend(_slot_values(obj))
+    return total
+
+
+def measure(items: Iterable, count: int, sample: int = MEMORY_SAMPLE_SIZE) -> Dict:
+    """Size of a collection of `count` items, extrapolated from the first `sample` of them."""
+    measured = 0
+    seen: set = set()
+    taken = 0
+    for item in islice(items, sample):
+        measured += deep_sizeof(item, seen)
+        taken += 1
+    approx = measured * count // taken if taken else 0
+    return {"count": count, "approx_bytes": approx, "sampled": taken}
+
+
+def process_memory() -> Dict:
+    """Resident set size and its peak, in bytes (None where unavailable)."""
+    rss = peak = None
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak *= 1 if sys.platform == "darwin" else 1024
+        except ImportError:
+            pass
+    return {"rss_bytes": rss, "peak_rss_bytes": peak}
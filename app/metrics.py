@@ -0,0 +1,297 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.histogram import LATENCY_BUCKETS, Histogram
+
+# Prefix of every metric name
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "torbware")
+# How often the event loop is probed for lag, in seconds (0 disables the probe)
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+# Seconds, for jobs that shell out (ffmpeg, yt-dlp)
+JOB_BUCKETS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 600)
+# Seconds the event loop was late
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[str, ...]
+# One metric family as rendered: (name, type, help, [(sample suffix, labels, value)])
+Family = Tuple[str, str, str, List[Tuple[str, Dict[str, str], float]]]
+
+
+class Counter:
+    """
+    Monotonic counter, optionally labelled. inc() is a dict update under an
+    uncontended lock, cheap enough for hot paths on the event loop and safe
+    from the threadpool (sync endpoints, /stream bodies); code that counts
+    per chunk still batches its increments (see stream_meter).
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, labels: Labels = ()):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self.values.get(labels, 0)
+
+    def collect(self) -> Family:
+        with self._lock:
+            values = list(self.values.items())
+        return self.name, self.kind, self.help, [
+            ("", dict(zip(self.labelnames, labels)), value) for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, or is read from `fn` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable] = None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, value: float, labels: Labels = ()):
+        with self._lock:
+            self.values[labels] = value
+
+    def dec(self, amount: float = 1, labels: Labels = ()):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) - amount
+
+    def collect(self) -> Family:
+        if self.fn is not None:
+            value = self.fn()
+            values = value if isinstance(value, dict) else {(): value}
+            return self.name, self.kind, self.help, [
+                ("", dict(zip(self.labelnames, labels)), v) for labels, v in values.items()
+            ]
+        return super().collect()
+
+
+class HistogramMetric:
+    """Fixed-bucket histogram (app/histogram.py) per label set; observe() locks like Counter.inc()."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, bounds: Sequence[float] = LATENCY_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(bounds)
+        self.labelnames = tuple(labelnames)
+        self.histograms: Dict[Labels, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Labels = ()):
+        with self._lock:
+            histogram = self.histograms.get(labels)
+            if histogram is None:
+                histogram = self.histograms[labels] = Histogram(self.bounds)
+            histogram.observe(value)
+
+    def collect(self) -> Family:
+        samples = []
+        with self._lock:
+            for labels, histogram in self.histograms.items():
+                samples.extend(histogram_samples(histogram, dict(zip(self.labelnames, labels))))
+        return self.name, self.kind, self.help, samples
+
+
+def histogram_samples(histogram: Histogram, labels: Dict[str, str]):
+    for bound, count in histogram.cumulative():
+        yield "_bucket", {**labels, "le": _format_value(bound)}, count
+    yield "_sum", labels, histogram.sum
+    yield "_count", labels, histogram.count
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in the Prometheus text format (version 0.0.4) by
+    GET /metrics. Besides registered metrics, collectors (functions
+    returning families) read state other modules already keep, at scrape
+    time only.
+    """
+
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self.metrics = []
+        self.collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _add(self, metric):
+        metric.name = f"{self.prefix}_{metric.name}"
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable] = None) -> Gauge:
+        return self._add(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, bounds: Sequence[float] = LATENCY_BUCKETS,
+                  labelnames: Sequence[str] = ()) -> HistogramMetric:
+        return self._add(HistogramMetric(name, help, bounds, labelnames))
+
+    def collector(self, fn: Callable[[], Iterable[Family]]):
+        """Registers fn; the names of the families it returns get the prefix too."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        """
+        A metric or collector that raises (e.g. a gauge function reading
+        state that changed under it) is logged and left out of this scrape
+        instead of failing the whole response.
+        """
+        out = []
+        families = []
+        for metric in self.metrics:
+            try:
+                families.append(metric.collect())
+            except Exception as e:
+                _collect_failed(metric.name, e)
+        for collector in self.collectors:
+            try:
+                families.extend((f"{self.prefix}_{name}", *rest) for name, *rest in collector())
+            except Exception as e:
+                _collect_failed(getattr(collector, "__name__", repr(collector)), e)
+        for name, kind, help, samples in families:
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                if labels:
+                    label_text = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+                    out.append(f"{name}{suffix}{{{label_text}}} {_format_value(value)}")
+                else:
+                    out.append(f"{name}{suffix} {_format_value(value)}")
+        out.append("")
+        return "\n".join(out)
+
+
+def _collect_failed(source: str, error: Exception):
+    from app.structured_log import get_logger  # Imports this module: not at the top
+
+    get_logger("metrics").exception("metrics_collector_failed",
+                                    f"Erro ao coletar métricas ({source}): {error}", collector=source)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+metrics = MetricsRegistry()
+
+# --- Instruments shared by several modules ---
+
+# /stream (responses are iterated in Starlette's threadpool)
+stream_requests = metrics.counter("stream_requests_total", "Requests to /stream by kind (full file or byte range)", ["kind"])
+stream_bytes = metrics.counter("stream_bytes_total", "Bytes sent by /stream responses")
+stream_active = metrics.gauge("stream_active_responses", "/stream responses currently being sent")
+stream_bytes.inc(0)
+stream_active.set(0)
+STREAM_FLUSH_BYTES = 256 * 1024  # Bytes counted locally before being added to stream_bytes
+
+
+def stream_meter(chunks: Iterable[bytes]):
+    """Wraps a /stream body iterator: counts bytes and open responses (batched per STREAM_FLUSH_BYTES)."""
+    stream_active.inc()
+    pending = 0
+    try:
+        for chunk in chunks:
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_BYTES:
+                stream_bytes.inc(pending)
+                pending = 0
+            yield chunk
+    finally:
+        stream_bytes.inc(pending)
+        stream_active.dec()
+
+
+# Conversions (ffmpeg) and imports (yt-dlp)
+job_in_progress = metrics.gauge("jobs_in_progress", "Conversion/import jobs running or waiting", ["job"])
+job_duration = metrics.histogram("job_duration_seconds", "Duration of conversion/import jobs", JOB_BUCKETS, ["job"])
+job_results = metrics.counter("jobs_total", "Finished conversion/import jobs by outcome", ["job", "outcome"])
+
+
+def timed_job(job: str):
+    """
+    Decorator for a conversion/import function: in-progress gauge, duration
+    and outcome (a raised exception or a None result count as failures).
+    """
+    labels = (job,)
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            job_in_progress.inc(labels=labels)
+            started = time.perf_counter()
+            outcome = "failure"
+            try:
+                result = fn(*args, **kwargs)
+                if result is not None:
+                    outcome = "success"
+                return result
+            finally:
+                job_in_progress.dec(labels=labels)
+                job_duration.observe(time.perf_counter() - started, labels)
+                job_results.inc(labels=(job, outcome))
+        return wrapper
+    return decorate
+
+
+# SQLite (SQLAlchemy engine events)
+db_queries = metrics.histogram("db_query_seconds", "SQLite statement execution time by statement kind",
+                               labelnames=["statement"])
+
+
+def instrument_engine(engine):
+    """Times every statement the engine runs (also from sync endpoints, in threads)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is not None:
+            kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+            db_queries.observe(time.perf_counter() - started, (kind,))
+
+
+# Event loop
+loop_lag = metrics.histogram("event_loop_lag_seconds", "How late the event loop woke up a periodic probe", LAG_BUCKETS)
+loop_lag_last = metrics.gauge("event_loop_lag_last_seconds", "Event loop lag measured by the last probe")
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Sleeps `interval` in a loop; anything beyond it is time the loop was busy elsewhere."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
@@ -0,0 +1,326 @@
+import asyncio
+import os
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app.clock_sync import ClockEstimator, server_now
+from app.delta_sync import merge_state_messages
+from app.heartbeat import HEARTBEAT_CLOSE_CODE, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, heartbeat_stats
+from app.histogram import LATENCY_BUCKETS
+from app.metrics import metrics
+from app.structured_log import get_logger
+from app.timer_wheel import Timer, timer_wheel
+from app.wire import JSON_CODEC, decode_frame
+
+log = get_logger("outbound")
+
+# State messages, grouped by the stream they describe. A newer message on a
+# stream replaces (or, for deltas, is merged into) an unsent older one, so a
+# slow client only ever receives the latest state.
+COALESCE_KEYS = {
+    "party_sync": "party_state",
+    "party_sync_delta": "party_state",
+    "solo_state_update": "solo_state",
+    "solo_state_delta": "solo_state",
+    "state_update": "lobby_state",
+    "state_update_delta": "lobby_state",
+}
+# Full-snapshot message type of each stream, used when merging deltas
+FULL_STATE_TYPES = {
+    "party_state": "party_sync",
+    "solo_state": "solo_state_update",
+    "lobby_state": "state_update",
+}
+
+# Set by the message router while a handler runs: a one-element list that
+# counts the messages queued to connections (the handler's fan-out)
+fanout_counter: ContextVar[Optional[List[int]]] = ContextVar("fanout_counter", default=None)
+
+# Totals over all connections, for GET /metrics
+messages_sent = metrics.counter("ws_messages_sent_total", "WebSocket messages written, by type", ["type"])
+bytes_sent = metrics.counter("ws_bytes_sent_total", "WebSocket bytes written, by message type", ["type"])
+queue_wait = metrics.histogram("ws_outbound_queue_wait_seconds",
+                               "Time from a message being queued (first, if coalesced) to its socket write", LATENCY_BUCKETS)
+slow_disconnects = metrics.counter("ws_slow_client_disconnects_total",
+                                   "Connections dropped for not keeping up with their outbound queue, by limit hit",
+                                   ["limit"])
+
+
+
+class SharedMessage(dict):
+    """
+    A message fanned out to many connections. It is encoded once per wire
+    encoding, by the first writer that sends it, and the result (with its
+    size in bytes) is reused for every recipient. Must not be mutated after
+    it is queued.
+    """
+
+    __slots__ = ("_encoded",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._encoded = {}
+
+
+def frame_size(data: str | bytes) -> int:
+    """Bytes on the wire of an encoded frame (text frames are UTF-8)."""
+    if isinstance(data, bytes) or data.isascii(): # isascii() is O(1) on str
+        return len(data)
+    return len(data.encode("utf-8"))
+
+
+def encode_frame(message: dict, codec=JSON_CODEC) -> Tuple[str | bytes, int]:
+    """(encoded message, its size in bytes), computed once per codec for a SharedMessage."""
+    if isinstance(message, SharedMessage):
+        frame = message._encoded.get(codec.name)
+        if frame is None:
+            data = codec.encode(message)
+            frame = message._encoded[codec.name] = (data, frame_size(data))
+        return frame
+    data = codec.encode(message)
+    return data, frame_size(data)
+
+
+def encode_message(message: dict, codec=JSON_CODEC) -> str | bytes:
+    return encode_frame(message, codec)[0]
+
+
+# Soft limit: a client may sit above it for SLOW_CLIENT_GRACE seconds before
+# being disconnected. Hard limit: disconnect immediately (bounds memory).
+OUTBOUND_QUEUE_LIMIT = int(os.getenv("WS_OUTBOUND_QUEUE_LIMIT", "256"))
+OUTBOUND_QUEUE_HARD_LIMIT = int(os.getenv("WS_OUTBOUND_QUEUE_HARD_LIMIT", str(OUTBOUND_QUEUE_LIMIT * 4)))
+SLOW_CLIENT_GRACE = float(os.getenv("WS_SLOW_CLIENT_GRACE", "10"))
+
+# Close code sent to clients dropped for not keeping up (1013 = try again later)
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+
+class Connection:
+    """
+    A WebSocket plus its bounded outbound queue and writer task.
+
+    Handlers call `send()`, which only enqueues; the writer task owned by
+    the connection does the actual socket write. A slow or stalled client
+    therefore only backs up its own queue.
+
+    Liveness: the server pings every `heartbeat_interval` seconds and any
+    inbound message (pongs included) counts as a sign of life. A connection
+    silent for `heartbeat_timeout` is aborted, which wakes the receive loop
+    with WebSocketDisconnect so the normal leave/cleanup path runs.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, codec=JSON_CODEC,
+                 limit: int = OUTBOUND_QUEUE_LIMIT,
+                 hard_limit: int = OUTBOUND_QUEUE_HARD_LIMIT,
+                 grace: float = SLOW_CLIENT_GRACE,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 heartbeat_timeout: float = HEARTBEAT_TIMEOUT):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.codec = codec
+        self.limit = limit
+        self.hard_limit = hard_limit
+        self.grace = grace
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+
+        # Entries are [coalesce_key, message, queued_at] lists so a pending entry can be
+        # replaced in place without losing its position in the queue.
+        self._queue: Deque[List] = deque()
+        self._pending_by_key: Dict[str, List] = {}
+        self._wakeup = asyncio.Event()
+        self._closed = asyncio.get_running_loop().create_future()
+        self._writer: Optional[asyncio.Task] = None
+
+        self.clock = ClockEstimator()
+        self.over_limit_since: float | None = None
+        self.close_reason: str | None = None
+        self.close_code: int | None = None
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.rtt: float | None = None # Last heartbeat round-trip
+        self._heartbeat: Optional[Timer] = None
+        self.sent = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.bytes_sent = 0
+        self.bytes_by_type: Dict[str, int] = defaultdict(int)
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.done()
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+        if self.heartbeat_interval > 0:
+            self._heartbeat = timer_wheel.call_later(self.heartbeat_interval, self._beat)
+
+    def _beat(self):
+        """Heartbeat timer: drops the connection past its deadline, otherwise pings."""
+        self._heartbeat = None
+        if self.closed:
+            return
+        silent = time.monotonic() - self.last_seen
+        remaining = self.heartbeat_timeout - silent
+        if remaining <= 0:
+            heartbeat_stats.record_zombie()
+            self.abort(f"no messages for {silent:.0f}s", code=HEARTBEAT_CLOSE_CODE)
+            return
+        self.send({"type": "ping", "payload": {"t": server_now(), "interval": self.heartbeat_interval}})
+        heartbeat_stats.record_ping()
+        self._heartbeat = timer_wheel.call_later(min(self.heartbeat_interval, remaining), self._beat)
+
+    def record_pong(self, sent_at):
+        """A `pong` echoing the `t` of one of our pings."""
+        if isinstance(sent_at, (int, float)):
+            self.rtt = server_now() - sent_at
+            heartbeat_stats.record_pong(self.rtt)
+
+    def send(self, message: dict):
+        """Enqueue a message for this client. Never blocks."""
+        if self.closed:
+            return
+        counter = fanout_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+        key = COALESCE_KEYS.get(message.get("type"))
+        if key is not None:
+            pending = self._pending_by_key.get(key)
+            if pending is not None:
+                merged = merge_state_messages(pending[1], message, FULL_STATE_TYPES[key])
+                if merged is not None:
+                    pending[1] = merged
+                    self.coalesced += 1
+                    return
+            entry = [key, message, time.perf_counter()]
+            self._pending_by_key[key] = entry
+        else:
+            entry = [None, message, time.perf_counter()]
+
+        self._queue.append(entry)
+        depth = len(self._queue)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        self._wakeup.set()
+        self._check_backpressure(depth)
+
+    def _check_backpressure(self, depth: int):
+        if depth >= self.hard_limit:
+            slow_disconnects.inc(labels=("hard",))
+            self.abort(f"outbound queue hit hard limit ({depth})")
+        elif depth > self.limit:
+            now = time.monotonic()
+            if self.over_limit_since is None:
+                self.over_limit_since = now
+            elif now - self.over_limit_since > self.grace:
+                slow_disconnects.inc(labels=("soft",))
+                self.abort(f"outbound queue over limit for {now - self.over_limit_since:.1f}s")
+
+    async def _run(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                entry = self._queue.popleft()
+                key, message, queued_at = entry
+                if key is not None and self._pending_by_key.get(key) is entry:
+                    del self._pending_by_key[key]
+                data, size = encode_frame(message, self.codec)
+                if self.codec.binary:
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+                self.sent += 1
+                self.bytes_sent += size
+                self.bytes_by_type[message.get("type")] += size
+                labels = (message.get("type"),)
+                messages_sent.inc(1, labels)
+                bytes_sent.inc(size, labels)
+                queue_wait.observe(time.perf_counter() - queued_at)
+                if self.over_limit_since is not None and len(self._queue) <= self.limit:
+                    self.over_limit_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Socket is gone; let the receive loop run the normal cleanup path
+            self._mark_closed(f"send failed: {e}")
+
+    def _mark_closed(self, reason: str):
+        if not self._closed.done():
+            self.close_reason = reason
+            self._closed.set_result(reason)
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        self._queue.clear()
+        self._pending_by_key.clear()
+
+    def abort(self, reason: str, code: int = SLOW_CLIENT_CLOSE_CODE):
+        """Drop the client: stop writing and close the socket in the background."""
+        if self.closed:
+            return
+        log.warning("connection_dropped", f"⚠️ Dropping connection {self.user_id}: {reason}",
+                    user_id=self.user_id, reason=reason, code=code)
+        self.close_code = code
+        self._mark_closed(reason)
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=5)
+        except Exception:
+            pass
+
+    async def receive_message(self):
+        """
+        Receive and decode the next message (text frames are JSON, binary
+        frames MessagePack), or raise WebSocketDisconnect as soon as the
+        connection is aborted (a stalled peer may never answer the close).
+        Undecodable frames raise MessageDecodeError.
+        """
+        receive = asyncio.ensure_future(self.websocket.receive())
+        await asyncio.wait({receive, self._closed}, return_when=asyncio.FIRST_COMPLETED)
+        if not receive.done():
+            receive.cancel()
+            raise WebSocketDisconnect(code=self.close_code or SLOW_CLIENT_CLOSE_CODE, reason=self.close_reason)
+        message = receive.result()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(code=message.get("code", 1000), reason=message.get("reason"))
+        self.last_seen = time.monotonic()
+        return decode_frame(message)
+
+    def close(self):
+        """Stop the writer task. Called once the client is gone."""
+        self._mark_closed(self.close_reason or "closed")
+        if self._writer:
+            self._writer.cancel()
+
+    def stats(self) -> dict:
+        connected_for = time.monotonic() - self.connected_at
+        return {
+            "user_id": self.user_id,
+            "encoding": self.codec.name,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_minute": round(self.bytes_sent * 60 / connected_for) if connected_for > 0 else 0,
+            "bytes_by_type": dict(self.bytes_by_type),
+            "over_limit_for": round(time.monotonic() - self.over_limit_since, 3)
+                              if self.over_limit_since is not None else 0.0,
+            "silent_for": round(time.monotonic() - self.last_seen, 3),
+            "rtt": round(self.rtt, 4) if self.rtt is not None else None,
+        }
@@ -0,0 +1,291 @@
+import asyncio
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+
+from app.structured_log import get_logger
+
+log = get_logger("profiling")
+
+# Profiling mode, switchable at runtime (POST /admin/profiling or SIGUSR2)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# Fraction of HTTP requests / WebSocket messages profiled while enabled
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.05"))
+# Stack sampling period of the profiler thread (milliseconds)
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+# Distinct stacks kept per endpoint / message type; further ones are counted as "[other]"
+PROFILING_MAX_STACKS = 5000
+PROFILING_MAX_DEPTH = 64
+
+_THIS_FILE = os.path.abspath(__file__)
+
+
+class _Unit:
+    """One profiled request or message. HTTP keys use the route template once routing has set it."""
+
+    __slots__ = ("key", "scope")
+
+    def __init__(self, key: str, scope: Optional[Dict] = None):
+        self.key = key
+        self.scope = scope
+
+    def name(self) -> str:
+        route = self.scope.get("route") if self.scope is not None else None
+        path = getattr(route, "path", None)
+        return f"{self.key} {path}" if path else self.key
+
+
+# The unit the current task (and worker threads it hands work to) belongs to
+_current_unit: ContextVar[Optional[_Unit]] = ContextVar("profiling_unit", default=None)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a fraction of requests and messages.
+
+    While enabled, each HTTP request / WebSocket message is picked with
+    probability `rate`. A picked one registers the asyncio task running it
+    (or, for sync endpoints and stream bodies, the worker thread); a
+    profiler thread then samples the stacks of registered tasks/threads
+    every `interval` seconds. Nothing else is touched, so the cost outside
+    the picked units is one random() per unit, and none when disabled.
+
+    Samples are aggregated per endpoint (route template) and msg_type as
+    folded stacks ("frame;frame;frame count"), the input of flamegraph.pl,
+    speedscope and similar.
+    """
+
+    def __init__(self, enabled: bool = PROFILING_ENABLED, rate: float = PROFILING_SAMPLE_RATE,
+                 interval: float = PROFILING_INTERVAL_MS / 1000):
+        self.enabled = False
+        self.rate = rate
+        self.interval = interval
+        self.profiles: Dict[str, Counter] = {}
+        self.units: Counter = Counter()  # Profiled units per key
+        self.samples = 0
+        self._tasks: Dict[asyncio.Task, _Unit] = {}
+        self._threads: Dict[int, _Unit] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._generation = 0  # A thread from before a quick off/on exits instead of sampling twice
+        self._lock = threading.Lock()
+        self._start_enabled = enabled
+
+    # --- Control ---
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Called from the running loop at startup."""
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        if self._start_enabled:
+            self.enable()
+
+    def enable(self, rate: Optional[float] = None, interval: Optional[float] = None):
+        if rate is not None:
+            self.rate = min(max(rate, 0.0), 1.0)
+        if interval is not None:
+            self.interval = max(interval, 0.001)
+        if self.enabled:
+            return
+        self.enabled = True
+        self._generation += 1
+        self._thread = threading.Thread(target=self._run, args=(self._generation,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+        log.info("profiling_enabled",
+                 f"🔬 Profiling ligado ({self.rate:.0%} das requisições/mensagens, amostra a cada {self.interval * 1000:.0f}ms)",
+                 rate=self.rate, interval_ms=round(self.interval * 1000, 2))
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False  # The thread exits at its next wakeup
+            log.info("profiling_disabled", f"🔬 Profiling desligado ({self.samples} amostras)", samples=self.samples)
+
+    def toggle(self):
+        self.disable() if self.enabled else self.enable()
+
+    def reset(self):
+        with self._lock:
+            self.profiles.clear()
+            self.units.clear()
+            self.samples = 0
+
+    # --- Units ---
+
+    def _pick(self) -> bool:
+        return self.enabled and self._loop is not None and random.random() < self.rate
+
+    @contextmanager
+    def _profiled_task(self, unit: _Unit):
+        task = asyncio.current_task() # None for plain loop callbacks (call_later)
+        token = _current_unit.set(unit)
+        self._tasks[task] = unit
+        try:
+            yield
+        finally:
+            self._tasks.pop(task, None)
+            _current_unit.reset(token)
+            name = unit.name()
+            with self._lock: # stats() iterates units from the threadpool
+                self.units[name] += 1
+
+    def unit(self, key: str, scope: Optional[Dict] = None):
+        """
+        Profiles the block (on the event loop) when this unit gets sampled.
+        Inside another profiled unit it is a no-op: the time stays with the
+        request or message that caused it.
+        """
+        if not self._pick() or _current_unit.get() is not None:
+            return nullcontext()
+        return self._profiled_task(_Unit(key, scope))
+
+    def profiled(self, key: str):
+        """
+        Decorator for work started outside any request or message (timers,
+        loop callbacks), so it gets its own profile under `key`.
+        """
+        def decorate(fn):
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.unit(key):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.unit(key):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    @contextmanager
+    def _profiled_thread(self, unit: _Unit):
+        ident = threading.get_ident()
+        self._threads[ident] = unit
+        try:
+            yield
+        finally:
+            self._threads.pop(ident, None)
+
+    def thread(self):
+        """
+        Profiles the block in a worker thread if the request that handed
+        the work over is being profiled (contextvars follow run_in_threadpool).
+        """
+        unit = _current_unit.get()
+        if unit is None or threading.get_ident() == self._loop_thread_id:
+            return nullcontext()
+        return self._profiled_thread(unit)
+
+    def wrap_iterator(self, chunks: Iterable):
+        """Stream bodies are iterated in worker threads, one next() at a time."""
+        unit = _current_unit.get()
+        if unit is None:
+            yield from chunks
+            return
+        iterator = iter(chunks)
+        while True:
+            with self._profiled_thread(unit):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+
+    def instrument_routes(self, app):
+        """Wraps sync endpoints so the worker thread running a profiled request is sampled too."""
+        for route in app.routes:
+            dependant = getattr(route, "dependant", None)
+            if dependant is None or dependant.call is None or asyncio.iscoroutinefunction(dependant.call):
+                continue
+            dependant.call = self._threaded_endpoint(dependant.call)
+
+    def _threaded_endpoint(self, endpoint):
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            with self.thread():
+                return endpoint(*args, **kwargs)
+        return wrapper
+
+    # --- Sampling thread ---
+
+    def _run(self, generation: int):
+        while self.enabled and generation == self._generation:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            picked = []
+            unit = self._tasks.get(asyncio.current_task(self._loop)) if self._tasks else None
+            if unit is not None:
+                picked.append((unit, frames.get(self._loop_thread_id)))
+            for ident, unit in list(self._threads.items()):
+                picked.append((unit, frames.get(ident)))
+            if not picked:
+                continue
+            with self._lock:
+                for unit, frame in picked:
+                    if frame is not None:
+                        self._record(unit.name(), frame)
+
+    def _record(self, key: str, frame):
+        stack = []
+        while frame is not None and len(stack) < PROFILING_MAX_DEPTH:
+            code = frame.f_code
+            if code.co_filename != _THIS_FILE:  # Leave the profiler's own wrappers out
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.append(key)
+        folded = ";".join(reversed(stack))
+        profile = self.profiles.get(key)
+        if profile is None:
+            profile = self.profiles[key] = Counter()
+        if folded not in profile and len(profile) >= PROFILING_MAX_STACKS:
+            folded = f"{key};[other]"
+        profile[folded] += 1
+        self.samples += 1
+
+    # --- Output ---
+
+    def folded(self, key: Optional[str] = None) -> str:
+        """Folded stacks of one endpoint/message type, or all of them (each rooted at its key)."""
+        with self._lock:
+            profiles = [self.profiles.get(key, Counter())] if key else list(self.profiles.values())
+            lines = [f"{stack} {count}" for profile in profiles for stack, count in profile.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> Dict:
+        with self._lock:
+            per_key = {key: {"units": self.units.get(key, 0), "samples": sum(self.profiles.get(key, {}).values()),
+                             "stacks": len(self.profiles.get(key, {}))} for key in {*self.units, *self.profiles}}
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.rate,
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.samples,
+            "active_units": len(self._tasks) + len(self._threads),
+            "profiles": dict(sorted(per_key.items(), key=lambda item: -item[1]["samples"])),
+        }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware picking HTTP requests for the profiler (keyed by method and route template)."""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            return await self.app(scope, receive, send)
+        with self.profiler.unit(f"http {scope['method']}", scope):
+            await self.app(scope, receive, send)
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,259 @@
+import asyncio
+import os
+from typing import Callable, Dict, Optional, Set
+from urllib.parse import urlparse
+
+from app.structured_log import get_logger
+
+log = get_logger("pubsub")
+
+# Cross-process message bus shared by all workers/nodes, e.g.
+# redis://127.0.0.1:6379 (Redis or app/pubsub_broker.py). Empty: one process.
+PUBSUB_URL = os.getenv("PUBSUB_URL", "")
+# Outgoing bytes buffered while the broker is slow or away; publishes beyond it are dropped
+PUBSUB_MAX_BUFFER = int(os.getenv("PUBSUB_MAX_BUFFER", str(8 * 1024 * 1024)))
+PUBSUB_RECONNECT_DELAY = 1.0
+
+OnMessage = Callable[[str, bytes], None]
+
+
+class InProcessPubSub:
+    """
+    Pub/sub inside one process. Instances attached to the same `hub` see
+    each other's publishes, which is how tests and benchmarks run several
+    "workers" in one process; a private hub (the default) has no peers, so
+    the app skips the bus entirely (`distributed` is False).
+    """
+
+    def __init__(self, hub: Optional[Dict[str, Set["InProcessPubSub"]]] = None):
+        self.distributed = hub is not None
+        self._hub = hub if hub is not None else {}
+        self._channels: Set[str] = set()
+        self._on_message: Optional[OnMessage] = None
+        self.published = 0
+        self.received = 0
+
+    async def start(self, on_message: OnMessage):
+        self._on_message = on_message
+
+    async def close(self):
+        for channel in list(self._channels):
+            self.unsubscribe(channel)
+
+    def subscribe(self, channel: str):
+        if channel not in self._channels:
+            self._channels.add(channel)
+            self._hub.setdefault(channel, set()).add(self)
+
+    def unsubscribe(self, channel: str):
+        if channel in self._channels:
+            self._channels.discard(channel)
+            peers = self._hub.get(channel)
+            if peers is not None:
+                peers.discard(self)
+                if not peers:
+                    del self._hub[channel]
+
+    def publish(self, channel: str, data: bytes):
+        self.published += 1
+        loop = asyncio.get_running_loop()
+        for peer in self._hub.get(channel, ()):
+            loop.call_soon(peer._deliver, channel, data)  # Asynchronous, like a real broker
+
+    def _deliver(self, channel: str, data: bytes):
+        if channel in self._channels and self._on_message is not None:
+            self.received += 1
+            self._on_message(channel, data)
+
+    def stats(self) -> Dict:
+        return {"backend": "in-process", "channels": len(self._channels),
+                "published": self.published, "received": self.received}
+
+
+def encode_command(*args: bytes) -> bytes:
+    """A RESP array of bulk strings (how clients send commands)."""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Reads one RESP value. Errors come back as RespError instances, not raised."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        return RespError(rest.decode(errors="replace"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        if size < 0:
+            return None
+        return [await read_reply(reader) for _ in range(size)]
+    raise ConnectionError(f"invalid RESP reply: {line[:40]!r}")
+
+
+class RespError(Exception):
+    pass
+
+
+class RespPubSub:
+    """
+    Pub/sub over the Redis protocol (RESP2), with no client library: one
+    connection in subscriber mode delivering messages, one for PUBLISH.
+    Publishes are pipelined (never awaited); their integer replies are
+    read and discarded by a background task.
+
+    If the broker goes away, publishes are dropped (counted) and both
+    connections are re-established with every channel re-subscribed. Bus
+    traffic is live state (it is never replayed), so clients recover
+    through the normal resync paths.
+    """
+
+    distributed = True
+
+    def __init__(self, url: str = PUBSUB_URL):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self._channels: Set[str] = set()
+        self._on_message: Optional[OnMessage] = None
+        self._pub: Optional[asyncio.StreamWriter] = None
+        self._sub: Optional[asyncio.StreamWriter] = None
+        self._tasks = []
+        self._closing = False
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+
+    async def start(self, on_message: OnMessage):
+        self._on_message = on_message
+        await self._connect()
+
+    async def close(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        for writer in (self._pub, self._sub):
+            if writer is not None:
+                writer.close()
+
+    def subscribe(self, channel: str):
+        if channel not in self._channels:
+            self._channels.add(channel)
+            if self._sub is not None:
+                self._sub.write(encode_command(b"SUBSCRIBE", channel.encode()))
+
+    def unsubscribe(self, channel: str):
+        if channel in self._channels:
+            self._channels.discard(channel)
+            if self._sub is not None:
+                self._sub.write(encode_command(b"UNSUBSCRIBE", channel.encode()))
+
+    def publish(self, channel: str, data: bytes):
+        writer = self._pub
+        if writer is None or writer.transport.get_write_buffer_size() > PUBSUB_MAX_BUFFER:
+            self.dropped += 1
+            return
+        self.published += 1
+        writer.write(encode_command(b"PUBLISH", channel.encode(), data))
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(encode_command(b"AUTH", self.password.encode()))
+            reply = await read_reply(reader)
+            if isinstance(reply, RespError):
+                writer.close()
+                raise ConnectionError(f"pub/sub AUTH failed: {reply}")
+        return reader, writer
+
+    async def _connect(self):
+        pub_reader, self._pub = await self._open()
+        sub_reader, self._sub = await self._open()
+        if self._channels:
+            self._sub.write(encode_command(b"SUBSCRIBE", *(c.encode() for c in self._channels)))
+        self._tasks = [
+            asyncio.create_task(self._read_messages(sub_reader)),
+            asyncio.create_task(self._read_replies(pub_reader)),
+        ]
+
+    async def _read_replies(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                await read_reply(reader)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            self._lost()
+
+    async def _read_messages(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                reply = await read_reply(reader)
+                if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                    self.received += 1
+                    try:
+                        self._on_message(reply[1].decode(), reply[2])
+                    except Exception as e:
+                        log.exception("pubsub_message_failed", f"Erro ao tratar mensagem do pub/sub ({reply[1]!r}): {e}",
+                                      channel=reply[1].decode(errors="replace"))
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            self._lost()
+
+    def _lost(self):
+        if self._closing or self._pub is None:
+            return
+        for writer in (self._pub, self._sub):
+            writer.close()
+        self._pub = self._sub = None
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closing:
+            await asyncio.sleep(PUBSUB_RECONNECT_DELAY)
+            try:
+                await self._connect()
+                self.reconnects += 1
+                log.info("pubsub_reconnected", f"Pub/sub reconectado ({self.host}:{self.port})",
+                         host=self.host, port=self.port)
+                return
+            except OSError as e:
+                log.warning("pubsub_unavailable", f"Pub/sub indisponível ({self.host}:{self.port}): {e}",
+                            host=self.host, port=self.port, error=str(e))
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "resp",
+            "broker": f"{self.host}:{self.port}",
+            "connected": self._pub is not None,
+            "channels": len(self._channels),
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "buffered_bytes": self._pub.transport.get_write_buffer_size() if self._pub else 0,
+        }
+
+
+def create_backend(url: str = PUBSUB_URL):
+    if not url:
+        return InProcessPubSub()
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "resp"):
+        return RespPubSub(url)
+    raise ValueError(f"Unsupported PUBSUB_URL scheme: {scheme!r}")
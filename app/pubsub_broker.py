@@ -0,0 +1,121 @@
+"""
+Stand-in pub/sub broker speaking the subset of the Redis protocol that
+app/pubsub.py uses (SUBSCRIBE, UNSUBSCRIBE, PUBLISH, PING, AUTH/SELECT as
+no-ops). For development, tests and benchmarks where no Redis is around:
+
+    python -m app.pubsub_broker --port 6390
+    PUBSUB_URL=redis://127.0.0.1:6390 uvicorn main:app --workers 4
+"""
+import argparse
+import asyncio
+from typing import Dict, Set
+
+from app.pubsub import read_reply
+
+# A subscriber this far behind (bytes buffered) is disconnected, as Redis does
+BROKER_CLIENT_BUFFER_LIMIT = 32 * 1024 * 1024
+
+
+class PubSubBroker:
+    def __init__(self):
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.clients = 0
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6390) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._client, host, port)
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients += 1
+        subscribed: Set[bytes] = set()
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(b"-ERR protocol error\r\n")
+                    break
+                name = command[0].upper()
+                args = command[1:]
+                if name == b"PUBLISH" and len(args) == 2:
+                    writer.write(b":%d\r\n" % self.publish(args[0], args[1]))
+                elif name == b"SUBSCRIBE":
+                    for channel in args:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(encode_reply([b"subscribe", channel, len(subscribed)]))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in args or list(subscribed):
+                        self._drop(channel, writer)
+                        subscribed.discard(channel)
+                        writer.write(encode_reply([b"unsubscribe", channel, len(subscribed)]))
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif name in (b"AUTH", b"SELECT"):
+                    writer.write(b"+OK\r\n")
+                elif name == b"QUIT":
+                    writer.write(b"+OK\r\n")
+                    break
+                else:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % name)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            for channel in subscribed:
+                self._drop(channel, writer)
+            self.clients -= 1
+            writer.close()
+
+    def publish(self, channel: bytes, data: bytes) -> int:
+        self.published += 1
+        subscribers = self.channels.get(channel)
+        if not subscribers:
+            return 0
+        frame = encode_reply([b"message", channel, data])
+        for writer in list(subscribers):
+            if writer.transport.get_write_buffer_size() > BROKER_CLIENT_BUFFER_LIMIT:
+                writer.close()  # Slow consumer: its loop's finally drops its subscriptions
+                continue
+            writer.write(frame)
+            self.delivered += 1
+        return len(subscribers)
+
+    def _drop(self, channel: bytes, writer: asyncio.StreamWriter):
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.channels[channel]
+
+
+def encode_reply(items) -> bytes:
+    out = [b"*%d\r\n" % len(items)]
+    for item in items:
+        if isinstance(item, int):
+            out.append(b":%d\r\n" % item)
+        else:
+            out.append(b"$%d\r\n%s\r\n" % (len(item), item))
+    return b"".join(out)
+
+
+async def run(host: str, port: int):
+    broker = PubSubBroker()
+    server = await broker.serve(host, port)
+    print(f"Pub/sub broker em {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,164 @@
+import os
+import secrets
+from collections import deque
+from typing import Callable, Deque, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from app.timer_wheel import Timer, timer_wheel
+
+# Seconds a disconnected user keeps their party membership and lobby
+# presence, waiting for the client to resume (0 disables resumption)
+RESUME_WINDOW = float(os.getenv("WS_RESUME_WINDOW", "30"))
+# Party state deltas kept for replay to resuming clients
+PARTY_EVENT_LOG_SIZE = int(os.getenv("PARTY_EVENT_LOG_SIZE", "256"))
+
+
+class EventLog:
+    """
+    Which fields changed in the last versions of one versioned state stream
+    (see DeltaTracker), so a client that was away can be brought from the
+    version it holds to the current one with a single merged delta instead
+    of a full snapshot.
+
+    Only the field names are kept: the values of a merged delta are the
+    latest ones, which the tracker's current snapshot already holds, so the
+    log never pins old copies of large fields (the queue) in memory.
+    """
+
+    __slots__ = ("_entries",)
+
+    def __init__(self, size: int = PARTY_EVENT_LOG_SIZE):
+        self._entries: Deque[Tuple[int, FrozenSet[str]]] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, version: int, keys: Iterable[str]):
+        """Records the fields changed by `version` (the keys of its delta)."""
+        self._entries.append((version, frozenset(keys)))
+
+    def changes_since(self, version: int, current: int, snapshot: Optional[Dict]) -> Optional[Dict]:
+        """
+        Fields changed after `version`, with their values in `snapshot` (the
+        state at `current`; None for fields it no longer has). None when the
+        log no longer reaches back that far (or the version is unknown): the
+        client needs a full snapshot then.
+        """
+        if version == current:
+            return {}
+        if not self._entries or not self._entries[0][0] - 1 <= version < current:
+            return None
+        snapshot = snapshot or {}
+        keys = set()
+        for entry_version, changed in self._entries:
+            if entry_version > version:
+                keys |= changed
+        return {key: snapshot.get(key) for key in keys}
+
+
+class ResumeSession:
+    __slots__ = ("user_id", "token", "name", "_expiry")
+
+    def __init__(self, user_id: str, name: str):
+        self.user_id = user_id
+        self.token = secrets.token_urlsafe(16)
+        self.name = name
+        self._expiry: Optional[Timer] = None
+
+    @property
+    def suspended(self) -> bool:
+        return self._expiry is not None
+
+
+class ResumeRegistry:
+    """
+    Resume tokens of connected and recently disconnected users, one
+    session per user shared by all of their connections.
+
+    `issue()` hands a token to a client after `user_join`. When the user's
+    last socket drops, `suspend()` keeps the session for `window` seconds
+    instead of running the leave path right away; a client that reconnects
+    and presents the token in time gets it back from `resume()`. Otherwise
+    the expiry callback runs the deferred leave. A session can also be
+    resumed while another of the user's sockets is still open (e.g. one
+    the server does not know is dead yet).
+    """
+
+    def __init__(self, window: float = RESUME_WINDOW):
+        self.window = window
+        self._sessions: Dict[str, ResumeSession] = {}  # user id -> session
+        self.counters = {"issued": 0, "suspended": 0, "resumed": 0, "expired": 0, "rejected": 0,
+                         "replayed_deltas": 0, "full_resyncs": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def issue(self, user_id: str, name: str) -> ResumeSession:
+        session = self._sessions.get(user_id)
+        if session is not None and not session.suspended:
+            session.name = name  # Another tab of the same user: same session
+            return session
+        self.discard(user_id)
+        session = self._sessions[user_id] = ResumeSession(user_id, name)
+        self.counters["issued"] += 1
+        return session
+
+    def get(self, user_id: str) -> Optional[ResumeSession]:
+        return self._sessions.get(user_id)
+
+    def suspend(self, user_id: str, on_expire: Callable[[ResumeSession], None]) -> bool:
+        """Holds the session of a user whose last socket dropped. False if it cannot be resumed."""
+        session = self._sessions.get(user_id)
+        if session is None or not self.enabled:
+            return False
+        if session._expiry is not None:
+            session._expiry.cancel()
+        session._expiry = timer_wheel.call_later(self.window, self._expire, session, on_expire)
+        self.counters["suspended"] += 1
+        return True
+
+    def resume(self, user_id: str, token: str) -> Optional[ResumeSession]:
+        session = self._sessions.get(user_id)
+        if session is None or not secrets.compare_digest(session.token, token or ""):
+            self.counters["rejected"] += 1
+            return None
+        if session._expiry is not None:
+            session._expiry.cancel()
+            session._expiry = None
+        self.counters["resumed"] += 1
+        return session
+
+    def expire_now(self, user_id: str) -> Optional[ResumeSession]:
+        """Ends a suspended session early (the user came back without its token)."""
+        session = self._sessions.get(user_id)
+        if session is None or not session.suspended:
+            return None
+        session._expiry.cancel()
+        session._expiry = None
+        del self._sessions[user_id]
+        self.counters["expired"] += 1
+        return session
+
+    def discard(self, user_id: str):
+        session = self._sessions.pop(user_id, None)
+        if session is not None and session._expiry is not None:
+            session._expiry.cancel()
+
+    def _expire(self, session: ResumeSession, on_expire: Callable[[ResumeSession], None]):
+        session._expiry = None
+        if self._sessions.get(session.user_id) is session:
+            del self._sessions[session.user_id]
+        self.counters["expired"] += 1
+        on_expire(session)
+
+    def stats(self) -> Dict:
+        held = sum(1 for s in self._sessions.values() if s.suspended)
+        return {
+            "window": self.window,
+            "sessions": len(self._sessions),
+            "held": held,  # Disconnected, waiting for a resume
+            **self.counters,
+        }
+
+
+resume_registry = ResumeRegistry()
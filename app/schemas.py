@@ -0,0 +1,88 @@
+from typing import Any, Callable, Dict, Tuple
+
+from app.wire import MessageDecodeError
+
+NUMBER = (int, float)
+
+# Payload fields of every inbound WebSocket message type (see mapedcomm.md).
+# Missing or null fields are left out, so handlers keep their own defaults;
+# fields not listed here are dropped.
+INBOUND_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "user_join": {"name": str},
+    "resume": {
+        "token": str, "party_id": str, "party_version": int, "chat_seq": int,
+        "solo_version": int, "lobby_version": int,
+    },
+    "get_parties": {},
+    "create_party": {},
+    "join_party": {"party_id": str},
+    "leave_party": {"party_id": str},
+    "set_mode": {"mode": str},
+    "sync_update": {"currentTime": NUMBER, "is_playing": bool, "client_time": NUMBER},
+    "player_action": {"action": str, "currentTime": NUMBER, "track_id": int},
+    "queue_action": {"action": str, "track_id": int, "position": int, "to": int},
+    "toggle_shuffle": {},
+    "set_repeat_mode": {"mode": str},
+    "chat_message": {"text": str},
+    "set_playlist": {"playlist_id": int},
+    "sync_resync": {"scope": str},
+    "clock_ping": {"t0": NUMBER, "offset": NUMBER, "rtt": NUMBER},
+    "pong": {"t": NUMBER},
+    "playback_report": {
+        "position": NUMBER, "client_time": NUMBER, "is_playing": bool,
+        "track_id": int, "corrections": int,
+    },
+}
+
+
+def _type_names(types) -> str:
+    types = types if isinstance(types, tuple) else (types,)
+    return "/".join(t.__name__ for t in types)
+
+
+def compile_schema(msg_type: str, fields: Dict[str, Any]) -> Callable[[Any], Dict]:
+    """
+    Turns a field spec into a decoder function. The spec is flattened into a
+    tuple once, so decoding a message is one dict lookup and one isinstance
+    per declared field.
+    """
+    checks: Tuple[Tuple[str, Any, str], ...] = tuple(
+        (name, types, f"{msg_type}.{name} must be {_type_names(types)}")
+        for name, types in fields.items()
+    )
+
+    def decode(payload: Any) -> Dict:
+        if payload is None:
+            return {}
+        if not isinstance(payload, dict):
+            raise MessageDecodeError(f"{msg_type} payload must be an object")
+        decoded = {}
+        for name, types, error in checks:
+            value = payload.get(name)
+            if value is None:
+                continue
+            if not isinstance(value, types):
+                raise MessageDecodeError(error)
+            decoded[name] = value
+        return decoded
+
+    return decode
+
+
+_DECODERS = {msg_type: compile_schema(msg_type, fields) for msg_type, fields in INBOUND_SCHEMAS.items()}
+
+
+def decode_inbound(data: Any) -> Tuple[str, Dict]:
+    """
+    Validates an inbound message and returns (type, payload).
+
+    Raises MessageDecodeError for malformed messages. Unknown types come
+    back with an empty payload (the endpoint ignores them anyway).
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("type"), str):
+        raise MessageDecodeError("message must be an object with a string type")
+    msg_type = data["type"]
+    decoder = _DECODERS.get(msg_type)
+    if decoder is None:
+        return msg_type, {}
+    return msg_type, decoder(data.get("payload"))
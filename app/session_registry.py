@@ -0,0 +1,137 @@
+from typing import Any, Dict, Iterator, Optional, Set
+
+
+class SessionRegistry:
+    """
+    Who is connected and who is in which party, indexed every way the
+    WebSocket handlers look things up, so none of them scans:
+
+    - user -> connections: a user may have several tabs or devices open at
+      once, and every one of them receives the user's messages
+    - party id -> party, user -> party and host -> party
+    - party -> members: the party's own `members` set, which is only
+      changed through join() / leave() here so the indexes stay in step
+
+    A user is in at most one party; the host is always a member. With
+    several workers (app/cluster.py) a local user may be in a party owned
+    by another worker: that membership is kept separately (remote_party_of),
+    while the owner's registry lists the user as a member of its party.
+    """
+
+    def __init__(self):
+        self._connections: Dict[str, Dict[Any, None]] = {}  # user id -> connections (ordered set)
+        self.parties: Dict[str, Any] = {}  # party id -> Party
+        self._party_of: Dict[str, str] = {}  # user id -> party id
+        self._hosted: Dict[str, str] = {}  # host user id -> party id
+        self._remote_party_of: Dict[str, str] = {}  # user id -> id of a party owned by another worker
+
+    # --- Connections ---
+
+    def add_connection(self, user_id: str, connection) -> bool:
+        """Registers a connection; True if it is the user's first one."""
+        connections = self._connections.setdefault(user_id, {})
+        connections[connection] = None
+        return len(connections) == 1
+
+    def remove_connection(self, user_id: str, connection) -> int:
+        """Unregisters a connection and returns how many the user still has."""
+        connections = self._connections.get(user_id)
+        if connections is None:
+            return 0
+        connections.pop(connection, None)
+        if not connections:
+            del self._connections[user_id]
+            return 0
+        return len(connections)
+
+    def connections(self, user_id: str):
+        """The user's open connections (empty if none)."""
+        return self._connections.get(user_id, {}).keys()
+
+    def is_connected(self, user_id: str) -> bool:
+        return user_id in self._connections
+
+    def is_last_connection(self, user_id: str, connection) -> bool:
+        connections = self._connections.get(user_id)
+        return connections is not None and len(connections) == 1 and connection in connections
+
+    def all_connections(self) -> Iterator:
+        for connections in list(self._connections.values()):
+            yield from connections
+
+    def connection_count(self) -> int:
+        return sum(len(c) for c in self._connections.values())
+
+    def user_count(self) -> int:
+        """Users with at least one open connection."""
+        return len(self._connections)
+
+    # --- Parties ---
+
+    def add_party(self, party):
+        self.parties[party.party_id] = party
+        self._hosted[party.host_id] = party.party_id
+        for user_id in party.members:
+            self._party_of[user_id] = party.party_id
+
+    def remove_party(self, party_id: str):
+        """Drops a party and its membership indexes; returns it (None if unknown)."""
+        party = self.parties.pop(party_id, None)
+        if party is None:
+            return None
+        if self._hosted.get(party.host_id) == party_id:
+            del self._hosted[party.host_id]
+        for user_id in party.members:
+            if self._party_of.get(user_id) == party_id:
+                del self._party_of[user_id]
+        return party
+
+    def get_party(self, party_id: Optional[str]):
+        return self.parties.get(party_id) if party_id else None
+
+    def party_of(self, user_id: str):
+        """The party the user is a member of, or None when solo."""
+        party_id = self._party_of.get(user_id)
+        return self.parties.get(party_id) if party_id else None
+
+    def hosted_by(self, user_id: str):
+        party_id = self._hosted.get(user_id)
+        return self.parties.get(party_id) if party_id else None
+
+    def members(self, party_id: str) -> Set[str]:
+        party = self.parties.get(party_id)
+        return party.members if party is not None else set()
+
+    def join(self, user_id: str, party):
+        party.members.add(user_id)
+        self._party_of[user_id] = party.party_id
+
+    def leave(self, user_id: str):
+        """Takes the user out of their party; returns that party (None if solo)."""
+        party_id = self._party_of.pop(user_id, None)
+        party = self.parties.get(party_id) if party_id else None
+        if party is not None:
+            party.members.discard(user_id)
+        return party
+
+    def remote_party_of(self, user_id: str) -> Optional[str]:
+        return self._remote_party_of.get(user_id)
+
+    def join_remote(self, user_id: str, party_id: str):
+        self._remote_party_of[user_id] = party_id
+
+    def leave_remote(self, user_id: str) -> Optional[str]:
+        return self._remote_party_of.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "users": self.user_count(),
+            "connections": self.connection_count(),
+            "multi_connection_users": sum(1 for c in self._connections.values() if len(c) > 1),
+            "parties": len(self.parties),
+            "party_members": len(self._party_of),
+            "remote_party_members": len(self._remote_party_of),
+        }
+
+
+sessions = SessionRegistry()
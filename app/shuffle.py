@@ -0,0 +1,153 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# Mirrored in static/app.js (shuffleKey / shuffledOrder): both sides must
+# compute the same play order from the same seed.
+
+_MASK = 0xFFFFFFFF
+
+
+def _fmix32(h: int) -> int:
+    """MurmurHash3 finalizer: a cheap 32-bit bijection with good avalanche."""
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & _MASK
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & _MASK
+    h ^= h >> 16
+    return h
+
+
+def shuffle_key(seed: int, seq: int) -> int:
+    """
+    Sort key of one queue entry (by its TrackQueue sequence number) under a
+    shuffle seed. A bijection of `seq` for a given seed, so keys never tie.
+    """
+    h = _fmix32((seed ^ (seq * 0x9E3779B1)) & _MASK)
+    return _fmix32(h ^ seed)
+
+
+def seq_runs(seqs: Iterable[int]) -> List[int]:
+    """Increasing sequence numbers as flat runs: start, count, start, count... (what payloads carry)."""
+    runs: List[int] = []
+    for seq in seqs:
+        if runs and runs[-2] + runs[-1] == seq:
+            runs[-1] += 1
+        else:
+            runs += (seq, 1)
+    return runs
+
+
+def expand_runs(runs: Sequence[int]) -> List[int]:
+    return [seq for i in range(0, len(runs), 2) for seq in range(runs[i], runs[i] + runs[i + 1])]
+
+
+class ShuffleOrder:
+    """
+    Play order of a shuffled queue, kept up to date entry by entry.
+
+    When shuffle is turned on the queue is renumbered (TrackQueue.renumber),
+    so its entries are 0..boundary-1 in queue order. The play order is then:
+    the `anchor` entry (the one playing at the time) first, the other
+    entries below `boundary` by their shuffle_key, then entries added later
+    (numbers >= boundary) in the order they were added. Keys depend on the
+    seed and the entry's own number only, so adding or removing entries
+    never moves the others: an append goes to the tail, a removal is a
+    bisect plus a del, and nothing is re-sorted. Unshuffling just drops
+    this object.
+
+    While shuffled the queue only grows at its end and is never reordered,
+    so its sequence numbers stay increasing in queue order; `runs()` is
+    that list run-length encoded, which is what clients need to rebuild
+    the same order. Like TrackQueue.to_list(), a change swaps in an updated
+    copy of it rather than rebuilding it.
+    """
+
+    __slots__ = ("seed", "anchor", "boundary", "queue_revision", "_keyed", "_tail",
+                 "_run_starts", "_runs")
+
+    def __init__(self, seed: int, anchor: Optional[int], boundary: int, seqs: Iterable[int],
+                 queue_revision: int = 0):
+        """`seqs`: sequence numbers of the queue's entries, in queue order."""
+        self.seed = seed
+        self.boundary = boundary
+        self.queue_revision = queue_revision # TrackQueue.revision this order matches
+        seqs = list(seqs)
+        self.anchor = anchor if anchor in seqs else None
+        self._keyed: List[Tuple[int, int]] = sorted(
+            (shuffle_key(seed, seq), seq) for seq in seqs if seq < boundary and seq != self.anchor)
+        self._tail: List[int] = [seq for seq in seqs if seq >= boundary]
+        self._runs: List[int] = seq_runs(seqs)
+        self._run_starts: List[int] = self._runs[::2] # For bisecting; run r is _runs[2r:2r+2]
+
+    def __len__(self) -> int:
+        return (self.anchor is not None) + len(self._keyed) + len(self._tail)
+
+    def seq_at(self, play_index: int) -> int:
+        """Sequence number of the entry at `play_index` (IndexError if out of range)."""
+        if not 0 <= play_index < len(self):
+            raise IndexError("play index out of range")
+        if self.anchor is not None:
+            if play_index == 0:
+                return self.anchor
+            play_index -= 1
+        if play_index < len(self._keyed):
+            return self._keyed[play_index][1]
+        return self._tail[play_index - len(self._keyed)]
+
+    def index(self, seq: int) -> int:
+        """Play index of an entry (ValueError if it is not in the order)."""
+        pinned = self.anchor is not None
+        if pinned and seq == self.anchor:
+            return 0
+        if seq < self.boundary:
+            item = (shuffle_key(self.seed, seq), seq)
+            i = bisect_left(self._keyed, item)
+            if i < len(self._keyed) and self._keyed[i] == item:
+                return pinned + i
+        else:
+            i = bisect_left(self._tail, seq)
+            if i < len(self._tail) and self._tail[i] == seq:
+                return pinned + len(self._keyed) + i
+        raise ValueError(f"entry {seq} is not in the play order")
+
+    def append(self, seq: int):
+        """An entry added at the end of the queue (plays last)."""
+        self._tail.append(seq)
+        runs = self._runs.copy()
+        if runs and runs[-2] + runs[-1] == seq:
+            runs[-1] += 1
+        else:
+            runs += (seq, 1)
+            self._run_starts.append(seq)
+        self._runs = runs
+
+    def remove(self, seq: int):
+        """Drops an entry; every entry after it moves up one play index."""
+        i = self.index(seq) - (self.anchor is not None)
+        if i < 0:
+            self.anchor = None
+        elif i < len(self._keyed):
+            del self._keyed[i]
+        else:
+            del self._tail[i - len(self._keyed)]
+        r = bisect_right(self._run_starts, seq) - 1
+        runs = self._runs.copy()
+        start, count = runs[2 * r], runs[2 * r + 1]
+        if count == 1:
+            del runs[2 * r:2 * r + 2]
+            del self._run_starts[r]
+        elif seq == start:
+            runs[2 * r] += 1
+            runs[2 * r + 1] -= 1
+            self._run_starts[r] += 1
+        elif seq == start + count - 1:
+            runs[2 * r + 1] -= 1
+        else:
+            runs[2 * r + 1] = seq - start
+            runs[2 * r + 2:2 * r + 2] = (seq + 1, start + count - seq - 1)
+            self._run_starts.insert(r + 1, seq + 1)
+        self._runs = runs
+
+    def runs(self) -> List[int]:
+        """The queue's sequence numbers as flat runs (see seq_runs). Shared, never modified afterwards."""
+        return self._runs
@@ -0,0 +1,295 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.database import SessionLocal, SoloStateSnapshot
+from app.structured_log import get_logger
+from app.timer_wheel import Timer, timer_wheel
+
+log = get_logger("solo_states")
+
+# Seconds a disconnected user's solo state stays in memory
+SOLO_STATE_TTL = float(os.getenv("SOLO_STATE_TTL", "900"))
+# Spill evicted states to SQLite so later reconnects can restore them (0 disables)
+SOLO_STATE_SPILL = os.getenv("SOLO_STATE_SPILL", "1") != "0"
+# Seconds a spilled state is kept before it is deleted for good
+SOLO_STATE_SPILL_TTL = float(os.getenv("SOLO_STATE_SPILL_TTL", str(7 * 24 * 3600)))
+# Seconds evictions are collected before they are written in one batch
+SOLO_STATE_SPILL_DELAY = float(os.getenv("SOLO_STATE_SPILL_DELAY", "1"))
+
+# Rows per executemany when spilling
+_SPILL_BATCH = 1000
+# Seconds between deletions of spilled states past SOLO_STATE_SPILL_TTL
+_PURGE_INTERVAL = 3600
+
+
+class SoloStateStore:
+    """
+    Player states of solo users, keyed by user id.
+
+    Reads and writes like the dict it replaces (`in`, `[]`, `get`), plus a
+    lifecycle: `release()` when a user disconnects arms a TTL timer on the
+    timer wheel, `acquire()` on (re)connect cancels it, and when it fires
+    the state is evicted. Evicted states are spilled to SQLite in batches
+    as a snapshot (`state.to_snapshot()`, None for states not worth
+    keeping), and a reconnect within SOLO_STATE_SPILL_TTL restores them with
+    `restore()`.
+
+    Nothing scans the states periodically: each one costs a timer while its
+    user is away, and nothing while connected. The ids of spilled users are indexed
+    in memory (a few dozen bytes each), so connecting users that have
+    nothing spilled never wait on SQLite.
+    """
+
+    def __init__(self, factory: Callable[[], Any], restore: Callable[[Dict], Any],
+                 ttl: float = SOLO_STATE_TTL, spill: bool = SOLO_STATE_SPILL,
+                 spill_ttl: float = SOLO_STATE_SPILL_TTL, session_factory=SessionLocal):
+        self.factory = factory
+        self.restore = restore
+        self.ttl = ttl
+        self.spill = spill
+        self.spill_ttl = spill_ttl
+        self.session_factory = session_factory
+        self._states: Dict[str, Any] = {}
+        self._released: Dict[str, Timer] = {} # user id -> eviction timer
+        self._pending: Dict[str, Dict] = {} # Evicted snapshots waiting for the next flush
+        self._writing: Dict[str, Dict] = {} # Snapshots being written, still restorable
+        self._flush_timer: Optional[Timer] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._spilled: Optional[Set[str]] = None # User ids with a row, loaded on first use
+        self._loading: Dict[str, asyncio.Future] = {} # user id -> restore from SQLite in flight
+        # Held while the index loads and while flush() adds to it, so concurrent
+        # first connects share one load and no flushed id is lost to a load in flight
+        self._index_lock = asyncio.Lock()
+        self.counters = {"evicted": 0, "spilled": 0, "restored": 0, "purged": 0}
+        self.last_flush_ms = 0.0
+        self._next_purge = 0.0
+
+    # --- dict interface ---
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._states
+
+    def __getitem__(self, user_id: str):
+        return self._states[user_id]
+
+    def __setitem__(self, user_id: str, state):
+        self._states[user_id] = state
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, user_id: str, default=None):
+        return self._states.get(user_id, default)
+
+    def values(self) -> Iterable:
+        return self._states.values()
+
+    # --- Lifecycle ---
+
+    async def acquire(self, user_id: str):
+        """State for a connecting user: in memory, spilled, or a new one."""
+        timer = self._released.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        state = self._states.get(user_id)
+        if state is not None:
+            return state
+        snapshot = self._pending.pop(user_id, None) or self._writing.get(user_id)
+        if snapshot is None and self.spill:
+            spilled = await self._spilled_index()
+            loading = self._loading.get(user_id)
+            if loading is None and user_id in spilled:
+                spilled.discard(user_id)
+                loading = self._loading[user_id] = asyncio.ensure_future(self._restore_spilled(user_id))
+                loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+            if loading is not None:
+                # Every connection of the user waits for the same restore (shielded:
+                # a waiter that goes away does not cancel it for the others)
+                restored = await asyncio.shield(loading)
+                if restored is not None:
+                    return restored
+            state = self._states.get(user_id)
+            if state is not None: # Another connection got here first
+                return state
+        if snapshot is not None:
+            state = self.restore(snapshot)
+            self.counters["restored"] += 1
+        else:
+            state = self.factory()
+        self._states[user_id] = state
+        return state
+
+    async def _restore_spilled(self, user_id: str):
+        """Takes a user's row out of SQLite and restores it. None if it was gone or stale."""
+        snapshot = await asyncio.to_thread(self._load, user_id)
+        if snapshot is None:
+            return None
+        state = self.restore(snapshot)
+        self.counters["restored"] += 1
+        # Replaces a state created meanwhile (a fresh one, without the user's queue)
+        self._states[user_id] = state
+        return state
+
+    async def _spilled_index(self) -> Set[str]:
+        async with self._index_lock:
+            if self._spilled is None:
+                self._spilled = await asyncio.to_thread(self._load_index)
+            return self._spilled
+
+    def release(self, user_id: str):
+        """Starts the TTL of a disconnected user's state."""
+        if user_id in self._states:
+            timer = self._released.pop(user_id, None)
+            if timer is not None:
+                timer.cancel()
+            self._released[user_id] = timer_wheel.call_later(self.ttl, self._expire, user_id)
+
+    def _expire(self, user_id: str):
+        del self._released[user_id]
+        self._evict(user_id)
+        if self._pending and self._flush_timer is None:
+            # Evictions are written in batches, one worker thread trip each
+            self._flush_timer = timer_wheel.call_later(SOLO_STATE_SPILL_DELAY, self._start_flush)
+
+    def _evict(self, user_id: str):
+        state = self._states.pop(user_id, None)
+        self.counters["evicted"] += 1
+        if state is not None and self.spill:
+            snapshot = state.to_snapshot()
+            if snapshot is not None:
+                self._pending[user_id] = snapshot
+
+    def _start_flush(self):
+        self._flush_timer = None
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_timer = timer_wheel.call_later(SOLO_STATE_SPILL_DELAY, self._start_flush)
+            return
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> int:
+        """Writes the pending evicted states to SQLite in a worker thread. Returns how many."""
+        snapshots, self._pending = self._pending, {}
+        purge = time.monotonic() >= self._next_purge
+        if not snapshots and not purge:
+            return 0
+        if purge:
+            self._next_purge = time.monotonic() + _PURGE_INTERVAL
+        start = time.perf_counter()
+        self._writing.update(snapshots)
+        try:
+            purged = await asyncio.to_thread(self._write, snapshots, purge)
+            self.counters["spilled"] += len(snapshots)
+            self.counters["purged"] += purged
+        except Exception as e:
+            log.exception("solo_spill_failed", f"Erro ao salvar estados solo: {e}", states=len(snapshots))
+            return 0
+        finally:
+            for user_id in snapshots:
+                self._writing.pop(user_id, None)
+        # Users that reconnected while the write was running got their
+        # state from _writing; their rows are stale already
+        revived = [user_id for user_id in snapshots if user_id in self._states]
+        if revived:
+            await asyncio.to_thread(self._delete, revived)
+        async with self._index_lock:
+            if purged:
+                self._spilled = None # Reloaded on the next acquire
+            elif self._spilled is not None:
+                self._spilled.update(user_id for user_id in snapshots if user_id not in self._states)
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        if snapshots:
+            log.info("solo_states_spilled", f"🧹 Solo states: {len(snapshots)} spilled ({self.last_flush_ms:.0f} ms)",
+                     states=len(snapshots), duration_ms=round(self.last_flush_ms, 1))
+        return len(snapshots)
+
+    async def sweep(self, now: float | None = None) -> Tuple[int, int]:
+        """
+        Evicts every released state whose TTL is over by `now` (loop time)
+        without waiting for its timer, then flushes. Returns (evicted, spilled).
+        """
+        now = asyncio.get_running_loop().time() if now is None else now
+        expired = [user_id for user_id, timer in self._released.items() if timer.when <= now]
+        for user_id in expired:
+            self._released.pop(user_id).cancel()
+            self._evict(user_id)
+        return len(expired), await self.flush()
+
+    # --- SQLite ---
+
+    def _load_index(self) -> Set[str]:
+        db = self.session_factory()
+        try:
+            return {user_id for (user_id,) in db.query(SoloStateSnapshot.user_id)}
+        finally:
+            db.close()
+
+    def _load(self, user_id: str) -> Optional[Dict]:
+        """Takes a spilled snapshot out of SQLite (it is in memory again from now on)."""
+        db = self.session_factory()
+        try:
+            row = db.get(SoloStateSnapshot, user_id)
+            if row is None:
+                return None
+            snapshot = json.loads(row.state)
+            fresh = row.saved_at >= datetime.utcnow() - timedelta(seconds=self.spill_ttl)
+            db.delete(row)
+            db.commit()
+            return snapshot if fresh else None
+        finally:
+            db.close()
+
+    def _delete(self, user_ids: List[str]):
+        table = SoloStateSnapshot.__table__
+        db = self.session_factory()
+        try:
+            db.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+            db.commit()
+        finally:
+            db.close()
+
+    def _write(self, snapshots: Dict[str, Dict], purge: bool = False) -> int:
+        """
+        Upserts snapshots and, with `purge`, deletes the ones past the spill TTL. Returns rows purged.
+        The upsert is a delete of the batch's ids plus a bulk insert, in one transaction: plain SQL
+        any DATABASE_URL backend runs, unlike the dialect-specific ON CONFLICT forms.
+        """
+        now = datetime.utcnow()
+        rows = [
+            {"user_id": user_id, "state": json.dumps(snapshot, separators=(",", ":")), "saved_at": now}
+            for user_id, snapshot in snapshots.items()
+        ]
+        table = SoloStateSnapshot.__table__
+        db = self.session_factory()
+        try:
+            for i in range(0, len(rows), _SPILL_BATCH):
+                batch = rows[i:i + _SPILL_BATCH]
+                db.execute(table.delete().where(table.c.user_id.in_([row["user_id"] for row in batch])))
+                db.execute(table.insert(), batch)
+            purged = 0
+            if purge:
+                purged = db.execute(
+                    table.delete().where(table.c.saved_at < now - timedelta(seconds=self.spill_ttl))
+                ).rowcount
+            db.commit()
+            return purged
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        return {
+            "in_memory": len(self._states),
+            "disconnected": len(self._released),
+            "ttl": self.ttl,
+            "spill": self.spill,
+            "spilled_index": len(self._spilled) if self._spilled is not None else None,
+            "pending_spill": len(self._pending),
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            **self.counters,
+        }
@@ -0,0 +1,206 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from app.metrics import metrics
+
+# Minimum level written (DEBUG, INFO, WARNING, ERROR)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line, for Docker/log shippers) or "text" (the message only, for local runs)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Per-event sampling, e.g. "player_action=0.1,action_rejected=0.05"; unlisted events are all kept
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+# Records per second allowed per event (bursts up to the same amount); 0 disables the limit
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "50"))
+# Records waiting for the writer thread; past it new records are dropped instead of blocking
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT_LOGGER = "torbware"
+
+log_records = metrics.counter("log_records_total", "Log records written by level", ["level"])
+log_dropped = metrics.counter("log_records_dropped_total",
+                              "Log records not written: sampled out, rate limited or queue full", ["event", "reason"])
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = item.partition("=")
+        try:
+            rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            pass
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event, msg and the record's fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The message as the old print() calls wrote it, plus fields that did not make it into the text."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = record.getMessage()
+        suppressed = getattr(record, "fields", {}).get("suppressed")
+        if suppressed:
+            text += f" (+{suppressed} suprimidas)"
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread. The caller only pays for building
+    the message: formatting and the write to stdout (a pipe under Docker,
+    which blocks when the reader falls behind) happen on the writer thread.
+    A full queue drops the record rather than blocking the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_dropped.inc(labels=(getattr(record, "event", None) or "", "queue_full"))
+
+
+class CountingStreamHandler(logging.StreamHandler):
+    def emit(self, record: logging.LogRecord):
+        super().emit(record)
+        log_records.inc(labels=(record.levelname.lower(),))
+
+
+class EventLogger:
+    """
+    Structured logger: every record has an event name (its type) plus
+    key/value fields. Level filtering, per-event sampling (LOG_SAMPLE) and
+    per-event rate limiting (LOG_RATE_LIMIT, a token bucket) all happen
+    before anything is formatted, so a dropped record costs a few dict
+    lookups. The first record let through after a rate-limited stretch
+    carries `suppressed`, the number of records dropped in between.
+    """
+
+    def __init__(self, logger: logging.Logger, sampling: "LogSampling"):
+        self.logger = logger
+        self.sampling = sampling
+
+    def log(self, level: int, event: str, message: str, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        suppressed = self.sampling.admit(event)
+        if suppressed is None:
+            return
+        if suppressed:
+            fields["suppressed"] = suppressed
+        self.logger.log(level, message, exc_info=exc_info, extra={"event": event, "fields": fields})
+
+    def debug(self, event: str, message: str, **fields):
+        self.log(logging.DEBUG, event, message, **fields)
+
+    def info(self, event: str, message: str, **fields):
+        self.log(logging.INFO, event, message, **fields)
+
+    def warning(self, event: str, message: str, **fields):
+        self.log(logging.WARNING, event, message, **fields)
+
+    def error(self, event: str, message: str, **fields):
+        self.log(logging.ERROR, event, message, **fields)
+
+    def exception(self, event: str, message: str, **fields):
+        self.log(logging.ERROR, event, message, exc_info=True, **fields)
+
+
+class LogSampling:
+    """Sampling and rate limiting state shared by all loggers (records come from the loop and from threads)."""
+
+    def __init__(self, rates: Dict[str, float], rate_limit: float):
+        self.rates = rates
+        self.rate_limit = rate_limit
+        self._buckets: Dict[str, list] = {}  # event -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+
+    def admit(self, event: str) -> Optional[int]:
+        """None if the record is dropped, else how many records of the event were rate limited before it."""
+        rate = self.rates.get(event)
+        if rate is not None and random.random() >= rate:
+            with self._lock:
+                log_dropped.inc(labels=(event, "sampled"))
+            return None
+        if self.rate_limit <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(event)
+            if bucket is None:
+                bucket = self._buckets[event] = [self.rate_limit, now, 0]
+            bucket[0] = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                log_dropped.inc(labels=(event, "rate_limited"))
+                return None
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+            return suppressed
+
+
+class LogSystem:
+    """Wires the "torbware" logger tree to a bounded queue drained by one writer thread."""
+
+    def __init__(self):
+        self.sampling = LogSampling(parse_sample_rates(LOG_SAMPLE), LOG_RATE_LIMIT)
+        self.queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.propagate = False
+        root.addHandler(DroppingQueueHandler(self.queue))
+        writer = CountingStreamHandler(sys.stdout)
+        writer.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        self.listener = QueueListener(self.queue, writer)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def get_logger(self, name: str) -> EventLogger:
+        return EventLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"), self.sampling)
+
+    def stop(self):
+        """Writes out what is still queued (app shutdown / interpreter exit)."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+
+log_system = LogSystem()
+
+
+def get_logger(name: str) -> EventLogger:
+    return log_system.get_logger(name)
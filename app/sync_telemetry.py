@@ -0,0 +1,100 @@
+import math
+import os
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+# Drift samples kept per party for the percentiles
+DRIFT_SAMPLE_WINDOW = int(os.getenv("DRIFT_SAMPLE_WINDOW", "512"))
+# Seconds between telemetry summaries in the server log (0 disables them)
+SYNC_TELEMETRY_LOG_INTERVAL = float(os.getenv("SYNC_TELEMETRY_LOG_INTERVAL", "60"))
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class PartySyncTelemetry:
+    """
+    How well one party stays in sync.
+
+    Members periodically report where their player actually is
+    (`playback_report`); the drift is that position minus the server
+    timeline at the same instant. Counters track how often clients had to
+    seek to catch up, how often the server re-anchored the timeline and how
+    many sync messages went each way.
+    """
+
+    def __init__(self, window: int = DRIFT_SAMPLE_WINDOW):
+        self.started_at = time.monotonic()
+        self.drift: Deque[float] = deque(maxlen=window)
+        self.members: Dict[str, Dict] = {}
+        self.counters: Counter = Counter()
+
+    def record_report(self, user_id: str, drift: float, offset: float | None, rtt: float | None,
+                      corrections: int = 0):
+        self.drift.append(drift)
+        self.counters["reports"] += 1
+        self.counters["client_corrections"] += corrections
+        self.members[user_id] = {
+            "drift": round(drift, 4),
+            "clock_offset": round(offset, 4) if offset is not None else None,
+            "rtt": round(rtt, 4) if rtt is not None else None,
+        }
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def stats(self) -> Dict:
+        elapsed_min = max(time.monotonic() - self.started_at, 1.0) / 60
+        magnitudes = sorted(abs(d) for d in self.drift)
+        return {
+            "samples": len(magnitudes),
+            "drift_p50": _round(percentile(magnitudes, 50)),
+            "drift_p95": _round(percentile(magnitudes, 95)),
+            "drift_max": _round(magnitudes[-1] if magnitudes else None),
+            "counters": dict(self.counters),
+            "per_minute": {name: round(n / elapsed_min, 2) for name, n in self.counters.items()},
+            "members": self.members,
+        }
+
+    def summary_line(self, party_id: str) -> str:
+        s = self.stats()
+        fmt = lambda v: "-" if v is None else f"{v * 1000:.0f}ms"
+        return (f"party {party_id[:8]}: drift p50={fmt(s['drift_p50'])} p95={fmt(s['drift_p95'])} "
+                f"max={fmt(s['drift_max'])} reports={self.counters['reports']} "
+                f"seeks={self.counters['client_corrections']} reanchors={self.counters['reanchors']} "
+                f"sync in/out per min={s['per_minute'].get('sync_in', 0)}/{s['per_minute'].get('sync_out', 0)}")
+
+
+def _round(value: float | None) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+
+class SyncTelemetry:
+    """Per-party sync telemetry, created on first use and dropped with the party."""
+
+    def __init__(self):
+        self.parties: Dict[str, PartySyncTelemetry] = {}
+
+    def party(self, party_id: str) -> PartySyncTelemetry:
+        telemetry = self.parties.get(party_id)
+        if telemetry is None:
+            telemetry = self.parties[party_id] = PartySyncTelemetry()
+        return telemetry
+
+    def drop(self, party_id: str) -> Optional[PartySyncTelemetry]:
+        return self.parties.pop(party_id, None)
+
+    def stats(self) -> Dict:
+        return {party_id: t.stats() for party_id, t in self.parties.items()}
+
+    def summary_lines(self) -> List[str]:
+        return [t.summary_line(party_id) for party_id, t in self.parties.items() if t.counters]
+
+
+sync_telemetry = SyncTelemetry()
@@ -0,0 +1,207 @@
+import asyncio
+import math
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from app.structured_log import get_logger
+
+log = get_logger("timer_wheel")
+
+# Resolution of the wheel: timers fire at most one tick late, never early
+TIMER_WHEEL_TICK = float(os.getenv("TIMER_WHEEL_TICK", "0.05"))
+
+# Slots per level. Level 0 spans 256 ticks (12.8 s at 50 ms); every level
+# above spans 64 times the one below (~14 min, ~15 h, ~39 days).
+_LEVEL_BITS = (8, 6, 6, 6)
+
+
+class Timer:
+    """A scheduled callback. `cancel()` is O(1) and safe to call more than once."""
+
+    __slots__ = ("expires", "callback", "args", "_wheel", "_slot")
+
+    def __init__(self, wheel: "TimerWheel", expires: int, callback: Callable, args: tuple):
+        self.expires = expires  # Absolute tick
+        self.callback = callback
+        self.args = args
+        self._wheel = wheel
+        self._slot: Optional[Dict["Timer", None]] = None
+
+    @property
+    def when(self) -> float:
+        """Loop time at which the timer is due."""
+        return self._wheel.origin + self.expires * self._wheel.tick
+
+    def active(self) -> bool:
+        return self._slot is not None
+
+    def cancel(self):
+        if self._slot is not None:
+            del self._slot[self]
+            self._slot = None
+            self._wheel.count -= 1
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel on the asyncio event loop.
+
+    Timers go into the slot of the tick they expire at: level 0 holds the
+    next 256 ticks one slot per tick, each higher level holds ranges 64
+    times coarser. When level 0 wraps around, the next slot of the level
+    above is cascaded down. Scheduling and cancelling are O(1) (a dict
+    insert/delete in a slot), whatever the number of pending timers, and
+    the loop is only woken up for ticks that have something to do.
+
+    Replaces per-concern polling loops and one loop TimerHandle per
+    deadline (debounce expiry, auto-advance, solo state eviction...).
+    """
+
+    def __init__(self, tick: float = TIMER_WHEEL_TICK):
+        self.tick = tick
+        self.origin = 0.0
+        self.count = 0  # Pending timers
+        self.fired = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._wake_at: Optional[int] = None
+        self._now = 0  # Last processed tick
+        self._levels: List[List[Dict[Timer, None]]] = [
+            [{} for _ in range(1 << bits)] for bits in _LEVEL_BITS
+        ]
+        self._shifts = []
+        shift = 0
+        for bits in _LEVEL_BITS:
+            self._shifts.append(shift)
+            shift += bits
+        self._span = 1 << shift
+
+    # --- Public API ---
+
+    def call_later(self, delay: float, callback: Callable, *args: Any) -> Timer:
+        loop = self._bind()
+        return self._add(loop.time() + max(0.0, delay), callback, args)
+
+    def call_at(self, when: float, callback: Callable, *args: Any) -> Timer:
+        self._bind()
+        return self._add(when, callback, args)
+
+    def stats(self) -> Dict:
+        return {"pending": self.count, "fired": self.fired, "tick_ms": round(self.tick * 1000)}
+
+    # --- Internals ---
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # First use, or the previous loop is gone (tests, reloads): its timers go with it
+            for level in self._levels:
+                for slot in level:
+                    for timer in slot:
+                        timer._slot = None
+                    slot.clear()
+            self._loop = loop
+            self._handle = None
+            self._wake_at = None
+            self.count = 0
+            self.origin = loop.time()
+            self._now = 0
+        return loop
+
+    def _tick_of(self, when: float) -> int:
+        return int((when - self.origin) / self.tick + 1e-9)
+
+    def _add(self, when: float, callback: Callable, args: tuple) -> Timer:
+        if self.count == 0:
+            # Nothing pending, so the wheel can jump straight to the present
+            self._now = max(self._now, self._tick_of(self._loop.time()))
+        expires = max(math.ceil((when - self.origin) / self.tick - 1e-9), self._now + 1)
+        timer = Timer(self, expires, callback, args)
+        self._insert(timer)
+        self.count += 1
+        # Timers on upper levels need a wake-up at the next cascade at the latest
+        target = min(expires, self._next_wrap())
+        if self._handle is None or target < self._wake_at:
+            self._wake(target)
+        return timer
+
+    def _insert(self, timer: Timer):
+        # Beyond the top level's range the timer is parked in the farthest
+        # slot and re-inserted when it gets there
+        expires = min(timer.expires, self._now + self._span - 1)
+        delta = expires - self._now
+        for level, bits in enumerate(_LEVEL_BITS):
+            shift = self._shifts[level]
+            if delta < 1 << (shift + bits) or level == len(_LEVEL_BITS) - 1:
+                slot = self._levels[level][(expires >> shift) & ((1 << bits) - 1)]
+                slot[timer] = None
+                timer._slot = slot
+                return
+
+    def _next_wrap(self) -> int:
+        """Next tick at which level 0 wraps around (and upper levels cascade)."""
+        return (self._now | ((1 << _LEVEL_BITS[0]) - 1)) + 1
+
+    def _wake(self, tick: int):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._wake_at = tick
+        self._handle = self._loop.call_at(self.origin + tick * self.tick, self._run)
+
+    def _next_tick(self, limit: int) -> int:
+        """Next tick with work (a non-empty level-0 slot or a cascade), or `limit` if sooner."""
+        level0 = self._levels[0]
+        mask = len(level0) - 1
+        end = min(self._next_wrap(), limit)
+        for t in range(self._now + 1, end):
+            if level0[t & mask]:
+                return t
+        return end
+
+    def _run(self):
+        self._handle = None
+        self._wake_at = None
+        due = self._tick_of(self._loop.time())
+        # Empty ticks are skipped, so catching up after a stall costs slots, not ticks
+        while self._now < due and self.count:
+            self._now = self._next_tick(due)
+            self._step(self._now)
+        if self.count == 0:
+            self._now = max(self._now, due)
+        else:
+            self._wake(self._next_tick(self._next_wrap()))
+
+    def _step(self, tick: int):
+        # Cascade higher levels whose slot starts at this tick
+        for level in range(1, len(_LEVEL_BITS)):
+            shift = self._shifts[level]
+            if tick & ((1 << shift) - 1):
+                break
+            slot = self._levels[level][(tick >> shift) & ((1 << _LEVEL_BITS[level]) - 1)]
+            if slot:
+                timers = list(slot)
+                slot.clear()
+                for timer in timers:
+                    self._insert(timer)
+
+        slot = self._levels[0][tick & ((1 << _LEVEL_BITS[0]) - 1)]
+        if not slot:
+            return
+        for timer in list(slot):
+            if timer._slot is not slot:  # Cancelled by an earlier callback
+                continue
+            del slot[timer]
+            timer._slot = None
+            if timer.expires > tick:  # Parked beyond the wheel's range
+                self._insert(timer)
+                continue
+            self.count -= 1
+            self.fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                name = getattr(timer.callback, "__qualname__", repr(timer.callback))
+                log.exception("timer_failed", f"Erro em timer {name}: {e}", callback=name)
+
+
+timer_wheel = TimerWheel()
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from app.convert import get_audio_info
+from app.database import SessionLocal, Track, MEDIA_DIR
+
+# Seconds a "not in the database" answer is trusted. Tracks added here go
+# through put(), but other workers (or scripts) write to the same database.
+TRACK_CACHE_MISS_TTL = float(os.getenv("TRACK_CACHE_MISS_TTL", "30"))
+
+
+class _Missing:
+    """Cached miss: the track was looked up and not found, until `expires`."""
+
+    __slots__ = ("expires",)
+
+    def __init__(self, expires: float):
+        self.expires = expires
+
+
+class TrackMetadataCache:
+    """
+    In-memory cache of track metadata (title, filename) keyed by track id.
+
+    Party payloads need the current track title on every broadcast; this
+    keeps those lookups off SQLite. Entries are loaded on first use and
+    bounded LRU-style. Misses are cached for `miss_ttl` seconds only, so a
+    track created by another process shows up without an invalidation.
+    `generation` changes whenever an entry is replaced or invalidated, so
+    callers memoizing derived payloads can tell when a title they used may
+    have changed.
+    """
+
+    def __init__(self, max_entries: int = 10000, media_dir: str = MEDIA_DIR,
+                 miss_ttl: float = TRACK_CACHE_MISS_TTL):
+        self.max_entries = max_entries
+        self.media_dir = media_dir
+        self.miss_ttl = miss_ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, object]" = OrderedDict()
+
+    def get(self, track_id: int) -> Optional[Dict]:
+        entry = self._entries.get(track_id)
+        if entry is not None and not (isinstance(entry, _Missing) and entry.expires <= time.monotonic()):
+            self._entries.move_to_end(track_id)
+            self.hits += 1
+            return None if isinstance(entry, _Missing) else entry
+
+        self.misses += 1
+        db = SessionLocal()
+        try:
+            track = db.query(Track).filter(Track.id == track_id).first()
+            if track is not None and entry is not None:
+                self.generation += 1  # Was cached as missing: titles built from that are stale
+            entry = self._store(track_id, track)
+        finally:
+            db.close()
+        return None if isinstance(entry, _Missing) else entry
+
+    def get_title(self, track_id: int | None, default: str | None = None) -> str | None:
+        if not track_id:
+            return default
+        entry = self.get(track_id)
+        return entry["title"] if entry else default
+
+    def get_duration(self, track_id: int | None) -> Optional[float]:
+        """Duration in seconds if already probed (never does I/O)."""
+        entry = self._entries.get(track_id)
+        if entry is None or isinstance(entry, _Missing):
+            return None
+        return entry.get("duration") or None
+
+    async def load_duration(self, track_id: int) -> Optional[float]:
+        """Probes the file with ffprobe in a worker thread, once per track."""
+        entry = self.get(track_id)
+        if entry is None:
+            return None
+        if "duration" not in entry:
+            entry["duration"] = 0.0  # Marks the probe as started/failed
+            path = os.path.join(self.media_dir, entry["filename"])
+            info = await asyncio.to_thread(get_audio_info, path)
+            try:
+                entry["duration"] = float(info.get("format", {}).get("duration", 0))
+            except (TypeError, ValueError):
+                pass
+        return entry["duration"] or None
+
+    def put(self, track: Track):
+        """Record a track that was just created or changed."""
+        self._store(track.id, track)
+        self.generation += 1
+
+    def invalidate(self, track_id: int | None = None):
+        """Forget one track (or everything) so the next lookup hits the database."""
+        if track_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(track_id, None)
+        self.generation += 1
+
+    def _store(self, track_id: int, track: Track | None):
+        if track is not None:
+            entry = {"title": track.title, "filename": track.filename}
+        else:
+            entry = _Missing(time.monotonic() + self.miss_ttl)
+        self._entries[track_id] = entry
+        self._entries.move_to_end(track_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+track_cache = TrackMetadataCache()
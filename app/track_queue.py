@@ -0,0 +1,320 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Entries per block: blocks split at twice this. Small enough that the
+# C-level list.insert/list.index inside a block stay in the microseconds.
+BLOCK_SIZE = 256
+
+
+class _Entry:
+    """One queue slot. Identity matters: the same track may be queued twice."""
+
+    __slots__ = ("track_id", "seq", "block")
+
+    def __init__(self, track_id: int, seq: int):
+        self.track_id = track_id
+        self.seq = seq
+        self.block: Optional["_Block"] = None
+
+
+class _Block(list):
+    # pos: index of the block in TrackQueue._blocks; ids: its track ids, for
+    # to_list() (None once the block changed)
+    __slots__ = ("pos", "ids")
+
+    def __init__(self):
+        super().__init__()
+        self.ids: Optional[List[int]] = None
+
+
+class TrackQueue:
+    """
+    Play queue of track ids with O(log n) positional operations.
+
+    Entries live in a list of small blocks, with a Fenwick tree over the
+    block sizes to turn a position into (block, offset) and back, and an
+    index from track id to its entries. `insert`, `pop`, `move`,
+    `index(track_id)` and `remove(track_id)` therefore cost a tree walk plus
+    a bounded list operation, instead of scanning or shifting the whole
+    queue (5k+ track playlists). The same track may appear more than once;
+    lookups by id refer to its first occurrence, like list.index().
+
+    Every entry also gets a sequence number when it is added, unique within
+    the queue and kept when other entries come and go (or it is moved): the
+    stable identity shuffle keys are derived from (see app.shuffle).
+    Appended entries get increasing numbers; `renumber()` restarts them at
+    0 in queue order.
+
+    The list form needed for payloads is built at most once per revision,
+    by the first to_list() after a mutation; mutations only drop it, so they
+    stay O(log n) however often the queue is broadcast. Each block keeps its
+    own track-id list, so the rebuild re-reads only the blocks that changed
+    and copies the rest at C speed. A new list every revision, never an
+    in-place edit, because earlier lists are still held by published
+    snapshots (DeltaTracker compares against them).
+    """
+
+    __slots__ = ("_blocks", "_tree", "_size", "_entries", "_by_seq", "_next_seq", "_list", "revision")
+
+    def __init__(self, track_ids: Iterable[int] = (), seqs: Optional[Sequence[int]] = None):
+        """`seqs` restores the sequence numbers of a saved queue (see seqs())."""
+        self._blocks: List[_Block] = []
+        self._tree: List[int] = [0]
+        self._size = 0
+        self._entries: Dict[int, List[_Entry]] = {}
+        self._by_seq: Dict[int, _Entry] = {}
+        self._next_seq = 0
+        self._list: Optional[List[int]] = None
+        self.revision = 0 # Bumped by every mutation
+        self.extend(track_ids, seqs)
+
+    # --- Reading ---
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __contains__(self, track_id) -> bool:
+        return track_id in self._entries
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_list())
+
+    def __getitem__(self, position: int) -> int:
+        block, offset = self._locate(self._normalize(position))
+        return block[offset].track_id
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TrackQueue):
+            return self.to_list() == other.to_list()
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"TrackQueue({self.to_list()!r})"
+
+    def count(self, track_id: int) -> int:
+        return len(self._entries.get(track_id, ()))
+
+    def index(self, track_id: int) -> int:
+        """Position of the first occurrence of `track_id` (ValueError if absent)."""
+        entries = self._entries.get(track_id)
+        if not entries:
+            raise ValueError(f"{track_id} is not in queue")
+        return min(self._position(entry) for entry in entries)
+
+    def seq_at(self, position: int) -> int:
+        block, offset = self._locate(self._normalize(position))
+        return block[offset].seq
+
+    def position_of(self, seq: int) -> int:
+        """Position of the entry with sequence number `seq` (KeyError if absent)."""
+        return self._position(self._by_seq[seq])
+
+    def seqs_of(self, track_id: int) -> List[int]:
+        """Sequence numbers of the entries of one track."""
+        return [entry.seq for entry in self._entries.get(track_id, ())]
+
+    def seqs(self) -> List[int]:
+        """Sequence numbers in queue order."""
+        return [entry.seq for block in self._blocks for entry in block]
+
+    def to_list(self) -> List[int]:
+        """The queue as a list. Shared, and never modified afterwards: do not modify it."""
+        if self._list is None:
+            result: List[int] = []
+            for block in self._blocks:
+                if block.ids is None:
+                    block.ids = [entry.track_id for entry in block]
+                result.extend(block.ids) # A C-level copy, as fast as list.copy()
+            self._list = result
+        return self._list
+
+    # --- Mutating ---
+
+    def append(self, track_id: int):
+        self.insert(self._size, track_id)
+
+    def extend(self, track_ids: Iterable[int], seqs: Optional[Sequence[int]] = None):
+        """Appends many entries at once, filling whole blocks."""
+        track_ids = list(track_ids)
+        if not track_ids:
+            return
+        if seqs is None:
+            seqs = range(self._next_seq, self._next_seq + len(track_ids))
+        elif len(seqs) != len(track_ids):
+            raise ValueError("one sequence number per track id")
+        entries = [_Entry(track_id, seq) for track_id, seq in zip(track_ids, seqs)]
+        for entry in entries:
+            self._entries.setdefault(entry.track_id, []).append(entry)
+            self._by_seq[entry.seq] = entry
+        self._next_seq = max(self._next_seq, max(seqs) + 1)
+        self.revision += 1
+        start = 0
+        if self._blocks and len(self._blocks[-1]) < BLOCK_SIZE:
+            last = self._blocks[-1]
+            start = BLOCK_SIZE - len(last)
+            self._fill(last, entries[:start])
+        for i in range(start, len(entries), BLOCK_SIZE):
+            block = _Block()
+            self._blocks.append(block)
+            self._fill(block, entries[i:i + BLOCK_SIZE])
+        self._size += len(entries)
+        self._reindex_blocks()
+        self._list = None
+
+    def insert(self, position: int, track_id: int):
+        """Inserts before `position` (clamped to the queue bounds, like list.insert)."""
+        if position < 0:
+            position = max(0, position + self._size)
+        entry = _Entry(track_id, self._next_seq)
+        self._next_seq += 1
+        self._entries.setdefault(track_id, []).append(entry)
+        self._by_seq[entry.seq] = entry
+        self._insert_entry(min(position, self._size), entry)
+
+    def pop(self, position: int = -1) -> int:
+        entry = self._detach(self._normalize(position))
+        entries = self._entries[entry.track_id]
+        entries.remove(entry)
+        if not entries:
+            del self._entries[entry.track_id]
+        del self._by_seq[entry.seq]
+        return entry.track_id
+
+    def remove(self, track_id: int):
+        """Removes the first occurrence of `track_id` (ValueError if absent)."""
+        self.pop(self.index(track_id))
+
+    def move(self, source: int, destination: int):
+        """Moves the entry at `source` so that it ends up at `destination`."""
+        entry = self._detach(self._normalize(source))
+        self._insert_entry(max(0, min(destination, self._size)), entry)
+
+    def clear(self):
+        """Empties the queue. Sequence numbers keep increasing from where they were."""
+        self._blocks.clear()
+        self._tree = [0]
+        self._size = 0
+        self._entries.clear()
+        self._by_seq.clear()
+        self._list = None
+        self.revision += 1
+
+    def renumber(self):
+        """Gives the entries sequence numbers 0, 1, ... in queue order."""
+        self._by_seq.clear()
+        for seq, entry in enumerate(entry for block in self._blocks for entry in block):
+            entry.seq = seq
+            self._by_seq[seq] = entry
+        self._next_seq = self._size
+        self.revision += 1
+
+    def copy(self) -> "TrackQueue":
+        """Same entries and sequence numbers."""
+        queue = TrackQueue(self.to_list(), self.seqs())
+        queue._next_seq = self._next_seq
+        return queue
+
+    # --- Internals ---
+
+    def _normalize(self, position: int) -> int:
+        if position < 0:
+            position += self._size
+        if not 0 <= position < self._size:
+            raise IndexError("queue index out of range")
+        return position
+
+    @staticmethod
+    def _fill(block: _Block, entries: List[_Entry]):
+        block.extend(entries)
+        block.ids = None
+        for entry in entries:
+            entry.block = block
+
+    def _reindex_blocks(self):
+        """Renumbers blocks and rebuilds the Fenwick tree (after adding/removing blocks)."""
+        tree = [0] * (len(self._blocks) + 1)
+        for i, block in enumerate(self._blocks):
+            block.pos = i
+            i += 1
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _add(self, pos: int, delta: int):
+        tree = self._tree
+        i = pos + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _block_start(self, pos: int) -> int:
+        """Number of entries before block `pos`."""
+        tree = self._tree
+        total = 0
+        while pos > 0:
+            total += tree[pos]
+            pos -= pos & -pos
+        return total
+
+    def _locate(self, position: int) -> Tuple[_Block, int]:
+        """(block, offset) of an existing position, by descending the Fenwick tree."""
+        tree = self._tree
+        pos = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(tree) and tree[nxt] <= position:
+                pos = nxt
+                position -= tree[nxt]
+            step >>= 1
+        return self._blocks[pos], position
+
+    def _position(self, entry: _Entry) -> int:
+        block = entry.block
+        return self._block_start(block.pos) + block.index(entry)
+
+    def _insert_entry(self, position: int, entry: _Entry):
+        if not self._blocks:
+            block = _Block()
+            self._blocks.append(block)
+            self._reindex_blocks()
+            offset = 0
+        elif position == self._size:
+            block = self._blocks[-1]
+            offset = len(block)
+        else:
+            block, offset = self._locate(position)
+        block.insert(offset, entry)
+        block.ids = None
+        entry.block = block
+        self._size += 1
+        self.revision += 1
+        self._list = None
+        if len(block) > 2 * BLOCK_SIZE:
+            tail = _Block()
+            self._fill(tail, block[BLOCK_SIZE:])
+            del block[BLOCK_SIZE:]
+            self._blocks.insert(block.pos + 1, tail)
+            self._reindex_blocks()
+        else:
+            self._add(block.pos, 1)
+
+    def _detach(self, position: int) -> _Entry:
+        block, offset = self._locate(position)
+        entry = block.pop(offset)
+        block.ids = None
+        self._size -= 1
+        self.revision += 1
+        self._list = None
+        if block:
+            self._add(block.pos, -1)
+        else:
+            del self._blocks[block.pos]
+            self._reindex_blocks()
+        return entry
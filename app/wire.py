@@ -0,0 +1,78 @@
+import json
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # Optional: without it every client uses JSON
+    msgpack = None
+
+
+class MessageDecodeError(ValueError):
+    """An inbound frame or payload that cannot be understood."""
+
+
+class JsonCodec:
+    """Default wire encoding: compact JSON in text frames."""
+
+    name = "json"
+    binary = False
+
+    def encode(self, message: dict) -> str:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, data: str | bytes) -> Any:
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            raise MessageDecodeError(f"invalid JSON: {e}") from None
+
+
+class MsgpackCodec:
+    """MessagePack in binary frames. Integer queues shrink to 1-3 bytes per id."""
+
+    name = "msgpack"
+    binary = True
+
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise MessageDecodeError(f"invalid MessagePack: {e}") from None
+
+
+JSON_CODEC = JsonCodec()
+
+# Available encodings by WebSocket subprotocol name
+CODECS: Dict[str, Any] = {JSON_CODEC.name: JSON_CODEC}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def negotiate_codec(offered: Iterable[str]) -> Tuple[Any, Optional[str]]:
+    """
+    Picks the first subprotocol the client offered that the server supports.
+
+    Returns (codec, subprotocol to accept). Clients that offer nothing, or
+    nothing we know, get JSON and no subprotocol (the pre-negotiation
+    behaviour).
+    """
+    for name in offered:
+        codec = CODECS.get(name)
+        if codec is not None:
+            return codec, name
+    return JSON_CODEC, None
+
+
+def decode_frame(message: dict) -> Any:
+    """Decodes a raw ASGI websocket.receive message, whatever the frame type."""
+    if message.get("text") is not None:
+        return JSON_CODEC.decode(message["text"])
+    data = message.get("bytes")
+    if data is None:
+        raise MessageDecodeError("empty frame")
+    if msgpack is None:
+        raise MessageDecodeError("binary frames are not supported")
+    return CODECS[MsgpackCodec.name].decode(data)
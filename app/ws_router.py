@@ -0,0 +1,136 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from app.histogram import FANOUT_BUCKETS, LATENCY_BUCKETS, Histogram
+from app.outbound import fanout_counter
+from app.structured_log import get_logger
+
+log = get_logger("ws_router")
+
+
+class MessageContext:
+    """
+    One inbound WebSocket message on its way through the middleware to its
+    handler. Middleware fills in what the handlers share: the user's party
+    and, for playback/queue changes, the state they act on.
+    """
+
+    __slots__ = ("connection", "user_id", "msg_type", "payload", "party", "target", "is_party_action")
+
+    def __init__(self, connection, user_id: str, msg_type: str, payload: Dict):
+        self.connection = connection
+        self.user_id = user_id
+        self.msg_type = msg_type
+        self.payload = payload
+        self.party = None
+        self.target = None  # Party or solo PlayerState the message changes
+        self.is_party_action = False
+
+
+# Middleware: returns False to stop the message there (not permitted, not
+# applicable, or already taken care of, e.g. forwarded to another worker)
+Guard = Callable[[MessageContext], Any]
+Handler = Callable[[MessageContext], Awaitable[None]]
+
+
+class MessageMetrics:
+    __slots__ = ("skipped", "errors", "handle_time", "fanout")
+
+    def __init__(self):
+        self.skipped = 0
+        self.errors = 0
+        self.handle_time = Histogram(LATENCY_BUCKETS)  # Seconds, middleware included
+        self.fanout = Histogram(FANOUT_BUCKETS)  # Messages queued to connections
+
+    def stats(self, total_time: float) -> Dict:
+        return {
+            "count": self.handle_time.count,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "time_share": round(self.handle_time.sum / total_time, 4) if total_time else 0.0,
+            "total_ms": round(self.handle_time.sum * 1000, 1),
+            "handle_ms": self.handle_time.stats(scale=1000),
+            "fanout": {**self.fanout.stats(digits=1), "total": int(self.fanout.sum)},
+        }
+
+
+class _Route:
+    __slots__ = ("handler", "guards", "metrics")
+
+    def __init__(self, handler: Handler, guards: List[Tuple[Guard, bool]]):
+        self.handler = handler
+        self.guards = guards
+        self.metrics = MessageMetrics()
+
+
+def _guard(fn: Guard) -> Tuple[Guard, bool]:
+    return fn, asyncio.iscoroutinefunction(fn)
+
+
+class MessageRouter:
+    """
+    msg_type -> handler, with shared middleware in front of every handler
+    (router-wide ones added with use(), then the route's own guards) and
+    errors isolated per message: a failing handler is logged and answered
+    with an error message instead of taking the connection down.
+
+    Every message type records its handling time and fan-out (messages
+    queued to connections while it ran, counted through a context variable
+    so concurrent connections don't mix) in fixed-bucket histograms.
+    """
+
+    def __init__(self):
+        self.routes: Dict[str, _Route] = {}
+        self.middleware: List[Tuple[Guard, bool]] = []
+        self.unhandled = 0
+
+    def use(self, guard: Guard) -> Guard:
+        self.middleware.append(_guard(guard))
+        return guard
+
+    def on(self, msg_type: str, *guards: Guard):
+        """Registers the decorated coroutine as the handler of `msg_type`, behind `guards`."""
+        def register(handler: Handler) -> Handler:
+            self.routes[msg_type] = _Route(handler, [_guard(g) for g in guards])
+            return handler
+        return register
+
+    async def dispatch(self, ctx: MessageContext):
+        route = self.routes.get(ctx.msg_type)
+        if route is None:
+            self.unhandled += 1
+            return
+        metrics = route.metrics
+        fanout = [0]
+        token = fanout_counter.set(fanout)
+        started = time.perf_counter()
+        try:
+            for guards in (self.middleware, route.guards):
+                for guard, is_async in guards:
+                    if not (await guard(ctx) if is_async else guard(ctx)):
+                        metrics.skipped += 1
+                        return
+            await route.handler(ctx)
+        except Exception as e:
+            metrics.errors += 1
+            log.exception("handler_failed", f"❌ Erro ao tratar {ctx.msg_type} de {ctx.user_id}: {e!r}",
+                          msg_type=ctx.msg_type, user_id=ctx.user_id)
+            ctx.connection.send({"type": "error", "payload": {
+                "message": f"Falha ao processar {ctx.msg_type}", "code": "HANDLER_ERROR",
+            }})
+        finally:
+            metrics.handle_time.observe(time.perf_counter() - started)
+            metrics.fanout.observe(fanout[0])
+            fanout_counter.reset(token)
+
+    def stats(self) -> Dict:
+        """Per message type, heaviest (total handling time) first."""
+        routes = sorted(self.routes.items(), key=lambda item: -item[1].metrics.handle_time.sum)
+        total_time = sum(route.metrics.handle_time.sum for _, route in routes)
+        return {
+            "messages": sum(route.metrics.handle_time.count for _, route in routes),
+            "unhandled": self.unhandled,
+            "total_ms": round(total_time * 1000, 1),
+            "per_type": {t: route.metrics.stats(total_time) for t, route in routes if route.metrics.handle_time.count},
+        }
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Lobby join storm: N clients connect within a short ramp and send user_join.
+
+Drives the real websocket_endpoint with in-memory sockets and reports CPU
+time, lobby flushes and bytes queued. Run it with several client counts to
+check that CPU grows linearly; --interval-ms 0 approximates the old
+broadcast-per-event behaviour for comparison.
+
+    python benchmarks/lobby_join_storm.py --clients 100 250 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+
+class FakeWebSocket:
+    """Minimal WebSocket: replays scripted inbound messages, counts outbound bytes."""
+
+    scope = {"subprotocols": []}
+
+    def __init__(self, inbound):
+        self.inbound = asyncio.Queue()
+        for message in inbound:
+            self.inbound.put_nowait(message)
+        self.bytes_received = 0
+        self.messages_received = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        message = await self.inbound.get()
+        if message is None:
+            return {"type": "websocket.disconnect", "code": 1000}
+        return {"type": "websocket.receive", "text": json.dumps(message)}
+
+    async def send_text(self, text):
+        self.bytes_received += len(text)
+        self.messages_received += 1
+
+    async def close(self, code=1000):
+        self.inbound.put_nowait(None)
+
+
+async def connect_later(delay, ws, user_id):
+    await asyncio.sleep(delay)
+    await main.websocket_endpoint(ws, user_id)
+
+
+async def storm(clients: int, ramp: float, settle: float):
+    main.sessions.__init__()
+    main.manager.__init__(main.sessions)
+    main.lobby.__init__(main.lobby.build_entries, main.lobby.publish, main.lobby.interval)
+
+    sockets = [FakeWebSocket([{"type": "user_join", "payload": {"name": f"user{i}"}}]) for i in range(clients)]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    tasks = [asyncio.create_task(connect_later(ramp * i / clients, ws, f"bench{i}"))
+             for i, ws in enumerate(sockets)]
+    await asyncio.sleep(ramp + settle)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    for ws in sockets:
+        ws.inbound.put_nowait(None)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        "clients": clients,
+        "cpu_s": cpu,
+        "wall_s": wall,
+        "flushes": main.lobby.flushes,
+        "lobby_requests": main.lobby.requests,
+        "bytes": sum(ws.bytes_received for ws in sockets),
+        "messages": sum(ws.messages_received for ws in sockets),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 250, 500])
+    parser.add_argument("--interval-ms", type=float, default=None,
+                        help="override LOBBY_FLUSH_INTERVAL_MS for this run")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which clients arrive")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to let flushes drain")
+    args = parser.parse_args()
+
+    if args.interval_ms is not None:
+        main.lobby.interval = args.interval_ms / 1000
+
+    print(f"lobby flush interval: {main.lobby.interval * 1000:.0f} ms")
+    print(f"{'clients':>8}{'cpu s':>9}{'cpu ms/client':>15}{'flushes':>9}{'messages':>10}{'MB sent':>9}")
+    for n in args.clients:
+        r = asyncio.run(storm(n, args.ramp, args.settle))
+        print(f"{r['clients']:>8}{r['cpu_s']:>9.2f}{r['cpu_s'] * 1000 / n:>15.2f}"
+              f"{r['flushes']:>9}{r['messages']:>10}{r['bytes'] / 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Multi-worker load test: parties whose members are spread over W uvicorn
+workers sharing one pub/sub broker (app/pubsub_broker.py, PUBSUB_URL).
+
+Every party member chats in a closed loop (send, wait for its own message
+to come back through the party broadcast). Reports delivered messages per
+second and round-trip latency for each worker count, so throughput can be
+compared as workers are added:
+
+    python benchmarks/pubsub_scaling.py --workers 1 2 4 --parties 20 --members 5
+
+Workers only scale with the cores the machine has; on a single core the
+numbers mostly show the cost of the bus hops.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import websockets
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+class Client:
+    def __init__(self, port: int, name: str):
+        self.port = port
+        self.user_id = f"bench-{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.ws = None
+        self.party_id = None
+        self.joined = asyncio.Event()
+        self.echo = asyncio.Event()
+        self.received = 0
+        self.latencies = []
+
+    async def connect(self):
+        self.ws = await websockets.connect(f"ws://127.0.0.1:{self.port}/ws/{self.user_id}", max_size=None)
+        self.reader = asyncio.create_task(self.read())
+        await self.send("user_join", {"name": self.name})
+
+    async def send(self, msg_type: str, payload: dict):
+        await self.ws.send(json.dumps({"type": msg_type, "payload": payload}))
+
+    async def read(self):
+        try:
+            async for raw in self.ws:
+                message = json.loads(raw)
+                self.received += 1
+                kind = message.get("type")
+                if kind == "party_sync":
+                    self.party_id = message["payload"].get("party_id")
+                    self.joined.set()
+                elif kind == "chat_message" and message["payload"].get("author") == self.name:
+                    self.echo.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    async def chat_loop(self, until: float):
+        n = 0
+        while time.monotonic() < until:
+            self.echo.clear()
+            sent = time.perf_counter()
+            await self.send("chat_message", {"text": f"{self.name} {n}"})
+            try:
+                await asyncio.wait_for(self.echo.wait(), 5.0)
+            except asyncio.TimeoutError:
+                continue  # Counted as missing from the latencies
+            self.latencies.append(time.perf_counter() - sent)
+            n += 1
+
+    async def close(self):
+        await self.ws.close()
+        self.reader.cancel()
+
+
+async def build_parties(ports, parties: int, members: int):
+    groups = []
+    for p in range(parties):
+        host = Client(ports[p % len(ports)], f"h{p}")
+        await host.connect()
+        await host.send("create_party", {})
+        await asyncio.wait_for(host.joined.wait(), 10)
+        group = [host]
+        for m in range(1, members):
+            # Members land on the other workers, so the party spans all of them
+            group.append(Client(ports[(p + m) % len(ports)], f"p{p}m{m}"))
+        groups.append(group)
+    await asyncio.gather(*(c.connect() for g in groups for c in g[1:]))
+    for group in groups:
+        for client in group[1:]:
+            # Another worker learns about the party through presence: retry until it does
+            for _ in range(50):
+                await client.send("join_party", {"party_id": group[0].party_id})
+                try:
+                    await asyncio.wait_for(client.joined.wait(), 0.3)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                raise RuntimeError(f"{client.name} could not join party {group[0].party_id}")
+    return groups
+
+
+async def measure(ports, parties: int, members: int, duration: float):
+    groups = await build_parties(ports, parties, members)
+    clients = [c for g in groups for c in g]
+    await asyncio.sleep(0.5)
+    start_received = sum(c.received for c in clients)
+    started = time.monotonic()
+    await asyncio.gather(*(c.chat_loop(started + duration) for c in clients))
+    elapsed = time.monotonic() - started
+    received = sum(c.received for c in clients) - start_received
+    latencies = sorted(l for c in clients for l in c.latencies)
+    await asyncio.gather(*(c.close() for c in clients))
+    return {
+        "chats_per_s": len(latencies) / elapsed,
+        "delivered_per_s": received / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+    }
+
+
+def start_workers(count: int, broker_url: str):
+    env = dict(os.environ, PUBSUB_URL=broker_url, CLUSTER_PRESENCE_INTERVAL="1")
+    ports, procs = [], []
+    for _ in range(count):
+        port = free_port()
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        ports.append(port)
+    return ports, procs
+
+
+async def run(worker_counts, parties: int, members: int, duration: float):
+    broker_port = free_port()
+    broker = subprocess.Popen([sys.executable, "-m", "app.pubsub_broker", "--port", str(broker_port)],
+                              cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        await wait_port(broker_port)
+        print(f"{'workers':>7} {'chats/s':>9} {'delivered/s':>12} {'p50 ms':>8} {'p99 ms':>8}")
+        for count in worker_counts:
+            ports, procs = start_workers(count, f"redis://127.0.0.1:{broker_port}")
+            try:
+                for port in ports:
+                    await wait_port(port)
+                await asyncio.sleep(1.5)  # First presence round between the workers
+                r = await measure(ports, parties, members, duration)
+                print(f"{count:>7} {r['chats_per_s']:>9.0f} {r['delivered_per_s']:>12.0f} "
+                      f"{r['p50_ms'] or 0:>8.1f} {r['p99_ms'] or 0:>8.1f}")
+            finally:
+                for proc in procs:
+                    proc.terminate()
+                for proc in procs:
+                    proc.wait()
+    finally:
+        broker.terminate()
+        broker.wait()
+    print(f"(cpus: {os.cpu_count()})")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--parties", type=int, default=20)
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.workers, args.parties, args.members, args.duration))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Queue changes end to end: a queue_action on a party followed by the sync
+broadcast it triggers, the path every add/remove takes in main.py.
+
+Each operation is the queue change, mark_dirty() and Party.broadcast_sync():
+the payload (PlayerState.to_dict with the queue list), the field delta, the
+event log entry and the fan-out to --members connections, which encode the
+message once (SharedMessage) like the outbound writers do. "add" appends a
+track, "remove" removes a random entry (play order), "change" is a
+change_track to a queued track (play_index + set_current_track).
+
+The "list" row is the queue as a plain list copied into every payload, as
+before TrackQueue, for reference; "shuffled" is TrackQueue with shuffle on,
+where every operation also goes through the play order (app.shuffle):
+
+    python benchmarks/queue_broadcast.py --sizes 10 1000 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from app.outbound import encode_message  # noqa: E402
+
+
+class EncodingConnection:
+    """Stands in for app.outbound.Connection: encodes what it is sent, nothing else."""
+
+    def send(self, message):
+        encode_message(message)
+
+    def close(self):
+        pass
+
+
+class ListQueue(list):
+    """The pre-TrackQueue queue: a list, copied for every payload."""
+
+    def to_list(self):
+        return list(self)
+
+
+def make_party(size: int, members: int, backend: str):
+    manager = main.ConnectionManager(main.SessionRegistry())
+    member_ids = [f"user{i}" for i in range(members)]
+    party = main.Party(host_id=member_ids[0], host_name=member_ids[0])
+    for uid in member_ids:
+        manager.sessions.add_connection(uid, EncodingConnection())
+        manager.user_names[uid] = uid
+        manager.subscribe(uid, main.party_topic(party.party_id))
+    party.members.update(member_ids)
+    ids = [i % max(1, size // 2) + 1 for i in range(size)]  # Every track queued twice
+    if backend == "list":
+        party._queue = ListQueue(ids)  # Past the setter, which would convert it
+    else:
+        party.queue = ids
+    if backend == "shuffled":
+        party.shuffle(seed=size)
+    return manager, party
+
+
+async def measure(size: int, members: int, backend: str, min_time: float) -> dict:
+    manager, party = make_party(size, members, backend)
+    await party.broadcast_sync(manager)
+    rng = random.Random(size)
+    timings = {"add": [], "remove": [], "change": []}
+    started = time.perf_counter()
+    while time.perf_counter() - started < min_time:
+        t0 = time.perf_counter()
+        party.append(rng.randint(1, size))
+        party.mark_dirty()
+        await party.broadcast_sync(manager)
+        t1 = time.perf_counter()
+        party.remove_at(rng.randrange(len(party.queue)))
+        party.mark_dirty()
+        await party.broadcast_sync(manager)
+        t2 = time.perf_counter()
+        party.current_index = party.play_index(party.queue[rng.randrange(len(party.queue))])
+        party.set_current_track()
+        party.mark_dirty()
+        await party.broadcast_sync(manager)
+        t3 = time.perf_counter()
+        timings["add"].append(t1 - t0)
+        timings["remove"].append(t2 - t1)
+        timings["change"].append(t3 - t2)
+    return {op: sorted(values)[len(values) // 2] * 1e6 for op, values in timings.items()}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 5000])
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds per measurement")
+    args = parser.parse_args()
+
+    # Titles come from the track cache; keep the benchmark off SQLite
+    main.track_cache.get_title = lambda track_id, default=None: f"Track {track_id}" if track_id else default
+
+    print(f"{'size':>8}{'backend':>12}{'add us':>10}{'remove us':>11}{'change us':>11}"
+          f"   (median, {args.members} members)")
+    for size in args.sizes:
+        for backend in ("list", "TrackQueue", "shuffled"):
+            result = asyncio.run(measure(size, args.members, backend, args.min_time))
+            print(f"{size:>8}{backend:>12}{result['add']:>10.1f}{result['remove']:>11.1f}{result['change']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Queue operations: plain list vs TrackQueue (app/track_queue.py).
+
+Measures the operations the queue handlers do — positional insert, remove
+from the middle, move, lookup by track id (change_track) and removal by
+track id — at several queue sizes.
+Track ids repeat, as they do when a track is queued twice.
+
+The "+payload" columns follow every operation with the list a state
+broadcast puts in its payload, as the handlers do: a copy of the plain
+list (as before TrackQueue) or TrackQueue.to_list().
+
+    python benchmarks/queue_ops.py --sizes 10 1000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.track_queue import TrackQueue  # noqa: E402
+
+
+def make_ids(size: int):
+    rng = random.Random(size)
+    return [rng.randint(1, max(2, size // 2)) for _ in range(size)]
+
+
+def op_insert(q, rng, size):
+    q.insert(rng.randrange(size), rng.randint(1, size))
+    q.pop(rng.randrange(size))
+
+
+def op_remove(q, rng, size):
+    track_id = q.pop(rng.randrange(size))
+    q.insert(rng.randrange(size), track_id)
+
+
+def op_move(q, rng, size):
+    source, destination = rng.randrange(size), rng.randrange(size)
+    if isinstance(q, list):
+        q.insert(destination, q.pop(source))
+    else:
+        q.move(source, destination)
+
+
+def op_index(q, rng, size):
+    # Late entries are the worst case for list.index
+    track_id = q[size - 1 - rng.randrange(max(1, size // 10))]
+    q.index(track_id)
+
+
+def op_remove_by_id(q, rng, size):
+    track_id = q[size - 1 - rng.randrange(max(1, size // 10))]
+    q.remove(track_id)
+    q.append(track_id)
+
+
+OPERATIONS = {
+    "insert": op_insert,
+    "remove": op_remove,
+    "move": op_move,
+    "index(id)": op_index,
+    "remove(id)": op_remove_by_id,
+}
+
+
+def payload(queue):
+    return list(queue) if isinstance(queue, list) else queue.to_list()
+
+
+def time_op(queue, op, size: int, min_time: float, with_payload: bool = False) -> float:
+    """Microseconds per operation (plus building the payload list after it, with `with_payload`)."""
+    rng = random.Random(1)
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(100):
+            op(queue, rng, size)
+            if with_payload:
+                payload(queue)
+        count += 100
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / count * 1e6
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--min-time", type=float, default=0.3, help="seconds per measurement")
+    args = parser.parse_args()
+
+    print(f"{'size':>8}{'operation':>12}{'list us':>10}{'TrackQueue us':>15}{'speedup':>9}"
+          f"{'+payload list':>15}{'+payload TQ':>13}{'speedup':>9}")
+    for size in args.sizes:
+        ids = make_ids(size)
+        start = time.perf_counter()
+        TrackQueue(ids)
+        build_ms = (time.perf_counter() - start) * 1000
+        for name, op in OPERATIONS.items():
+            list_us = time_op(list(ids), op, size, args.min_time)
+            tree_us = time_op(TrackQueue(ids), op, size, args.min_time)
+            list_payload_us = time_op(list(ids), op, size, args.min_time, with_payload=True)
+            tree_payload_us = time_op(TrackQueue(ids), op, size, args.min_time, with_payload=True)
+            print(f"{size:>8}{name:>12}{list_us:>10.2f}{tree_us:>15.2f}{list_us / tree_us:>8.1f}x"
+                  f"{list_payload_us:>15.2f}{tree_payload_us:>13.2f}{list_payload_us / tree_payload_us:>8.1f}x")
+        print(f"{size:>8}{'build':>12}{'':>10}{build_ms * 1000:>15.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
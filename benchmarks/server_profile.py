@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Launch profiles compared: the old container command (uvicorn --reload)
+against serve.py, the production profile.
+
+For each profile the server is started the way the container would start
+it, against synthetic fixtures (see stream_throughput.py), and measured
+with: time to first response, a /stream Range storm and a thundering herd,
+and WebSocket parties (ws_load.py). CPU and RSS are summed over the whole
+process tree, so the reloader process and its file watcher count too:
+
+    python benchmarks/server_profile.py --clients 20 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pubsub_scaling import ROOT, free_port, wait_port  # noqa: E402
+from stream_throughput import MB, prepare_fixtures, run_scenario  # noqa: E402
+from ws_load import run_load  # noqa: E402
+
+PROFILES = {
+    "reload": lambda port: [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                            "--port", str(port), "--reload"],
+    "serve": lambda port: [sys.executable, "serve.py"],
+}
+
+
+def process_tree(pid: int) -> list:
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+class TreeCpu:
+    """CPU seconds (utime + stime) of a process and all its descendants."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def read(self):
+        total = 0.0
+        for pid in process_tree(self.pid):
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            except (OSError, IndexError, ValueError):
+                pass
+        return total
+
+
+def tree_rss_mb(pid: int) -> float:
+    total = 0
+    for child in process_tree(pid):
+        try:
+            with open(f"/proc/{child}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            pass
+    return round(total / 1024, 1)
+
+
+async def first_response(port: int, timeout: float = 60.0) -> float:
+    started = time.perf_counter()
+    await wait_port(port, timeout)
+    import httpx
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() - started < timeout:
+            try:
+                if (await client.get(f"http://127.0.0.1:{port}/library")).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.01)
+    return time.perf_counter() - started
+
+
+async def measure(profile: str, workdir: str, track_ids, size: int, clients: int, duration: float) -> dict:
+    port = free_port()
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port), MEDIA_DIR=os.path.join(workdir, "media"),
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'library.db')}", SHOW_NETWORK_URL="0",
+               LOG_LEVEL="WARNING")
+    started = time.perf_counter()
+    proc = subprocess.Popen(PROFILES[profile](port), cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await first_response(port)
+        startup = time.perf_counter() - started
+        base = f"http://127.0.0.1:{port}"
+        cpu = TreeCpu(proc.pid)
+        idle_before = cpu.read()
+        await asyncio.sleep(3)
+        idle_cpu = (cpu.read() - idle_before) / 3
+        ranges = await run_scenario("range", base, track_ids, size, clients, duration, 1, cpu, proc.pid)
+        herd = await run_scenario("herd", base, track_ids, size, clients, duration, 1, cpu, proc.pid)
+        ws = await run_load(f"ws://127.0.0.1:{port}", clients, 5, duration, 1.5, 0.5, 1, 100, cpu)
+        return {
+            "startup_ms": round(startup * 1000),
+            "idle_cpu_pct": round(idle_cpu * 100, 1),
+            "range_mb_s": ranges["mb_per_s"],
+            "range_p99_ms": ranges["latency_p99_ms"],
+            "herd_mb_s": herd["mb_per_s"],
+            "herd_ttfb_p99_ms": herd["ttfb_p99_ms"],
+            "ws_chat_p99_ms": ws["chat_latency_ms"]["p99"],
+            "ws_server_cpu_pct": ws["server_cpu_pct"],
+            "rss_mb": tree_rss_mb(proc.pid),
+            "processes": len(process_tree(proc.pid)),
+        }
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="profile-bench-")
+    size = int(args.size_mb * MB)
+    try:
+        track_ids = prepare_fixtures(workdir, 4, size)
+        results = {}
+        for profile in args.profiles:
+            results[profile] = await measure(profile, workdir, track_ids, size, args.clients, args.duration)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    keys = list(next(iter(results.values())).keys())
+    print(f"{'':<18}" + "".join(f"{p:>12}" for p in results))
+    for key in keys:
+        print(f"{key:<18}" + "".join(f"{results[p][key]!s:>12}" for p in results))
+    print(f"(cpus: {os.cpu_count()}, {args.clients} clients, {args.duration}s per scenario)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--size-mb", type=float, default=5.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
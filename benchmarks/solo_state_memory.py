@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Solo state memory: N synthetic users connect, queue some tracks and leave.
+
+Builds N solo PlayerStates in a SoloStateStore (app/solo_states.py),
+releases them all and runs one eviction sweep that spills them to a
+temporary SQLite database, then restores a sample as reconnects would.
+Reports the memory the states hold before and after the sweep (the
+sampled estimate used by /stats/memory and process RSS; --traced adds exact
+tracemalloc numbers, at the cost of much slower timings) and how long
+spilling and restoring take.
+
+    python benchmarks/solo_state_memory.py --users 100000 --queue 20
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import main  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.memory_report import measure, process_memory  # noqa: E402
+from app.solo_states import SoloStateStore  # noqa: E402
+
+
+def mb(n) -> str:
+    return "-" if n is None else f"{n / 1e6:.1f} MB"
+
+
+async def run(users: int, queue: int, restores: int, db_path: str, traced: bool):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    store = SoloStateStore(main.PlayerState, main.PlayerState.from_snapshot, ttl=0, spill=True,
+                           session_factory=sessionmaker(bind=engine))
+    rng = random.Random(users)
+    user_ids = [f"bench-{i:06d}" for i in range(users)]
+
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    for user_id in user_ids:
+        state = await store.acquire(user_id)
+        state.queue = [rng.randint(1, 50000) for _ in range(queue)]
+        state.current_index = 0
+        state.set_current_track()
+        state.to_dict()
+    build_s = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0] if traced else None
+    estimate = measure(store.values(), len(store))["approx_bytes"]
+    rss_full = process_memory()["rss_bytes"]
+
+    for user_id in user_ids:
+        store.release(user_id)
+    start = time.perf_counter()
+    evicted, spilled = await store.sweep()
+    sweep_s = time.perf_counter() - start
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0] if traced else None
+    tracemalloc.stop()
+    rss_after = process_memory()["rss_bytes"]
+
+    sample = rng.sample(user_ids, min(restores, users))
+    start = time.perf_counter()
+    for user_id in sample:
+        state = await store.acquire(user_id)
+        assert len(state.queue) == queue
+    restore_ms = (time.perf_counter() - start) / max(1, len(sample)) * 1000
+
+    print(f"users={users} queue={queue}")
+    print(f"  build:            {build_s:.2f} s")
+    print(f"  held (estimate):  {mb(estimate)}  ({estimate / users:.0f} B/user, sampled deep size as /stats/memory)")
+    if traced:
+        print(f"  held (traced):    {mb(held)}")
+    print(f"  RSS full:         {mb(rss_full)}")
+    print(f"  sweep:            {evicted} evicted, {spilled} spilled in {sweep_s:.2f} s")
+    if traced:
+        print(f"  traced after sweep: {mb(after)}  (spilled id index and SQLite buffers)")
+    print(f"  RSS after sweep:  {mb(rss_after)}")
+    print(f"  SQLite file:      {mb(os.path.getsize(db_path))}")
+    print(f"  restore:          {restore_ms:.2f} ms/user ({len(sample)} users)")
+    print(f"  stats:            {store.stats()}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--queue", type=int, default=20, help="tracks queued per user")
+    parser.add_argument("--restores", type=int, default=1000, help="users reconnecting after the sweep")
+    parser.add_argument("--traced", action="store_true", help="also measure with tracemalloc (slow)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args.users, args.queue, args.restores, os.path.join(tmp, "solo_states.db"), args.traced))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Startup time: how long a fresh server process takes to answer its first
+request, and how much of that is importing main.py.
+
+Each round runs, in new processes with an empty library (temporary
+MEDIA_DIR / DATABASE_URL) and SHOW_NETWORK_URL=0:
+
+- `import main` alone (also reports whether yt_dlp got imported);
+- uvicorn main:app, timed from spawn to the first 200 from GET /library
+  (startup hooks included).
+
+Medians over --rounds are reported. --budget-ms fails (exit 1) if the
+median time to first response is above it; --compare / --max-regression
+fail on a relative slowdown against a report saved with --json:
+
+    python benchmarks/startup_time.py --rounds 5 --budget-ms 2500
+    python benchmarks/startup_time.py --json after.json --compare before.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pubsub_scaling import ROOT, free_port  # noqa: E402
+from ws_load import git_revision  # noqa: E402
+
+IMPORT_PROBE = (
+    "import sys, time\n"
+    "started = time.perf_counter()\n"
+    "import main\n"
+    "print(time.perf_counter() - started, 'yt_dlp' in sys.modules)\n"
+)
+
+
+def server_env(workdir: str) -> dict:
+    return dict(os.environ, MEDIA_DIR=os.path.join(workdir, "media"),
+                DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'library.db')}",
+                SHOW_NETWORK_URL="0", LOG_LEVEL="WARNING")
+
+
+def measure_import(workdir: str):
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, env=server_env(workdir),
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[-2]), out[-1] == "True"
+
+
+def measure_first_response(workdir: str, timeout: float = 60.0) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=server_env(workdir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/library", timeout=5) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with {proc.returncode}")
+        raise RuntimeError("no response")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def run(rounds: int) -> dict:
+    imports, firsts, yt_dlp_loaded = [], [], False
+    for _ in range(rounds):
+        workdir = tempfile.mkdtemp(prefix="startup-bench-")
+        try:
+            seconds, loaded = measure_import(workdir)
+            imports.append(seconds)
+            yt_dlp_loaded |= loaded
+            firsts.append(measure_first_response(workdir))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "revision": git_revision(),
+        "cpus": os.cpu_count(),
+        "rounds": rounds,
+        "import_main_ms": round(statistics.median(imports) * 1000, 1),
+        "first_response_ms": round(statistics.median(firsts) * 1000, 1),
+        "first_response_min_ms": round(min(firsts) * 1000, 1),
+        "yt_dlp_imported": yt_dlp_loaded,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="fail if the median time to first response is above this")
+    parser.add_argument("--json", help="save the report here")
+    parser.add_argument("--compare", help="report saved by an earlier --json run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="with --compare: fail if first response got slower by more than this fraction")
+    args = parser.parse_args()
+    report = run(args.rounds)
+    failures = []
+    print(f"{report['revision']}: import main {report['import_main_ms']} ms, first response "
+          f"{report['first_response_ms']} ms (min {report['first_response_min_ms']}), "
+          f"yt_dlp imported: {report['yt_dlp_imported']}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ("import_main_ms", "first_response_ms"):
+            old, new = baseline[key], report[key]
+            print(f"  {key}: {old} -> {new} ({(new - old) / old:+.0%})")
+            if new > old * (1 + args.max_regression):
+                failures.append(f"{key} {old} -> {new}")
+    if args.budget_ms is not None and report["first_response_ms"] > args.budget_ms:
+        failures.append(f"first_response_ms {report['first_response_ms']} > budget {args.budget_ms}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    for line in failures:
+        print(f"REGRESSION {line}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
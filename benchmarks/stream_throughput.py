@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+/stream benchmark suite: audio delivery under three access patterns.
+
+- full:  N concurrent listeners, each downloading whole files back to back
+         (tracks round-robin), like players buffering a track;
+- range: N clients firing random `Range: bytes=a-b` requests (64 KB to
+         1 MB at random offsets), like browsers scrubbing the seek bar;
+- herd:  N clients released at once on the same track (a party starting
+         a song): first 1 MB, then the rest, repeated for the duration.
+
+Fixtures are generated locally in a temporary directory: M synthetic m4a
+files (an MP4 `ftyp` box followed by an `mdat` of seeded random bytes;
+/stream never parses them, so they stand in for real AAC at the size of a
+128 kbps track). The server is a uvicorn subprocess with MEDIA_DIR and
+DATABASE_URL pointing at that directory, so its CPU and memory (/proc)
+are measured on their own.
+
+For each scenario: requests, errors, throughput (MB/s), time to first
+byte and request latency (p50/p99), server CPU seconds per GB sent, and
+server memory (RSS after the run, peak RSS):
+
+    python benchmarks/stream_throughput.py --clients 10 50 --duration 10
+    python benchmarks/stream_throughput.py --json after.json --compare before.json --max-regression 0.15
+
+With --compare and --max-regression the exit status is 1 if throughput
+dropped, or TTFB/latency p99 or CPU per GB grew, by more than that
+fraction in any scenario, which is what a CI job should check. The load
+generator shares the machine with the server: compare runs made on the
+same hardware with the same parameters.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pubsub_scaling import ROOT, free_port, wait_port  # noqa: E402
+from ws_load import ServerCpu, git_revision, percentile  # noqa: E402
+
+SCENARIOS = ("full", "range", "herd")
+MB = 1024 * 1024
+
+
+# --- Fixtures ---
+
+def write_fixture(path: str, size: int, seed: int):
+    """MP4-shaped file of `size` bytes: ftyp (M4A brand) + mdat of random bytes."""
+    rng = random.Random(seed)
+    ftyp = struct.pack(">I4s4sI4s4s", 24, b"ftyp", b"M4A ", 0, b"M4A ", b"isom")
+    payload = size - len(ftyp) - 8
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        f.write(struct.pack(">I4s", payload + 8, b"mdat"))
+        block = rng.randbytes(MB)
+        while payload > 0:
+            f.write(block[:min(payload, MB)])
+            payload -= MB
+
+
+def prepare_fixtures(workdir: str, tracks: int, size: int) -> list:
+    """Writes the files and a fresh SQLite library listing them; returns the track ids."""
+    media_dir = os.path.join(workdir, "media")
+    os.makedirs(media_dir, exist_ok=True)
+    for i in range(tracks):
+        write_fixture(os.path.join(media_dir, f"bench-{i}.m4a"), size, seed=i)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'library.db')}"
+    sys.path.insert(0, ROOT)
+    from app.database import SessionLocal, Track, init_db
+    init_db()
+    db = SessionLocal()
+    try:
+        rows = [Track(title=f"Bench {i}", filename=f"bench-{i}.m4a", source_url=None) for i in range(tracks)]
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+def start_server(workdir: str, port: int):
+    env = dict(os.environ, MEDIA_DIR=os.path.join(workdir, "media"),
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'library.db')}",
+               LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def process_memory(pid: int) -> dict:
+    """VmRSS / VmHWM (peak) of a process, in MB."""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    memory[line[:5]] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return {"rss_mb": memory.get("VmRSS"), "peak_rss_mb": memory.get("VmHWM")}
+
+
+# --- Load ---
+
+class Recorder:
+    def __init__(self):
+        self.ttfb = []
+        self.latency = []
+        self.bytes = 0
+        self.errors = 0
+
+    async def get(self, client: httpx.AsyncClient, url: str, headers=None):
+        started = time.perf_counter()
+        first = None
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code not in (200, 206):
+                    self.errors += 1
+                    return
+                async for chunk in response.aiter_raw():
+                    if first is None:
+                        first = time.perf_counter()
+                    self.bytes += len(chunk)
+        except httpx.HTTPError:
+            self.errors += 1
+            return
+        done = time.perf_counter()
+        self.ttfb.append((first or done) - started)
+        self.latency.append(done - started)
+
+
+async def full_listener(client, base: str, track_ids, index: int, until: float, recorder: Recorder):
+    n = index
+    while time.monotonic() < until:
+        await recorder.get(client, f"{base}/stream/{track_ids[n % len(track_ids)]}")
+        n += 1
+
+
+async def range_scrubber(client, base: str, track_ids, size: int, rng: random.Random, until: float,
+                         recorder: Recorder):
+    while time.monotonic() < until:
+        length = rng.randint(64 * 1024, MB)
+        start = rng.randrange(0, size - length)
+        await recorder.get(client, f"{base}/stream/{rng.choice(track_ids)}",
+                           headers={"Range": f"bytes={start}-{start + length - 1}"})
+
+
+async def herd(client, base: str, track_id: int, clients: int, until: float, recorder: Recorder):
+    url = f"{base}/stream/{track_id}"
+    while time.monotonic() < until:
+        # Everyone asks for the start of the song at the same moment, then buffers the rest
+        await asyncio.gather(*(recorder.get(client, url, headers={"Range": f"bytes=0-{MB - 1}"})
+                               for _ in range(clients)))
+        await asyncio.gather(*(recorder.get(client, url, headers={"Range": f"bytes={MB}-"})
+                               for _ in range(clients)))
+
+
+async def run_scenario(name: str, base: str, track_ids, size: int, clients: int, duration: float, seed: int,
+                       cpu: ServerCpu, pid: int) -> dict:
+    recorder = Recorder()
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await recorder.get(client, f"{base}/stream/{track_ids[0]}", headers={"Range": "bytes=0-0"})  # Warm up
+        recorder.__init__()
+        cpu_before = cpu.read()
+        started = time.monotonic()
+        until = started + duration
+        if name == "full":
+            tasks = [full_listener(client, base, track_ids, i, until, recorder) for i in range(clients)]
+        elif name == "range":
+            tasks = [range_scrubber(client, base, track_ids, size, random.Random(rng.random()), until, recorder)
+                     for _ in range(clients)]
+        else:
+            tasks = [herd(client, base, track_ids[0], clients, until, recorder)]
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+        cpu_after = cpu.read()
+    ttfb, latency = sorted(recorder.ttfb), sorted(recorder.latency)
+    gigabytes = recorder.bytes / (1024 * MB)
+    server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "clients": clients,
+        "requests": len(latency),
+        "errors": recorder.errors,
+        "mb_per_s": round(recorder.bytes / MB / elapsed, 1),
+        "ttfb_p50_ms": _ms(percentile(ttfb, 0.5)),
+        "ttfb_p99_ms": _ms(percentile(ttfb, 0.99)),
+        "latency_p50_ms": _ms(percentile(latency, 0.5)),
+        "latency_p99_ms": _ms(percentile(latency, 0.99)),
+        "server_cpu_s_per_gb": round(server_cpu / gigabytes, 2) if server_cpu is not None and gigabytes else None,
+        **process_memory(pid),
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+# --- Reports ---
+
+# Metric -> True if higher is better (for --compare / --max-regression)
+COMPARED = {"mb_per_s": True, "ttfb_p99_ms": False, "latency_p99_ms": False, "server_cpu_s_per_gb": False}
+
+
+def regressions(report: dict, baseline: dict, budget: float) -> list:
+    found = []
+    for key, result in report["results"].items():
+        base = baseline["results"].get(key)
+        if not base:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            new, old = result.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if (change < -budget) if higher_is_better else (change > budget):
+                found.append(f"{key} {metric}: {old} -> {new} ({change:+.0%})")
+    return found
+
+
+def print_report(report: dict, baseline: dict = None):
+    title = f"{report['revision']}: {report['params']['tracks']} tracks of {report['params']['size_mb']} MB"
+    if baseline:
+        title += f"  vs {baseline['revision']}"
+    print(title)
+    print(f"{'scenario':<10} {'req':>6} {'err':>4} {'MB/s':>8} {'ttfb p50':>9} {'ttfb p99':>9} "
+          f"{'lat p50':>9} {'lat p99':>9} {'cpu s/GB':>9} {'rss MB':>7} {'peak MB':>8}")
+    for key, r in report["results"].items():
+        print(f"{key:<10} {r['requests']:>6} {r['errors']:>4} {r['mb_per_s']:>8} {r['ttfb_p50_ms'] or '-':>9} "
+              f"{r['ttfb_p99_ms'] or '-':>9} {r['latency_p50_ms'] or '-':>9} {r['latency_p99_ms'] or '-':>9} "
+              f"{r['server_cpu_s_per_gb'] or '-':>9} {r['rss_mb'] or '-':>7} {r['peak_rss_mb'] or '-':>8}")
+        base = baseline["results"].get(key) if baseline else None
+        if base:
+            print(f"{'  was':<10} {base['requests']:>6} {base['errors']:>4} {base['mb_per_s']:>8} "
+                  f"{base['ttfb_p50_ms'] or '-':>9} {base['ttfb_p99_ms'] or '-':>9} {base['latency_p50_ms'] or '-':>9} "
+                  f"{base['latency_p99_ms'] or '-':>9} {base['server_cpu_s_per_gb'] or '-':>9} "
+                  f"{base['rss_mb'] or '-':>7} {base['peak_rss_mb'] or '-':>8}")
+    print(f"(cpus: {report['cpus']})")
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="stream-bench-")
+    size = int(args.size_mb * MB)
+    proc = None
+    try:
+        track_ids = prepare_fixtures(workdir, args.tracks, size)
+        port = free_port()
+        proc = start_server(workdir, port)
+        await wait_port(port)
+        base = f"http://127.0.0.1:{port}"
+        cpu = ServerCpu(pid=proc.pid)
+        results = {}
+        for scenario in args.scenarios:
+            for clients in args.clients:
+                results[f"{scenario}@{clients}"] = await run_scenario(
+                    scenario, base, track_ids, size, clients, args.duration, args.seed, cpu, proc.pid)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    params = {"tracks": args.tracks, "size_mb": args.size_mb, "duration": args.duration, "seed": args.seed}
+    return {"revision": git_revision(), "cpus": os.cpu_count(), "params": params, "results": results}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--tracks", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=5.0, help="fixture size (5 MB ~ 5 min at 128 kbps)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="save the report here")
+    parser.add_argument("--compare", help="report saved by an earlier --json run")
+    parser.add_argument("--max-regression", type=float,
+                        help="with --compare: exit 1 if a scenario got worse by more than this fraction")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline and args.max_regression is not None:
+        found = regressions(report, baseline, args.max_regression)
+        for line in found:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
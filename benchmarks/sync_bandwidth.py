@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Party sync bandwidth: bytes per member per minute, full snapshots vs deltas.
+
+Simulates one minute of a party (host sync_update every 1.5 s, a few player
+and queue actions) with a large queue and measures what each member would
+receive, once with SYNC_DELTAS disabled and once enabled.
+
+    python benchmarks/sync_bandwidth.py --queue-size 1000 --members 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+
+class RecordingConnection:
+    """Stands in for app.outbound.Connection and counts encoded bytes."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+
+    def send(self, message):
+        self.bytes += len(json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+        self.messages += 1
+
+    def close(self):
+        pass
+
+
+async def simulate_minute(queue_size: int, member_count: int, deltas: bool):
+    main.SYNC_DELTAS_ENABLED = deltas
+    manager = main.ConnectionManager(main.SessionRegistry())
+    member_ids = [f"user{i}" for i in range(member_count)]
+    connections = {uid: RecordingConnection() for uid in member_ids}
+    for uid in member_ids:
+        manager.sessions.add_connection(uid, connections[uid])
+        manager.user_names[uid] = uid
+
+    party = main.Party(host_id=member_ids[0], host_name=member_ids[0])
+    party.queue = list(range(1, queue_size + 1))
+    party.current_index = 0
+    party.set_current_track()
+    party.is_playing = True
+    party.members.update(member_ids)
+    for uid in member_ids:
+        manager.subscribe(uid, main.party_topic(party.party_id))
+    party.mark_dirty()
+    await party.broadcast_sync(manager, full_to=set(member_ids))
+
+    # 60 s of host sync_update every 1.5 s, plus an action every 15 s
+    for tick in range(40):
+        party.current_time = tick * 1.5
+        party.mark_dirty()
+        await party.broadcast_sync(manager)
+        if tick % 10 == 9:
+            party.queue.append(queue_size + tick)
+            party.current_index += 1
+            party.set_current_track()
+            party.current_time = 0
+            party.mark_dirty()
+            await party.broadcast_sync(manager)
+
+    member = connections[member_ids[-1]]
+    return member.bytes, member.messages
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--members", type=int, default=5)
+    args = parser.parse_args()
+
+    # Titles come from the track cache; keep the benchmark off SQLite
+    main.track_cache.get_title = lambda track_id, default=None: f"Track {track_id}" if track_id else default
+
+    full_bytes, full_msgs = asyncio.run(simulate_minute(args.queue_size, args.members, deltas=False))
+    delta_bytes, delta_msgs = asyncio.run(simulate_minute(args.queue_size, args.members, deltas=True))
+
+    print(f"queue size: {args.queue_size}, members: {args.members}")
+    print(f"{'mode':<8}{'messages/min':>14}{'bytes/min':>14}")
+    print(f"{'full':<8}{full_msgs:>14}{full_bytes:>14,}")
+    print(f"{'delta':<8}{delta_msgs:>14}{delta_bytes:>14,}")
+    print(f"reduction: {full_bytes / max(delta_bytes, 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
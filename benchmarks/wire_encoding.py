@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Wire encoding micro-benchmark: JSON vs MessagePack.
+
+Outbound: encode/decode throughput and bytes on the wire of a full
+`party_sync` with large queues. Inbound: frame decoding plus schema
+validation (app.schemas) of the messages clients send most often.
+
+    python benchmarks/wire_encoding.py --queue-sizes 100 1000 10000
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.schemas import decode_inbound  # noqa: E402
+from app.wire import CODECS  # noqa: E402
+
+
+def party_sync_message(queue_size: int) -> dict:
+    rng = random.Random(queue_size)
+    queue = [rng.randint(1, 50000) for _ in range(queue_size)]
+    return {
+        "type": "party_sync",
+        "payload": {
+            "party_id": "0f8c7d2e-5a61-4d0b-9a7e-3c2b1d4e5f60",
+            "host_id": "user-1",
+            "host_name": "Host",
+            "member_count": 8,
+            "members": [{"id": f"user-{i}", "name": f"Member {i}"} for i in range(8)],
+            "queue": queue,
+            "current_index": queue_size // 2,
+            "current_track_id": queue[queue_size // 2],
+            "current_track_title": "Some Track Title - Artist",
+            "current_time": 83.417,
+            "time_anchor": 123456.789,
+            "is_playing": True,
+            "is_shuffled": True,
+            "queue_seqs": [0, queue_size // 3, queue_size // 3 + 1, queue_size - queue_size // 3 - 1],
+            "shuffle_seed": 2654435769,
+            "shuffle_anchor": queue_size // 2,
+            "shuffle_boundary": queue_size,
+            "repeat_mode": "off",
+            "mode": "democratic",
+            "version": 42,
+        },
+    }
+
+
+INBOUND_SAMPLES = [
+    {"type": "sync_update", "payload": {"currentTime": 83.417, "is_playing": True, "client_time": 1718000000.123}},
+    {"type": "player_action", "payload": {"action": "seek", "currentTime": 12.5}},
+    {"type": "queue_action", "payload": {"action": "add", "track_id": 1234}},
+    {"type": "clock_ping", "payload": {"t0": 1718000000.456, "offset": -0.0123, "rtt": 0.034}},
+]
+
+
+def per_second(fn, min_time: float) -> float:
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    return number / elapsed
+
+
+def bench_outbound(queue_sizes, min_time):
+    print("party_sync (full snapshot)")
+    print(f"{'queue':>8}{'codec':>9}{'bytes':>10}{'encode/s':>11}{'decode/s':>11}{'enc MB/s':>10}")
+    for size in queue_sizes:
+        message = party_sync_message(size)
+        for codec in CODECS.values():
+            data = codec.encode(message)
+            assert codec.decode(data) == message
+            enc = per_second(lambda: codec.encode(message), min_time)
+            dec = per_second(lambda: codec.decode(data), min_time)
+            print(f"{size:>8}{codec.name:>9}{len(data if codec.binary else data.encode()):>10}"
+                  f"{enc:>11.0f}{dec:>11.0f}{enc * len(data) / 1e6:>10.1f}")
+
+
+def bench_inbound(min_time):
+    print("\ninbound frame decode + schema validation")
+    print(f"{'message':>14}{'codec':>9}{'bytes':>7}{'decode/s':>11}{'+schema/s':>11}")
+    for sample in INBOUND_SAMPLES:
+        for codec in CODECS.values():
+            data = codec.encode(sample)
+            raw = per_second(lambda: codec.decode(data), min_time)
+            full = per_second(lambda: decode_inbound(codec.decode(data)), min_time)
+            print(f"{sample['type']:>14}{codec.name:>9}{len(data if codec.binary else data.encode()):>7}"
+                  f"{raw:>11.0f}{full:>11.0f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue-sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--min-time", type=float, default=0.3, help="seconds per measurement")
+    args = parser.parse_args()
+
+    if len(CODECS) == 1:
+        print("msgpack is not installed; only JSON will be measured (pip install msgpack)\n")
+    bench_outbound(args.queue_sizes, args.min_time)
+    bench_inbound(args.min_time)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+WebSocket load generator: simulated parties speaking the protocol of
+mapedcomm.md against /ws/{user_id}.
+
+Every party has one host and M-1 members. Clients connect (user_join),
+the host creates the party (create_party) and sets it to democratic mode,
+members join (join_party). Then, for --duration seconds:
+
+- the host sends sync_update every --sync-interval seconds (1.5 s);
+- every client sends random player_action / queue_action / chat_message
+  at --action-rate messages per second (exponential gaps, seeded);
+- everyone answers the server's ping with pong.
+
+Chat messages carry a token, so each member's copy gives one end-to-end
+broadcast latency sample (send -> server -> party fan-out -> member).
+Reports latency percentiles, sent/received message rates by type, dropped
+connections (closed before the end), chats that never arrived, and CPU of
+the server and of the generator itself.
+
+The server is a local uvicorn started on a free port (default), an
+in-process uvicorn on a thread (--in-process; CPU is then that thread's),
+or one already running (--url, with --server-pid for its CPU):
+
+    python benchmarks/ws_load.py --parties 200 --members 5 --duration 20
+    python benchmarks/ws_load.py --url ws://127.0.0.1:8000 --server-pid 1234
+    python benchmarks/ws_load.py --json after.json --compare before.json
+
+--json saves the report (with the git revision and parameters) and
+--compare prints it side by side with an earlier one. Keep parameters and
+--seed equal between runs being compared. The generator runs on the same
+machine, so on few cores its own CPU limits what the server gets.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pubsub_scaling import ROOT, free_port, wait_port  # noqa: E402
+
+CHAT_MARK = "⏱"
+
+
+def percentile(values, fraction: float):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class ServerCpu:
+    """CPU seconds used by the server: a process (/proc) or, in-process, the server's thread."""
+
+    def __init__(self, pid: int = None, thread_id: int = None):
+        self.pid = pid
+        self.thread_id = thread_id
+
+    def read(self):
+        if self.thread_id is not None:
+            return time.clock_gettime(time.pthread_getcpuclockid(self.thread_id))
+        if self.pid is None:
+            return None
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+        except (OSError, IndexError, ValueError):
+            return None
+
+
+class Stats:
+    def __init__(self):
+        self.sent = Counter()
+        self.received = Counter()
+        self.latencies = []
+        self.chat_sent = {}  # token -> (send time, expected deliveries)
+        self.chat_delivered = Counter()
+        self.dropped = 0
+        self.connect_failures = 0
+        self.recording = False
+
+
+class SimClient:
+    def __init__(self, url: str, index: int, stats: Stats, rng: random.Random, track_ids):
+        self.url = url
+        self.index = index
+        self.user_id = f"load-{index}-{rng.randrange(1 << 30):x}"
+        self.name = f"load{index}"
+        self.stats = stats
+        self.rng = rng
+        self.track_ids = track_ids
+        self.ws = None
+        self.party_id = None
+        self.party = None  # The clients of the party, shared list
+        self.queue_length = 0
+        self.joined = asyncio.Event()
+        self.closing = False
+        self.chat_seq = 0
+
+    async def connect(self):
+        try:
+            self.ws = await websockets.connect(f"{self.url}/ws/{self.user_id}", max_size=None, ping_interval=None)
+        except (OSError, websockets.InvalidHandshake, asyncio.TimeoutError):
+            self.stats.connect_failures += 1
+            return False
+        self.reader = asyncio.create_task(self.read())
+        await self.send("user_join", {"name": self.name})
+        return True
+
+    async def send(self, msg_type: str, payload: dict):
+        if self.stats.recording:
+            self.stats.sent[msg_type] += 1
+        await self.ws.send(json.dumps({"type": msg_type, "payload": payload}))
+
+    async def read(self):
+        stats = self.stats
+        try:
+            async for raw in self.ws:
+                message = json.loads(raw)
+                kind = message.get("type")
+                payload = message.get("payload") or {}
+                if stats.recording:
+                    stats.received[kind] += 1
+                if kind == "ping":
+                    await self.send("pong", {"t": payload.get("t")})
+                elif kind == "party_sync":
+                    self.party_id = payload.get("party_id") or self.party_id
+                    self.queue_length = len(payload.get("queue") or [])
+                    self.joined.set()
+                elif kind == "party_sync_delta":
+                    changes = payload.get("changes") or {}
+                    if isinstance(changes.get("queue"), list):
+                        self.queue_length = len(changes["queue"])
+                elif kind == "chat_message":
+                    text = payload.get("text", "")
+                    if text.startswith(CHAT_MARK) and stats.recording:
+                        sent = stats.chat_sent.get(text)
+                        if sent is not None:
+                            stats.latencies.append(time.perf_counter() - sent[0])
+                            stats.chat_delivered[text] += 1
+        except websockets.ConnectionClosed:
+            pass
+        if not self.closing:
+            stats.dropped += 1
+
+    async def host_loop(self, until: float, interval: float):
+        position = 0.0
+        while time.monotonic() < until and not self.closing:
+            await asyncio.sleep(interval)
+            position += interval
+            await self.send("sync_update", {"currentTime": position, "is_playing": True, "client_time": time.time()})
+
+    async def action_loop(self, until: float, rate: float):
+        rng = self.rng
+        next_at = time.monotonic() + rng.expovariate(rate)
+        while not self.closing and next_at < until:
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            next_at += rng.expovariate(rate)
+            roll = rng.random()
+            if roll < 0.4:
+                await self.chat()
+            elif roll < 0.7:
+                await self.player_action()
+            else:
+                await self.queue_action()
+
+    async def chat(self):
+        self.chat_seq += 1
+        text = f"{CHAT_MARK}{self.index}:{self.chat_seq}"
+        # Every member of the party, the sender included, gets the broadcast
+        self.stats.chat_sent[text] = (time.perf_counter(), len(self.party))
+        await self.send("chat_message", {"text": text, "party_id": self.party_id})
+
+    async def player_action(self):
+        action = self.rng.choice(["play", "pause", "seek", "change_track"] if self.track_ids else ["play", "pause", "seek"])
+        if action == "change_track":
+            await self.send("player_action", {"action": action, "track_id": self.rng.choice(self.track_ids)})
+        else:
+            await self.send("player_action", {"action": action, "currentTime": round(self.rng.uniform(0, 180), 2)})
+
+    async def queue_action(self):
+        if self.track_ids and (self.queue_length < 20 or self.rng.random() < 0.3):
+            await self.send("queue_action", {"action": "add", "track_id": self.rng.choice(self.track_ids),
+                                             "party_id": self.party_id})
+        elif self.queue_length > 1:
+            await self.send("queue_action", {"action": "move", "position": self.rng.randrange(self.queue_length),
+                                             "to": self.rng.randrange(self.queue_length)})
+        elif self.queue_length:
+            await self.send("queue_action", {"action": "remove", "position": 0, "party_id": self.party_id})
+
+    async def close(self):
+        self.closing = True
+        if self.ws is not None:
+            await self.ws.close()
+            self.reader.cancel()
+
+
+def library_ids(http_url: str):
+    try:
+        with urllib.request.urlopen(f"{http_url}/library", timeout=10) as response:
+            return [t["id"] for t in json.loads(response.read())][:50]
+    except (OSError, ValueError):
+        return []
+
+
+async def build_parties(url: str, parties: int, members: int, stats: Stats, rng: random.Random, track_ids,
+                        connect_concurrency: int):
+    limit = asyncio.Semaphore(connect_concurrency)
+    groups = []
+    index = 0
+    for _ in range(parties):
+        group = []
+        for _ in range(members):
+            group.append(SimClient(url, index, stats, random.Random(rng.random()), track_ids))
+            index += 1
+        groups.append(group)
+
+    async def connect(client):
+        async with limit:
+            return await client.connect()
+
+    async def setup(group):
+        host = group[0]
+        if not await connect(host):
+            return None
+        await host.send("create_party", {})
+        await asyncio.wait_for(host.joined.wait(), 30)
+        await host.send("set_mode", {"mode": "democratic"})
+        alive = [host]
+        for client in group[1:]:
+            if await connect(client):
+                await client.send("join_party", {"party_id": host.party_id})
+                alive.append(client)
+        await asyncio.gather(*(asyncio.wait_for(c.joined.wait(), 30) for c in alive))
+        for client in alive:
+            client.party = alive
+            client.party_id = host.party_id
+        return alive
+
+    ready = await asyncio.gather(*(setup(g) for g in groups), return_exceptions=True)
+    return [g for g in ready if isinstance(g, list)]
+
+
+async def run_load(url: str, parties: int, members: int, duration: float, sync_interval: float,
+                   action_rate: float, seed: int, connect_concurrency: int, cpu: ServerCpu):
+    stats = Stats()
+    rng = random.Random(seed)
+    http_url = "http" + url[len("ws"):]
+    track_ids = library_ids(http_url)
+    started_setup = time.perf_counter()
+    groups = await build_parties(url, parties, members, stats, rng, track_ids, connect_concurrency)
+    setup_time = time.perf_counter() - started_setup
+    clients = [c for g in groups for c in g]
+    await asyncio.sleep(1.0)  # Joins settle, lobby flushes go out
+
+    stats.recording = True
+    cpu_before, own_before = cpu.read(), time.process_time()
+    started = time.monotonic()
+    until = started + duration
+    tasks = [c.action_loop(until, action_rate) for c in clients if action_rate > 0]
+    tasks += [g[0].host_loop(until, sync_interval) for g in groups]
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(1.0)  # In-flight broadcasts land
+    elapsed = time.monotonic() - started
+    stats.recording = False
+    cpu_after, own_after = cpu.read(), time.process_time()
+    dropped = stats.dropped
+    await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+    latencies = sorted(stats.latencies)
+    expected = sum(n for _, n in stats.chat_sent.values())
+    delivered = sum(stats.chat_delivered.values())
+    server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "clients": len(clients),
+        "parties": len(groups),
+        "tracks": len(track_ids),
+        "setup_s": round(setup_time, 2),
+        "duration_s": round(elapsed, 2),
+        "sent_per_s": round(sum(stats.sent.values()) / elapsed, 1),
+        "received_per_s": round(sum(stats.received.values()) / elapsed, 1),
+        "sent_by_type": {k: round(v / elapsed, 1) for k, v in stats.sent.most_common()},
+        "received_by_type": {k: round(v / elapsed, 1) for k, v in stats.received.most_common()},
+        "chat_latency_ms": {
+            "samples": len(latencies),
+            "p50": _ms(percentile(latencies, 0.5)),
+            "p90": _ms(percentile(latencies, 0.9)),
+            "p99": _ms(percentile(latencies, 0.99)),
+            "max": _ms(latencies[-1] if latencies else None),
+        },
+        "chats_missing": expected - delivered,
+        "dropped_connections": dropped,
+        "connect_failures": stats.connect_failures,
+        "server_cpu_s": round(server_cpu, 2) if server_cpu is not None else None,
+        "server_cpu_pct": round(server_cpu / elapsed * 100, 1) if server_cpu is not None else None,
+        "generator_cpu_pct": round((own_after - own_before) / elapsed * 100, 1),
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def start_subprocess_server(port: int):
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def start_in_process_server(port: int):
+    """uvicorn on its own thread and event loop; returns (server, thread)."""
+    import uvicorn
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    config = uvicorn.Config("main:app", port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    server.install_signal_handlers = lambda: None  # Not the main thread
+    thread = threading.Thread(target=server.run, name="ws-load-server", daemon=True)
+    thread.start()
+    return server, thread
+
+
+def print_report(report: dict, baseline: dict = None):
+    r = report["results"]
+    b = baseline["results"] if baseline else {}
+
+    def row(label, value, base=None, unit=""):
+        text = f"{label:<24} {value if value is not None else '-':>12}{unit}"
+        if base is not None and value is not None:
+            delta = f"{(value - base) / base * 100:+.1f}%" if base else "-"
+            text += f"   was {base}{unit} ({delta})"
+        print(text)
+
+    title = f"{report['revision']}: {r['clients']} clients in {r['parties']} parties, {r['duration_s']}s"
+    if baseline:
+        title += f"  vs {baseline['revision']}"
+    print(title)
+    row("sent msg/s", r["sent_per_s"], b.get("sent_per_s"))
+    row("received msg/s", r["received_per_s"], b.get("received_per_s"))
+    for key in ("p50", "p90", "p99", "max"):
+        row(f"chat latency {key}", r["chat_latency_ms"][key], b.get("chat_latency_ms", {}).get(key), " ms")
+    row("chats missing", r["chats_missing"], b.get("chats_missing"))
+    row("dropped connections", r["dropped_connections"], b.get("dropped_connections"))
+    row("connect failures", r["connect_failures"], b.get("connect_failures"))
+    row("server CPU", r["server_cpu_pct"], b.get("server_cpu_pct"), " %")
+    row("generator CPU", r["generator_cpu_pct"], b.get("generator_cpu_pct"), " %")
+    print("received/s by type: " + ", ".join(f"{k}={v}" for k, v in r["received_by_type"].items()))
+
+
+async def run(args):
+    server = proc = None
+    if args.url:
+        url = args.url.rstrip("/")
+        cpu = ServerCpu(pid=args.server_pid)
+    else:
+        port = free_port()
+        url = f"ws://127.0.0.1:{port}"
+        if args.in_process:
+            server, thread = start_in_process_server(port)
+            await wait_port(port)
+            cpu = ServerCpu(thread_id=thread.ident)
+        else:
+            proc = start_subprocess_server(port)
+            await wait_port(port)
+            cpu = ServerCpu(pid=proc.pid)
+    try:
+        results = await run_load(url, args.parties, args.members, args.duration, args.sync_interval,
+                                 args.action_rate, args.seed, args.connect_concurrency, cpu)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if server is not None:
+            server.should_exit = True
+    params = {k: getattr(args, k) for k in ("parties", "members", "duration", "sync_interval", "action_rate", "seed")}
+    params["server"] = "url" if args.url else ("in-process" if args.in_process else "subprocess")
+    return {"revision": git_revision(), "cpus": os.cpu_count(), "params": params, "results": results}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="running server, e.g. ws://127.0.0.1:8000 (default: start one)")
+    parser.add_argument("--server-pid", type=int, help="pid of the --url server, for its CPU usage")
+    parser.add_argument("--in-process", action="store_true", help="run the server on a thread of this process")
+    parser.add_argument("--parties", type=int, default=50)
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--sync-interval", type=float, default=1.5, help="host sync_update period (s)")
+    parser.add_argument("--action-rate", type=float, default=0.2, help="random actions per client per second")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--json", help="save the report here")
+    parser.add_argument("--compare", help="report saved by an earlier --json run")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,21 +3,46 @@ import socket
 import json
 import uuid
 import time
-from typing import Dict, List, Set, Literal
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Literal
 import random # Added for shuffle
+import signal
 
 from fastapi import (
     FastAPI, UploadFile, File, HTTPException, Request, WebSocket, WebSocketDisconnect
 )
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.templating import Jinja2Templates
 from pydantic import BaseModel, HttpUrl
 
-from app.database import SessionLocal, Track, Playlist, PlaylistTrack, User, init_db
+from app.database import SessionLocal, Track, Playlist, PlaylistTrack, User, init_db, MEDIA_DIR
 from app.convert import convert_to_aac
 from app.importer import import_from_youtube
+from app.outbound import Connection, SharedMessage, OUTBOUND_QUEUE_LIMIT
+from app.heartbeat import heartbeat_stats, HEARTBEAT_INTERVAL
+from app.lobby import LobbyBroadcaster
+from app.clock_sync import server_now
+from app.wire import MessageDecodeError, negotiate_codec
+from app.schemas import decode_inbound
+from app.sync_telemetry import sync_telemetry, SYNC_TELEMETRY_LOG_INTERVAL
+from app.track_cache import track_cache
+from app.track_queue import TrackQueue
+from app.shuffle import ShuffleOrder, expand_runs
+from app.delta_sync import DeltaTracker, SYNC_DELTAS_ENABLED
+from app.solo_states import SoloStateStore
+from app.timer_wheel import Timer, timer_wheel
+from app.resume import EventLog, ResumeSession, resume_registry
+from app.session_registry import SessionRegistry, sessions
+from app.pubsub import InProcessPubSub, create_backend
+from app.cluster import Cluster, RemoteConnection
+from app.ws_router import MessageContext, MessageRouter
+from app.loop_watchdog import WatchdogTagMiddleware, loop_watchdog
+from app.profiling import ProfilingMiddleware, profiler
+from app.structured_log import get_logger
+from app.metrics import metrics, histogram_samples, stream_meter, stream_requests, monitor_loop_lag, LOOP_LAG_INTERVAL
+from app.memory_report import measure, deep_sizeof, process_memory
 
 # --- Pydantic Models ---
 class URLImportRequest(BaseModel):
@@ -39,6 +64,11 @@ class PlaylistAddTrackRequest(BaseModel):
 class PlaylistUpdateTracksRequest(BaseModel):
     tracks: List[dict]  # [{"track_id": 1, "position": 0}, ...]
 
+class ProfilingUpdateRequest(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = None  # 0..1
+    interval_ms: Optional[float] = None
+
 # --- Range Requests Support ---
 def range_requests_response(
     file_path: str, 
@@ -57,8 +87,9 @@ def range_requests_response(
             with open(file_path, mode="rb") as file_like:
                 yield from file_like
         
+        stream_requests.inc(labels=("full",))
         return StreamingResponse(
-            iterfile(), 
+            profiler.wrap_iterator(stream_meter(iterfile())), 
             media_type=media_type,
             headers={
                 "Accept-Ranges": "bytes",
@@ -90,8 +121,9 @@ def range_requests_response(
                     remaining -= len(chunk)
                     yield chunk
         
+        stream_requests.inc(labels=("range",))
         return StreamingResponse(
-            iterfile(),
+            profiler.wrap_iterator(stream_meter(iterfile())),
             status_code=206,  # Partial Content
             media_type=media_type,
             headers={
@@ -107,8 +139,9 @@ def range_requests_response(
             with open(file_path, mode="rb") as file_like:
                 yield from file_like
         
+        stream_requests.inc(labels=("invalid_range",))
         return StreamingResponse(
-            iterfile(), 
+            profiler.wrap_iterator(stream_meter(iterfile())), 
             media_type=media_type,
             headers={
                 "Accept-Ranges": "bytes",
@@ -117,90 +150,461 @@ def range_requests_response(
         )
 
 # --- App Setup ---
-MEDIA_DIR = "media"
+log = get_logger("main")
 app = FastAPI(title="Simple Music Streaming App")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
 )
-os.makedirs(MEDIA_DIR, exist_ok=True)
-init_db()
+# Tags requests for the event loop watchdog (only active with LOOP_WATCHDOG_THRESHOLD_MS)
+app.add_middleware(WatchdogTagMiddleware, watchdog=loop_watchdog)
+# Picks a fraction of HTTP requests for the sampling profiler (off unless enabled, see /admin/profiling)
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # --- WebSocket State Management ---
 
 class PlayerState:
+    __slots__ = (
+        "_position", "_is_playing", "time_anchor", "_queue",
+        "current_index", "current_track_id", "repeat_mode",
+        "shuffle_seed", "shuffle_anchor", "shuffle_boundary", "_order",
+        "revision", "sync_tracker",
+    )
+
     def __init__(self):
-        self.queue: List[int] = []
-        self.original_queue: List[int] = [] # For unshuffling
-        self.current_index: int = -1 # Index in the queue
+        # Playback timeline: `current_time` is the position at server time
+        # `time_anchor` (monotonic); while playing it advances in real time.
+        self._position: float = 0.0
+        self._is_playing: bool = False
+        self.time_anchor: float = server_now()
+        self._order: ShuffleOrder | None = None
+        self.queue = TrackQueue() # Always in the order tracks were queued
+        self.current_index: int = -1 # Index in play order (see shuffle_order())
         self.current_track_id: int | None = None
         self.current_time: float = 0.0
         self.is_playing: bool = False
         self.repeat_mode: Literal['off', 'all', 'one'] = 'off'
-        self.is_shuffled: bool = False
+        # Shuffle is a seed, not a reordered copy of the queue (see app.shuffle)
+        self.shuffle_seed: int | None = None
+        self.shuffle_anchor: int | None = None # Entry (queue seq) pinned first: the one playing when shuffle was enabled
+        self.shuffle_boundary: int = 0 # Entries numbered below this were shuffled; later ones play in added order
+        self.revision: int = 0 # Bumped on every state change, see mark_dirty()
+        self.sync_tracker = DeltaTracker() # Last published snapshot + version
+
+    def mark_dirty(self):
+        """Must be called after mutating the state so memoized payloads get rebuilt."""
+        self.revision += 1
+
+    @property
+    def queue(self) -> TrackQueue:
+        return self._queue
+
+    @queue.setter
+    def queue(self, track_ids):
+        self._queue = track_ids if isinstance(track_ids, TrackQueue) else TrackQueue(track_ids)
+        self._order = None
+
+    @property
+    def is_shuffled(self) -> bool:
+        return self.shuffle_seed is not None
+
+    def shuffle_order(self) -> ShuffleOrder:
+        """
+        The play order while shuffled. Built on first use, then updated entry
+        by entry by append()/remove_at(); rebuilt if the queue was changed
+        some other way.
+        """
+        order = self._order
+        if order is None or order.queue_revision != self.queue.revision:
+            order = self._order = ShuffleOrder(self.shuffle_seed, self.shuffle_anchor, self.shuffle_boundary,
+                                               self.queue.seqs(), self.queue.revision)
+            self.shuffle_anchor = order.anchor
+        return order
+
+    def queue_index(self, play_index: int) -> int:
+        """Index in `queue` of the entry at `play_index` in play order."""
+        if not self.is_shuffled:
+            return play_index
+        return self.queue.position_of(self.shuffle_order().seq_at(play_index))
+
+    def play_index(self, track_id: int) -> int:
+        """Play-order index of the first copy of `track_id` to be played (ValueError if absent)."""
+        if not self.is_shuffled:
+            return self.queue.index(track_id)
+        seqs = self.queue.seqs_of(track_id)
+        if not seqs:
+            raise ValueError(f"{track_id} is not in queue")
+        order = self.shuffle_order()
+        return min(order.index(seq) for seq in seqs)
+
+    def shuffle(self, seed: int | None = None):
+        """Turns shuffle on: the current entry plays first, then the rest in seeded order."""
+        self.shuffle_seed = random.getrandbits(32) if seed is None else seed
+        self.queue.renumber() # Entry seqs = queue positions from here on
+        self.shuffle_anchor = self.current_index if 0 <= self.current_index < len(self.queue) else None
+        self.shuffle_boundary = len(self.queue)
+        self._order = None
+        self.current_index = 0 if self.queue else -1
+
+    def unshuffle(self):
+        """Back to queue order, staying on the same entry."""
+        if 0 <= self.current_index < len(self.queue):
+            self.current_index = self.queue_index(self.current_index)
+        self.shuffle_seed = None
+        self.shuffle_anchor = None
+        self.shuffle_boundary = 0
+        self._order = None
+
+    def append(self, track_id: int):
+        """Adds a track at the end of the queue: it plays last, shuffled or not."""
+        order = self.shuffle_order() if self.is_shuffled else None
+        self.queue.append(track_id)
+        if order is not None:
+            order.append(self.queue.seq_at(-1))
+            order.queue_revision = self.queue.revision
+
+    def clear_queue(self):
+        self.queue.clear() # Seqs keep growing, so later entries land past shuffle_boundary
+        self.shuffle_anchor = None
+        self._order = None
+
+    def remove_at(self, play_index: int) -> int:
+        """
+        Removes the entry at `play_index` (play order) and returns its track id.
+        No other entry changes place in the play order, so current_index keeps
+        pointing at the same entry, unless that entry is the one removed (then
+        it points at whatever took its place).
+        """
+        index = self.queue_index(play_index)
+        if self.is_shuffled:
+            order = self.shuffle_order()
+            seq = self.queue.seq_at(index)
+            track_id = self.queue.pop(index)
+            order.remove(seq)
+            order.queue_revision = self.queue.revision
+            self.shuffle_anchor = order.anchor
+        else:
+            track_id = self.queue.pop(index)
+        if play_index < self.current_index:
+            self.current_index -= 1
+        return track_id
+
+    def queue_seqs(self) -> List[int] | None:
+        """Entry seqs as runs (start, count, ...) while shuffled (clients key the shuffle on them), else None."""
+        return self.shuffle_order().runs() if self.is_shuffled else None
+
+    @property
+    def current_time(self) -> float:
+        """Position at `time_anchor`. Use position_at() for the live position."""
+        return self._position
+
+    @current_time.setter
+    def current_time(self, value: float):
+        self.set_position(value)
+
+    @property
+    def is_playing(self) -> bool:
+        return self._is_playing
+
+    @is_playing.setter
+    def is_playing(self, value: bool):
+        if value != self._is_playing:
+            now = server_now()
+            self._position = self.position_at(now) # Freeze/resume from the live position
+            self.time_anchor = now
+            self._is_playing = value
+
+    def position_at(self, at: float | None = None) -> float:
+        if not self._is_playing:
+            return self._position
+        if at is None:
+            at = server_now()
+        return self._position + max(0.0, at - self.time_anchor)
+
+    def set_position(self, position: float, at: float | None = None):
+        """Re-anchors the timeline: `position` was the playback position at server time `at`."""
+        self._position = float(position or 0.0)
+        self.time_anchor = server_now() if at is None else at
+
+    def advance_track(self):
+        """Moves to the next track honouring repeat mode (next_track and auto-advance)."""
+        if self.repeat_mode == 'one' and self.is_playing:
+            self.current_time = 0 # Repeat current track
+        elif self.current_index < len(self.queue) - 1:
+            self.current_index += 1
+        elif self.repeat_mode == 'all': # End of queue, repeat all
+            self.current_index = 0
+        else: # End of queue, no repeat or repeat one (but not playing)
+            self.is_playing = False
+            # Optionally, could set current_index to -1 or keep it at end
+
+        if self.is_playing or self.repeat_mode == 'all' or \
+           (self.current_index != len(self.queue) -1 and self.current_index != -1) : # only reset time if actually moving to a track
+            self.set_current_track()
+            self.current_time = 0
+            self.is_playing = True # Autoplay next track
 
     def set_current_track(self):
         if 0 <= self.current_index < len(self.queue):
-            self.current_track_id = self.queue[self.current_index]
+            self.current_track_id = self.queue[self.queue_index(self.current_index)]
         else:
             self.current_track_id = None
             self.current_index = -1 # Ensure index is reset if queue is empty or out of bounds
             self.is_playing = False # Stop playing if no track
 
+    def to_snapshot(self) -> Dict | None:
+        """What a spilled solo state keeps (app.solo_states); None if there is nothing worth keeping."""
+        if not self.queue and self.repeat_mode == 'off':
+            return None
+        return {
+            "queue": self.queue.to_list(),
+            "queue_seqs": self.queue_seqs(),
+            "current_index": self.current_index,
+            "current_track_id": self.current_track_id,
+            "position": self.position_at(),
+            "repeat_mode": self.repeat_mode,
+            "shuffle_seed": self.shuffle_seed,
+            "shuffle_anchor": self.shuffle_anchor,
+            "shuffle_boundary": self.shuffle_boundary,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict) -> "PlayerState":
+        """Restores a spilled state, paused where it was."""
+        state = cls()
+        seqs = snapshot.get("queue_seqs")
+        state.queue = TrackQueue(snapshot.get("queue") or [], expand_runs(seqs) if seqs else None)
+        state.current_index = snapshot.get("current_index", -1)
+        state.current_track_id = snapshot.get("current_track_id")
+        state.current_time = snapshot.get("position", 0.0)
+        state.repeat_mode = snapshot.get("repeat_mode", 'off')
+        if seqs: # Shuffle state is only meaningful with the entry seqs it was built on
+            state.shuffle_seed = snapshot.get("shuffle_seed")
+            state.shuffle_anchor = snapshot.get("shuffle_anchor")
+            state.shuffle_boundary = snapshot.get("shuffle_boundary", 0)
+        return state
+
     def to_dict(self):
         return {
-            "queue": self.queue,
-            "original_queue": self.original_queue,
+            "queue": self.queue.to_list(), # Cached until the queue changes
             "current_index": self.current_index,
             "current_track_id": self.current_track_id,
             "current_time": self.current_time,
+            "time_anchor": self.time_anchor,
             "is_playing": self.is_playing,
             "repeat_mode": self.repeat_mode,
             "is_shuffled": self.is_shuffled,
+            # Clients derive the play order from these (app.shuffle / shuffledOrder)
+            "queue_seqs": self.queue_seqs(),
+            "shuffle_seed": self.shuffle_seed,
+            "shuffle_anchor": self.shuffle_anchor,
+            "shuffle_boundary": self.shuffle_boundary,
         }
 
+# Pub/sub topics: everyone outside a party listens to the lobby, party
+# members to their party, and each user to a private topic.
+LOBBY_TOPIC = "lobby"
+
+def party_topic(party_id: str) -> str:
+    return f"party:{party_id}"
+
+def user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+broadcast_time = metrics.histogram("ws_broadcast_seconds", "Time to queue one topic message for all its local subscribers")
+invalid_messages = metrics.counter("ws_messages_invalid_total", "Inbound WebSocket frames rejected by decoding/validation")
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(self, sessions: SessionRegistry, cluster: Cluster | None = None):
+        self.sessions = sessions # Connections per user (several tabs/devices each) and party membership
+        # Other workers serving the same parties; a single process by default
+        self.cluster = cluster if cluster is not None else Cluster(InProcessPubSub())
         self.user_names: Dict[str, str] = {}
-        self.player_states: Dict[str, PlayerState] = {} # For solo users
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        if user_id not in self.player_states: # Create player state if not exists
-            self.player_states[user_id] = PlayerState()
-
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.user_names:
-            del self.user_names[user_id]
-        # Note: We might want to persist player_states or clear them based on requirements.
-        # For now, let's keep them, they might reconnect.
-        # If memory becomes an issue, a cleanup strategy for player_states would be needed.
+        # Solo users; evicted some time after they disconnect (see app.solo_states)
+        self.player_states = SoloStateStore(PlayerState, PlayerState.from_snapshot)
+        self.subscribers: Dict[str, Set[str]] = {} # topic -> user ids
+        self.subscriptions: Dict[str, Set[str]] = {} # user id -> topics
+
+    async def connect(self, websocket: WebSocket, user_id: str) -> Connection:
+        # Wire encoding is negotiated through the WebSocket subprotocol
+        # (e.g. "msgpack"); clients that offer none keep using JSON.
+        codec, subprotocol = negotiate_codec(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        connection = Connection(websocket, user_id, codec)
+        connection.start()
+        self.sessions.add_connection(user_id, connection)
+        await self.player_states.acquire(user_id) # Existing, restored or new state
+        # Topics are per user, so a further tab joins the ones the user already has
+        self.subscribe(user_id, user_topic(user_id))
+        party = self.sessions.party_of(user_id)
+        self.subscribe(user_id, party_topic(party.party_id) if party else LOBBY_TOPIC)
+        return connection
+
+    def subscribe(self, user_id: str, topic: str):
+        users = self.subscribers.get(topic)
+        if users is None:
+            users = self.subscribers[topic] = set()
+            self.cluster.watch(topic) # First local subscriber: receive the topic from other workers too
+        users.add(user_id)
+        self.subscriptions.setdefault(user_id, set()).add(topic)
+
+    def unsubscribe(self, user_id: str, topic: str):
+        users = self.subscribers.get(topic)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.subscribers[topic]
+                self.cluster.unwatch(topic)
+        topics = self.subscriptions.get(user_id)
+        if topics is not None:
+            topics.discard(topic)
+            if not topics:
+                del self.subscriptions[user_id]
+
+    def unsubscribe_all(self, user_id: str):
+        for topic in list(self.subscriptions.get(user_id, ())):
+            self.unsubscribe(user_id, topic)
+
+    def drop_topic(self, topic: str) -> Set[str]:
+        """Removes a topic entirely, returning the users that were subscribed."""
+        users = self.subscribers.pop(topic, set())
+        if users:
+            self.cluster.unwatch(topic)
+        for user_id in users:
+            topics = self.subscriptions.get(user_id)
+            if topics is not None:
+                topics.discard(topic)
+                if not topics:
+                    del self.subscriptions[user_id]
+        return users
+
+    def publish(self, topic: str, message: dict, exclude: Set[str] = frozenset(), local_only: bool = False):
+        """
+        Queues a message for the subscribers of one topic, encoding it only
+        once, and hands it to the other workers (unless `local_only`).
+        """
+        message = SharedMessage(message)
+        self.deliver(topic, message, exclude)
+        if not local_only:
+            self.cluster.publish_topic(topic, message, exclude)
+
+    def deliver(self, topic: str, message: SharedMessage, exclude: Set[str] = frozenset()):
+        """Local fan-out of a topic message (also what the cluster calls for other workers' publishes)."""
+        users = self.subscribers.get(topic)
+        if not users:
+            return
+        started = time.perf_counter()
+        for user_id in users:
+            if user_id not in exclude:
+                for connection in self.sessions.connections(user_id):
+                    connection.send(message)
+        broadcast_time.observe(time.perf_counter() - started)
+
+    def disconnect(self, user_id: str, connection: Connection | None = None, keep_presence: bool = False):
+        """
+        Closes one of the user's connections (all of them if `connection`
+        is None). The user's topics and presence go with their last one;
+        with `keep_presence` (resumable session) the user stays listed
+        until forget() is called.
+        """
+        closing = [connection] if connection is not None else list(self.sessions.connections(user_id))
+        remaining = 0
+        for conn in closing:
+            remaining = self.sessions.remove_connection(user_id, conn)
+            conn.close()
+        if remaining:
+            return # Other tabs/devices of the user are still connected
+        self.unsubscribe_all(user_id)
+        if not keep_presence:
+            self.forget(user_id)
+
+    def forget(self, user_id: str):
+        """Removes a disconnected user from the lobby lists and starts their solo state TTL."""
+        self.user_names.pop(user_id, None)
+        if not self.sessions.is_connected(user_id):
+            # The solo state outlives the connection for SOLO_STATE_TTL, then is spilled
+            self.player_states.release(user_id)
+
+    def send(self, user_id: str, message: dict):
+        """Queues a message for every connection of one user; their writer tasks deliver it."""
+        if self.cluster.is_remote_user(user_id): # Some of the user's connections are on other workers
+            self.publish(user_topic(user_id), message)
+            return
+        connections = self.sessions.connections(user_id)
+        if len(connections) > 1:
+            message = SharedMessage(message)
+        for connection in connections:
+            connection.send(message)
+
+    def send_all(self, message: dict):
+        """Queues one message for every connection, encoding it only once."""
+        message = SharedMessage(message)
+        for connection in self.sessions.all_connections():
+            connection.send(message)
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections.values():
-            await connection.send_json(message)
+        self.send_all(message)
 
-    async def send_solo_state_update(self, user_id: str):
-        if user_id in self.active_connections and user_id in self.player_states:
+    async def send_solo_state_update(self, user_id: str, full: bool = False):
+        """
+        Sends the solo state as a delta against the last published version,
+        or as a full snapshot when `full` is set (join, resync requests).
+        """
+        if self.sessions.is_connected(user_id) and user_id in self.player_states:
             state = self.player_states[user_id]
-            await self.active_connections[user_id].send_json({
-                "type": "solo_state_update",
-                "payload": state.to_dict()
-            })
+            tracker = state.sync_tracker
+            changes = tracker.update(state.to_dict())
+            if full or not SYNC_DELTAS_ENABLED:
+                self.send(user_id, {
+                    "type": "solo_state_update",
+                    "payload": tracker.full_payload()
+                })
+            elif changes:
+                self.send(user_id, {
+                    "type": "solo_state_delta",
+                    "payload": tracker.delta_payload(changes)
+                })
+
+    def queue_stats(self) -> Dict:
+        connections = [c.stats() for c in self.sessions.all_connections()]
+        depths = [c["depth"] for c in connections]
+        return {
+            "topics": len(self.subscribers),
+            "lobby_subscribers": len(self.subscribers.get(LOBBY_TOPIC, ())),
+            "connections": len(connections),
+            "total_depth": sum(depths),
+            "max_depth": max(depths, default=0),
+            "over_limit": sum(1 for c in connections if c["over_limit_for"] > 0),
+            # Missed two heartbeats but not yet past the liveness deadline
+            "suspected_zombies": sum(1 for c in connections if c["silent_for"] > 2 * HEARTBEAT_INTERVAL > 0),
+            "queue_limit": OUTBOUND_QUEUE_LIMIT,
+            "per_connection": connections,
+        }
 
     def get_users_list(self) -> List[Dict[str, str]]:
         return [{"id": uid, "name": name} for uid, name in self.user_names.items()]
 
     def get_users_list_for_ids(self, user_ids: Set[str]) -> List[Dict[str, str]]:
-        return [{"id": uid, "name": self.user_names.get(uid, "Unknown")} for uid in user_ids]
+        return [{"id": uid, "name": self.display_name(uid)} for uid in user_ids]
+
+    def display_name(self, user_id: str) -> str:
+        """Name of a local user, or of one served by another worker (party members can be either)."""
+        name = self.user_names.get(user_id)
+        if name is None:
+            name = self.cluster.user_name(user_id) or "Unknown"
+        return name
 
 class Party(PlayerState): # Inherits from PlayerState
+    __slots__ = (
+        "party_id", "host_id", "host_name", "members", "mode",
+        "last_action_timestamp", "last_action_user", "action_debounce_time", "chat_history", "chat_seq",
+        "event_log",
+        "_dict_cache", "_dict_cache_key", "_summary_cache", "_summary_cache_key",
+        "_advance_handle", "_duration_probe", "_debounce_timer",
+    )
+
     def __init__(self, host_id: str, host_name: str, initial_player_state: PlayerState | None = None):
         super().__init__() # Initialize PlayerState attributes
         self.party_id: str = str(uuid.uuid4())
@@ -212,17 +616,27 @@ class Party(PlayerState): # Inherits from PlayerState
         self.last_action_timestamp: float = time.time()
         self.last_action_user: str = host_id
         self.action_debounce_time: float = 0.5  # 500ms debounce
-        self.chat_history: List[Dict] = []
+        self.chat_history: Deque[Dict] = deque(maxlen=CHAT_HISTORY_LIMIT)
+        self.chat_seq: int = 0 # Sequence number of the last chat message
+        self.event_log = EventLog() # Recent sync deltas, replayed to resuming members
+        self._dict_cache: Dict | None = None
+        self._dict_cache_key: tuple | None = None
+        self._summary_cache: Dict | None = None
+        self._summary_cache_key: tuple | None = None
+        self._advance_handle: Timer | None = None
+        self._duration_probe: asyncio.Task | None = None
+        self._debounce_timer: Timer | None = None
 
         if initial_player_state:
-            self.queue = initial_player_state.queue[:]
-            self.original_queue = initial_player_state.original_queue[:]
+            self.queue = initial_player_state.queue.copy() # Same entry seqs, so the shuffle carries over
+            self.shuffle_seed = initial_player_state.shuffle_seed
+            self.shuffle_anchor = initial_player_state.shuffle_anchor
+            self.shuffle_boundary = initial_player_state.shuffle_boundary
             self.current_index = initial_player_state.current_index
             self.current_track_id = initial_player_state.current_track_id
             self.current_time = initial_player_state.current_time
             self.is_playing = initial_player_state.is_playing
             self.repeat_mode = initial_player_state.repeat_mode
-            self.is_shuffled = initial_player_state.is_shuffled
             self.set_current_track() # Ensure current_track_id is consistent
 
         # Deprecated attributes (or their logic needs fundamental change)
@@ -260,18 +674,31 @@ class Party(PlayerState): # Inherits from PlayerState
             timestamp = time.time()
         self.last_action_timestamp = timestamp
         self.last_action_user = user_id
+        # Limpa o debounce se ninguém agir por DEBOUNCE_RESET_DELAY segundos
+        if self._debounce_timer:
+            self._debounce_timer.cancel()
+        self._debounce_timer = timer_wheel.call_later(DEBOUNCE_RESET_DELAY, self._reset_debounce)
+
+    def _reset_debounce(self):
+        """Evita que o debounce trave por muito tempo"""
+        self._debounce_timer = None
+        self.last_action_timestamp = 0
+        self.last_action_user = ""
 
     def to_dict(self, manager: ConnectionManager) -> Dict:
-        db = SessionLocal()
-        track_title = "Nothing playing"
-        if self.current_track_id:
-            track = db.query(Track).filter(Track.id == self.current_track_id).first()
-            if track:
-                track_title = track.title
-        db.close()
+        """
+        Party payload for lobby lists and syncs. Memoized until the party is
+        marked dirty or a cached track title changes; callers must not mutate
+        the returned dict.
+        """
+        cache_key = (self.revision, track_cache.generation)
+        if self._dict_cache is not None and self._dict_cache_key == cache_key:
+            return self._dict_cache
+
+        track_title = track_cache.get_title(self.current_track_id, "Nothing playing")
 
         # Merge PlayerState's dict representation
-        payload = self.to_dict() # This now comes from PlayerState
+        payload = PlayerState.to_dict(self)
         payload.update({
             "party_id": self.party_id,
             "host_name": self.host_name,
@@ -283,473 +710,898 @@ class Party(PlayerState): # Inherits from PlayerState
             # "is_playlist_active": self.is_playlist_active, # Deprecated
             # "current_playlist_index": self.current_playlist_index, # Replaced by current_index
         })
+        self._dict_cache = payload
+        self._dict_cache_key = cache_key
         return payload
 
-    async def broadcast_sync(self, manager: ConnectionManager):
+    def lobby_summary(self, manager: ConnectionManager) -> Dict:
+        """Small party entry for the lobby list (no queues). Memoized like to_dict."""
+        cache_key = (self.revision, track_cache.generation)
+        if self._summary_cache is None or self._summary_cache_key != cache_key:
+            full = self.to_dict(manager)
+            self._summary_cache = {
+                "party_id": self.party_id,
+                "host_id": self.host_id,
+                "host_name": self.host_name,
+                "member_count": len(self.members),
+                "current_track_title": full["current_track_title"],
+                "is_playing": self.is_playing,
+                "mode": self.mode,
+            }
+            self._summary_cache_key = cache_key
+        return self._summary_cache
+
+    @profiler.profiled("party broadcast_sync") # Own profile when run by the auto-advance timer
+    async def broadcast_sync(self, manager: ConnectionManager, full_to: Set[str] = frozenset()):
+        """
+        Publishes the party state to its members as a versioned field-level
+        delta. Members in `full_to` (new joiners, clients that reported a
+        version gap) get a full snapshot instead.
+        """
         # Prepare the full party state including player state
-        party_state_payload = self.to_dict(manager) # Uses the overridden to_dict
+        party_state_payload = dict(self.to_dict(manager)) # Copy, to_dict is memoized
 
         # Add members list, specific to party context
         party_state_payload["members"] = manager.get_users_list_for_ids(self.members)
         # Ensure host_id is present for client-side logic (e.g. identifying host)
         party_state_payload["host_id"] = self.host_id
 
+        tracker = self.sync_tracker
+        changes = tracker.update(party_state_payload)
+        if changes:
+            self.event_log.append(tracker.version, changes.keys())
+
+        topic = party_topic(self.party_id)
+        telemetry = sync_telemetry.party(self.party_id)
+        if changes and not SYNC_DELTAS_ENABLED:
+            telemetry.count("sync_out")
+            manager.publish(topic, {"type": "party_sync", "payload": tracker.full_payload()})
+            return
+        telemetry.count("sync_out", (1 if changes else 0) + len(full_to))
+        if changes:
+            manager.publish(topic, {
+                "type": "party_sync_delta",
+                "payload": tracker.delta_payload(changes, party_id=self.party_id)
+            }, exclude=full_to)
+        if full_to:
+            full_message = SharedMessage({
+                "type": "party_sync",
+                "payload": tracker.full_payload()
+            })
+            for member_id in full_to:
+                manager.send(member_id, full_message)
+        if changes:
+            self.schedule_auto_advance(manager)
 
-        message = {
-            "type": "party_sync",
-            "payload": party_state_payload
-        }
-        for member_id in self.members:
-            if member_id in manager.active_connections:
-                await manager.active_connections[member_id].send_json(message)
+    def schedule_auto_advance(self, manager: ConnectionManager):
+        """
+        Arms a timer for the end of the current track, so the server moves
+        the party on by itself instead of waiting for a client. The track
+        duration is probed (off the event loop) the first time it is needed.
+        """
+        if self._advance_handle:
+            self._advance_handle.cancel()
+            self._advance_handle = None
+        if not self.is_playing or not self.current_track_id:
+            return
+
+        duration = track_cache.get_duration(self.current_track_id)
+        if duration is None:
+            if self._duration_probe is None or self._duration_probe.done():
+                self._duration_probe = asyncio.create_task(self._probe_duration(manager))
+            return
+
+        remaining = duration - self.position_at()
+        self._advance_handle = timer_wheel.call_later(
+            max(0.0, remaining) + AUTO_ADVANCE_GRACE, self._auto_advance, manager, self.current_track_id
+        )
 
-manager = ConnectionManager()
-parties: Dict[str, Party] = {}
+    async def _probe_duration(self, manager: ConnectionManager):
+        if await track_cache.load_duration(self.current_track_id):
+            self.schedule_auto_advance(manager)
+
+    def _auto_advance(self, manager: ConnectionManager, track_id: int):
+        self._advance_handle = None
+        if self.current_track_id != track_id or not self.is_playing:
+            return
+        duration = track_cache.get_duration(track_id) or 0
+        if self.position_at() < duration:  # Re-anchored since the timer was set
+            self.schedule_auto_advance(manager)
+            return
+        self.advance_track()
+        self.mark_dirty()
+        asyncio.create_task(self.broadcast_sync(manager))
+        lobby.mark_dirty()
+
+    def close(self):
+        """Stops the party's timers once it is disbanded."""
+        if self._advance_handle:
+            self._advance_handle.cancel()
+            self._advance_handle = None
+        if self._debounce_timer:
+            self._debounce_timer.cancel()
+            self._debounce_timer = None
+        if self._duration_probe and not self._duration_probe.done():
+            self._duration_probe.cancel()
+
+cluster = Cluster(create_backend()) # PUBSUB_URL set: parties are shared with the other workers
+manager = ConnectionManager(sessions, cluster)
+
+# A controller's sync_update only re-anchors the party timeline when it is
+# further than this from the server's extrapolated position (seconds).
+SYNC_DRIFT_TOLERANCE = float(os.getenv("SYNC_DRIFT_TOLERANCE", "0.35"))
+# Chat messages kept per party (ring buffer)
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "100"))
+# Slack after a track's known end before the server advances the party
+AUTO_ADVANCE_GRACE = 0.5
+# Seconds without actions after which a party's debounce state is cleared
+DEBOUNCE_RESET_DELAY = 5.0
 
-# Sistema de limpeza automática para evitar travas
 import asyncio
 
-async def cleanup_old_actions():
-    """Limpa ações antigas para evitar que o debounce trave por muito tempo"""
+async def log_sync_telemetry():
+    """Logs a drift/sync summary per active party every SYNC_TELEMETRY_LOG_INTERVAL seconds"""
     while True:
-        try:
-            current_time = time.time()
-            for party in parties.values():
-                # Se passou muito tempo desde a última ação (5 segundos), limpa o debounce
-                if current_time - party.last_action_timestamp > 5.0:
-                    party.last_action_timestamp = 0
-                    party.last_action_user = ""
-            await asyncio.sleep(2)  # Verifica a cada 2 segundos
-        except Exception as e:
-            print(f"Erro na limpeza automática: {e}")
-            await asyncio.sleep(5)
+        await asyncio.sleep(SYNC_TELEMETRY_LOG_INTERVAL)
+        for line in sync_telemetry.summary_lines():
+            log.info("sync_summary", f"📈 Sync {line}")
+
+def build_lobby_entries() -> Dict:
+    entries = {f"user:{u['id']}": u for u in manager.get_users_list()}
+    for party_id, party in sessions.parties.items():
+        entries[f"party:{party_id}"] = party.lobby_summary(manager)
+    # With several workers, their entries too (ours are published to them as presence)
+    return cluster.merge_entries(entries)
+
+# Every worker builds the lobby from the cluster presence, so its messages stay local
+lobby = LobbyBroadcaster(build_lobby_entries, lambda message: manager.publish(LOBBY_TOPIC, message, local_only=True))
+
+def enter_party_topic(user_id: str, party_id: str):
+    """Party members stop receiving lobby traffic while they are in the party."""
+    if not sessions.is_connected(user_id):
+        return # Served by another worker, which subscribes its connections
+    manager.unsubscribe(user_id, LOBBY_TOPIC)
+    manager.subscribe(user_id, party_topic(party_id))
+
+def return_to_lobby(user_ids: Set[str] | List[str], party_id: str | None = None):
+    """Moves users back to the lobby topic with a fresh lobby snapshot (they missed its deltas)."""
+    snapshot = SharedMessage(lobby.snapshot_message())
+    for user_id in user_ids:
+        if party_id:
+            manager.unsubscribe(user_id, party_topic(party_id))
+        if sessions.is_connected(user_id):
+            manager.subscribe(user_id, LOBBY_TOPIC)
+            manager.send(user_id, snapshot)
+
+def disband_party(party_id: str):
+    """Removes a party, stops its timers and sends remaining subscribers back to the lobby."""
+    party = sessions.remove_party(party_id)
+    if party:
+        party.close()
+        cluster.party_closed(party_id) # Other workers send their members back to the lobby
+    telemetry = sync_telemetry.drop(party_id)
+    if telemetry and telemetry.counters:
+        log.info("sync_summary", f"📈 Sync (final) {telemetry.summary_line(party_id)}", party_id=party_id, final=True)
+    return_to_lobby(manager.drop_topic(party_topic(party_id)))
+
+async def leave_current_party(user_id: str) -> Party | None:
+    """
+    Takes a user out of their party (explicit leave, end of the resume
+    window, account deletion). A host leaving disbands the party.
+    Returns the party that was left, None if the user was solo or in a
+    party of another worker (that worker does the actual leave).
+    """
+    remote_party_id = sessions.leave_remote(user_id)
+    if remote_party_id is not None:
+        owner = cluster.party_owner(remote_party_id)
+        if owner is not None: # Its party_left comes back through the user topic
+            cluster.forward(owner, user_id, manager.display_name(user_id), "leave_party", {})
+        else:
+            manager.send(user_id, {"type": "party_left", "payload": {"party_id": remote_party_id}})
+        return_to_lobby([user_id], remote_party_id)
+        return None
+    party = sessions.leave(user_id)
+    if party is None:
+        return None
+    party.mark_dirty()
+    cluster.member_left(party.party_id, user_id)
+    manager.send(user_id, {"type": "party_left", "payload": {"party_id": party.party_id}}) # Every tab of the user
+    return_to_lobby([user_id], party.party_id)
+    if not party.members or user_id == party.host_id : # If party empty or host left
+        if user_id == party.host_id and party.members: # Host left, but members remain
+            # Simplistic: disband. Could also implement host migration.
+            log.info("party_disbanded", f"Host {user_id} left party {party.party_id}, disbanding.",
+                     party_id=party.party_id, host_id=user_id)
+        disband_party(party.party_id)
+    else: # Member left, party continues
+        await party.broadcast_sync(manager)
+    return party
+
+async def finish_disconnect(session: ResumeSession):
+    """The resume window ran out: runs the leave path deferred at disconnect."""
+    # A connection opened meanwhile did not resume, so it holds no party state either
+    await leave_current_party(session.user_id)
+    if not sessions.is_connected(session.user_id):
+        manager.forget(session.user_id)
+    await broadcast_state_update()
+
+async def resume_session(connection: Connection, user_id: str, session: ResumeSession, payload: Dict):
+    """
+    Re-attaches a client that presented its resume token: it gets its party
+    back and only what it missed (one merged delta built from the party's
+    event log, newer chat messages), without a lobby-wide broadcast.
+    """
+    manager.user_names[user_id] = session.name
+    state = await manager.player_states.acquire(user_id)
+    party = sessions.party_of(user_id) # Membership was held during the window
+    remote_party_id = sessions.remote_party_of(user_id)
+    if remote_party_id is not None and cluster.party_owner(remote_party_id) is None:
+        sessions.leave_remote(user_id) # Its worker closed it meanwhile
+        remote_party_id = None
+    connection.send({"type": "resumed", "payload": {"party_id": party.party_id if party else remote_party_id}})
+
+    if remote_party_id is not None:
+        # Party of another worker: no event log here, the owner sends a full sync
+        enter_party_topic(user_id, remote_party_id)
+        forward_to_owner(connection, user_id, remote_party_id, "sync_resync", {"scope": "party"})
+    elif party is not None:
+        enter_party_topic(user_id, party.party_id)
+        tracker = party.sync_tracker
+        changes = None
+        base_version = payload.get("party_version")
+        if payload.get("party_id") == party.party_id and base_version is not None:
+            changes = party.event_log.changes_since(base_version, tracker.version, tracker.snapshot)
+        if changes is None:
+            resume_registry.counters["full_resyncs"] += 1
+            connection.send({"type": "party_sync", "payload": tracker.full_payload()})
+        elif changes:
+            resume_registry.counters["replayed_deltas"] += 1
+            connection.send({"type": "party_sync_delta", "payload": {
+                "version": tracker.version, "base_version": base_version,
+                "changes": changes, "party_id": party.party_id,
+            }})
+        chat_seq = payload.get("chat_seq", 0)
+        for message in party.chat_history:
+            if message["seq"] > chat_seq:
+                connection.send({"type": "chat_message", "payload": message})
+    elif payload.get("lobby_version") != lobby.tracker.version:
+        connection.send(lobby.snapshot_message())
+
+    if payload.get("solo_version") != state.sync_tracker.version:
+        await manager.send_solo_state_update(user_id, full=True)
 
 async def broadcast_state_update():
-    """Broadcasts the current list of users and parties to everyone."""
-    await manager.broadcast({
-        "type": "state_update",
-        "payload": {
-            "users": manager.get_users_list(),
-            "parties": [p.to_dict(manager) for p in parties.values()],
-        }
-    })
+    """
+    Marks the lobby (users and parties lists) as changed. The actual
+    broadcast is coalesced and rate-limited by LobbyBroadcaster.
+    """
+    lobby.mark_dirty()
+
+# --- Cluster (other workers serving the same parties) ---
+
+async def run_forwarded_message(origin: str, user_id: str, msg_type: str, payload: Dict, clock):
+    """A party message of a user served by another worker; replies go back through the user topic."""
+    await handle_message(RemoteConnection(user_id, origin, clock, manager.send), user_id, msg_type, payload)
+
+def remote_member_left(party_id: str, user_id: str):
+    """The owner took a local user out of its party (e.g. left from a tab on another worker)."""
+    if sessions.remote_party_of(user_id) == party_id:
+        sessions.leave_remote(user_id)
+        return_to_lobby([user_id], party_id)
+
+def remote_party_gone(party_id: str):
+    """A party of another worker was disbanded (or its worker went away)."""
+    users = manager.drop_topic(party_topic(party_id))
+    for user_id in users:
+        if sessions.remote_party_of(user_id) == party_id:
+            sessions.leave_remote(user_id)
+    return_to_lobby(users)
+
+async def remote_users_gone(user_ids: Set[str]):
+    """Users no other worker serves anymore leave the parties they had here."""
+    for user_id in user_ids:
+        if user_id not in manager.user_names: # Not connected (or held for resume) here either
+            await leave_current_party(user_id)
+    await broadcast_state_update()
+
+cluster.deliver = manager.deliver
+cluster.on_command = run_forwarded_message
+cluster.on_member_left = remote_member_left
+cluster.on_party_gone = remote_party_gone
+cluster.on_users_gone = remote_users_gone
+cluster.on_presence = lobby.mark_dirty
+
+# Messages acting on the user's party; for a party owned by another
+# worker they are forwarded there (sync_resync only with scope "party")
+PARTY_MESSAGE_TYPES = frozenset({
+    "leave_party", "set_mode", "sync_update", "player_action", "queue_action", "toggle_shuffle",
+    "set_repeat_mode", "chat_message", "set_playlist", "playback_report", "sync_resync",
+})
+
+def forward_to_owner(connection: Connection, user_id: str, party_id: str, msg_type: str, payload: Dict) -> bool:
+    """Hands a message to the worker owning the party; False if no worker does anymore."""
+    owner = cluster.party_owner(party_id)
+    if owner is None:
+        return False
+    if payload.get("client_time") is not None: # The owner cannot know this connection's clock offset
+        payload = dict(payload, client_time=connection.clock.to_server_time(payload["client_time"]))
+    cluster.forward(owner, user_id, manager.display_name(user_id), msg_type, payload, connection.clock)
+    return True
 
 # --- WebSocket Endpoint ---
 
-@app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
-    user_party_id: str | None = None
+# Inbound messages go through this router: shared middleware (party lookup,
+# forwarding, permissions, target state) in front of one handler per type.
+# Handling time and fan-out per type: GET /stats/messages
+router = MessageRouter()
+
+@metrics.collector
+def collect_message_metrics():
+    """Inbound messages per type, from the router's own histograms."""
+    routes = [(t, r) for t, r in router.routes.items() if r.metrics.handle_time.count]
+    yield "ws_messages_received_total", "counter", "Inbound WebSocket messages handled, by type", [
+        ("", {"type": t}, r.metrics.handle_time.count) for t, r in routes]
+    yield "ws_messages_skipped_total", "counter", "Inbound messages stopped by middleware (permissions, not applicable, forwarded)", [
+        ("", {"type": t}, r.metrics.skipped) for t, r in routes]
+    yield "ws_message_errors_total", "counter", "Inbound messages whose handler raised", [
+        ("", {"type": t}, r.metrics.errors) for t, r in routes]
+    yield "ws_message_handle_seconds", "histogram", "Handling time per inbound message type", [
+        s for t, r in routes for s in histogram_samples(r.metrics.handle_time, {"type": t})]
+    yield "ws_message_fanout", "histogram", "Messages queued to connections per inbound message, by type", [
+        s for t, r in routes for s in histogram_samples(r.metrics.fanout, {"type": t})]
+
+metrics.gauge("ws_connections", "Open WebSocket connections", fn=lambda: sessions.connection_count())
+metrics.gauge("ws_users", "Users with at least one open connection", fn=lambda: sessions.user_count())
+metrics.gauge("parties", "Parties owned by this worker", fn=lambda: len(sessions.parties))
+metrics.gauge("party_members", "Members of the parties owned by this worker",
+              fn=lambda: sum(len(p.members) for p in sessions.parties.values()))
+metrics.gauge("ws_outbound_queue_depth", "Messages waiting in outbound queues (all connections)",
+              fn=lambda: sum(c.depth for c in sessions.all_connections()))
+
+async def handle_message(connection: Connection, user_id: str, msg_type: str, payload: Dict):
+    """
+    Handles one inbound message of a user. `connection` is the one it came
+    in on (a RemoteConnection when forwarded by another worker).
+    """
+    # Blocking handlers show up under their message type; a sampled fraction gets profiled
+    with loop_watchdog.tag(f"ws {msg_type}"), profiler.unit(f"ws {msg_type}"):
+        await router.dispatch(MessageContext(connection, user_id, msg_type, payload))
+
+# --- Middleware ---
+
+@router.use
+def resolve_party(ctx: MessageContext) -> bool:
+    ctx.party = sessions.party_of(ctx.user_id) # None when solo; shared by all of the user's connections
+    return True
+
+@router.use
+async def forward_remote_party(ctx: MessageContext) -> bool:
+    """Party messages of a member of another worker's party are handled there."""
+    remote_party_id = sessions.remote_party_of(ctx.user_id)
+    if remote_party_id is None or ctx.msg_type not in PARTY_MESSAGE_TYPES \
+            or (ctx.msg_type == "sync_resync" and ctx.payload.get("scope") != "party"):
+        return True
+    if ctx.msg_type == "leave_party":
+        await leave_current_party(ctx.user_id) # Forwards the leave itself
+        await manager.send_solo_state_update(ctx.user_id, full=True)
+        await broadcast_state_update()
+    elif not forward_to_owner(ctx.connection, ctx.user_id, remote_party_id, ctx.msg_type, ctx.payload):
+        await leave_current_party(ctx.user_id) # Its worker is gone, and the party with it
+    return False
 
-    try:
-        while True:
-            data = await websocket.receive_json()
-            msg_type = data.get("type")
-            payload = data.get("payload", {})
-
-            # User joins for the first time
-            if msg_type == "user_join":
-                manager.user_names[user_id] = payload.get("name", "Anonymous")
-                # Ensure player state is initialized (connect already does this, but good to be sure)
-                if user_id not in manager.player_states:
-                    manager.player_states[user_id] = PlayerState()
-                await manager.send_solo_state_update(user_id) # Send initial solo state
-                await broadcast_state_update()
-
-            # Create a new party
-            elif msg_type == "create_party":
-                if user_id not in [p.host_id for p in parties.values()]: # User is not already a host
-                    # Retrieve solo player state
-                    solo_player_state = manager.player_states.get(user_id)
-
-                    party = Party(
-                        host_id=user_id,
-                        host_name=manager.user_names.get(user_id, "Unknown"),
-                        initial_player_state=solo_player_state # Pass solo state to party
-                    )
-                    parties[party.party_id] = party
-                    user_party_id = party.party_id
-
-                    # Clear or reset solo player state for the user who created the party
-                    if user_id in manager.player_states:
-                        manager.player_states[user_id] = PlayerState() # Reset to default
-                        # Optionally, send an update for the now-empty solo state
-                        # await manager.send_solo_state_update(user_id)
+def in_party(ctx: MessageContext) -> bool:
+    return ctx.party is not None
 
-                    await party.broadcast_sync(manager)
-                    await broadcast_state_update()
-
-            # Join an existing party
-            elif msg_type == "join_party":
-                party_id = payload.get("party_id")
-                if party_id in parties:
-                    party = parties[party_id]
-                    party.members.add(user_id)
-                    user_party_id = party_id
-                    await party.broadcast_sync(manager)
-                    await broadcast_state_update()
-
-            # Leave the current party
-            elif msg_type == "leave_party":
-                if user_party_id and user_party_id in parties:
-                    party = parties[user_party_id]
-                    if user_id in party.members:
-                        party.members.remove(user_id)
-                    # If host leaves, disband party
-                    if user_id == party.host_id or not party.members:
-                        del parties[user_party_id]
-                    else:
-                        await party.broadcast_sync(manager)
-                    user_party_id = None
-                    # If user leaves party, send them their current solo state
-                    await manager.send_solo_state_update(user_id)
-                    await broadcast_state_update()
-
-            # Player action from a client
-            elif msg_type == "player_action":
-                action = payload.get("action")
-                target_state: PlayerState | None = None
-                is_party_action = False
-
-                if user_party_id and user_party_id in parties:
-                    party = parties[user_party_id]
-                    action_timestamp = time.time()
-                    if party.can_accept_action(user_id, action_timestamp):
-                        party.update_action_timestamp(user_id, action_timestamp)
-                        target_state = party
-                        is_party_action = True
-                    else:
-                        print(f"🚫 Party action rejected: {action} from {user_id} (debounce/permissions)")
-                        await party.broadcast_sync(manager) # Realign client
-                        continue # Skip processing this action
-                elif not user_party_id and user_id in manager.player_states: # Solo user
-                    target_state = manager.player_states[user_id]
-                
-                if target_state:
-                    print(f"🎮 Player action: {action} for {'party ' + user_party_id if is_party_action else 'solo user ' + user_id}")
-                    if action in ["play", "pause"]:
-                        target_state.is_playing = action == "play"
-                    elif action == "seek":
-                        target_state.current_time = payload.get("currentTime", 0)
-                    elif action == "change_track":
-                        new_track_id = payload.get("track_id")
-                        if new_track_id in target_state.queue:
-                            target_state.current_index = target_state.queue.index(new_track_id)
-                            target_state.set_current_track()
-                            target_state.current_time = 0
-                            target_state.is_playing = True
-                        else: # Track not in queue, try adding it (e.g. from library click)
-                            target_state.queue.append(new_track_id)
-                            target_state.current_index = len(target_state.queue) -1
-                            target_state.set_current_track()
-                            target_state.current_time = 0
-                            target_state.is_playing = True
-                            if target_state.is_shuffled: # also add to original_queue if shuffled
-                                target_state.original_queue.append(new_track_id)
-
-
-                    elif action == "next_track":
-                        if not target_state.queue: continue
-
-                        if target_state.repeat_mode == 'one' and target_state.is_playing:
-                            target_state.current_time = 0 # Repeat current track
-                        elif target_state.current_index < len(target_state.queue) - 1:
-                            target_state.current_index += 1
-                        elif target_state.repeat_mode == 'all': # End of queue, repeat all
-                            target_state.current_index = 0
-                        else: # End of queue, no repeat or repeat one (but not playing)
-                            target_state.is_playing = False
-                            # Optionally, could set current_index to -1 or keep it at end
-
-                        if target_state.is_playing or target_state.repeat_mode == 'all' or \
-                           (target_state.current_index != len(target_state.queue) -1 and target_state.current_index != -1) : # only reset time if actually moving to a track
-                            target_state.set_current_track()
-                            target_state.current_time = 0
-                            target_state.is_playing = True # Autoplay next track
-
-                    elif action == "prev_track":
-                        if not target_state.queue: continue
-
-                        if target_state.current_time > 3 or target_state.current_index == 0 : # If played for >3s or first track, restart current
-                            target_state.current_time = 0
-                        elif target_state.current_index > 0:
-                            target_state.current_index -= 1
-                        # No wrap-around for previous in this logic, can be added if needed
-                        
-                        target_state.set_current_track()
-                        target_state.current_time = 0
-                        target_state.is_playing = True # Autoplay previous track
-
-                    if is_party_action:
-                        await parties[user_party_id].broadcast_sync(manager)
-                        await broadcast_state_update() # To update track title in party list
-                    else:
-                        await manager.send_solo_state_update(user_id)
-
-            # Sync update from party host/democratic member (Only for parties)
-            elif msg_type == "sync_update" and user_party_id and user_party_id in parties:
-                party = parties[user_party_id]
-                is_host_or_democratic_controller = (user_id == party.host_id) or \
-                                                 (party.mode == 'democratic' and party.can_accept_action(user_id))
-
-                if is_host_or_democratic_controller:
-                    if party.mode == 'democratic' and user_id != party.host_id:
-                        party.update_action_timestamp(user_id) # Update if democratic non-host sends
-                        
-                    party.current_time = payload.get("currentTime", party.current_time)
-                    party.is_playing = payload.get("is_playing", party.is_playing)
-                    # Potentially sync other parts of PlayerState if needed, but usually just time/play state
-                    await party.broadcast_sync(manager)
+def party_host(ctx: MessageContext) -> bool:
+    return ctx.user_id == ctx.party.host_id
+
+def party_controller(ctx: MessageContext) -> bool:
+    """Host, or anyone in democratic mode"""
+    return (ctx.user_id == ctx.party.host_id) or (ctx.party.mode == 'democratic')
+
+def controlled_state(ctx: MessageContext) -> bool:
+    """
+    Target of a queue/playback setting change: the party if the user may
+    control it, otherwise the user's solo state.
+    """
+    if ctx.party is not None:
+        if not party_controller(ctx):
+            log.info("action_rejected", f"🚫 Party {ctx.msg_type} rejected from {ctx.user_id} (permissions)",
+                     msg_type=ctx.msg_type, user_id=ctx.user_id, party_id=ctx.party.party_id, reason="permissions")
+            return False
+        ctx.target = ctx.party
+        ctx.is_party_action = True
+    else:
+        ctx.target = manager.player_states.get(ctx.user_id)
+    return ctx.target is not None
+
+async def debounced_state(ctx: MessageContext) -> bool:
+    """Like controlled_state, but party actions also go through the debounce (player_action)."""
+    party = ctx.party
+    if party is None:
+        ctx.target = manager.player_states.get(ctx.user_id) # Solo user
+        return ctx.target is not None
+    action_timestamp = time.time()
+    if not party.can_accept_action(ctx.user_id, action_timestamp):
+        log.info("action_rejected", f"🚫 Party action rejected: {ctx.payload.get('action')} from {ctx.user_id} (debounce/permissions)",
+                 msg_type=ctx.msg_type, action=ctx.payload.get("action"), user_id=ctx.user_id, party_id=party.party_id,
+                 reason="debounce/permissions")
+        await party.broadcast_sync(manager, full_to={ctx.user_id}) # Realign client
+        return False
+    party.update_action_timestamp(ctx.user_id, action_timestamp)
+    ctx.target = party
+    ctx.is_party_action = True
+    return True
+
+async def publish_target(ctx: MessageContext, lobby_changed: bool = False):
+    """Sends out a changed target state: party sync to the members, or the user's solo state."""
+    ctx.target.mark_dirty()
+    if ctx.is_party_action:
+        await ctx.party.broadcast_sync(manager)
+        if lobby_changed:
+            await broadcast_state_update() # To update track title in party list
+    else:
+        await manager.send_solo_state_update(ctx.user_id)
+
+# --- Handlers ---
+
+# Reconnecting client presenting its resume token
+@router.on("resume")
+async def on_resume(ctx: MessageContext):
+    session = resume_registry.resume(ctx.user_id, ctx.payload.get("token"))
+    if session is None:
+        ctx.connection.send({"type": "resume_failed", "payload": {}}) # Client falls back to user_join
+        return
+    await resume_session(ctx.connection, ctx.user_id, session, ctx.payload)
+
+# User joins for the first time
+@router.on("user_join")
+async def on_user_join(ctx: MessageContext):
+    user_id, connection, party = ctx.user_id, ctx.connection, ctx.party
+    # Back without a resume token (e.g. page reload): the held session ends now
+    if resume_registry.expire_now(user_id):
+        await leave_current_party(user_id)
+        party = None
+    remote_party_id = sessions.remote_party_of(user_id)
+    manager.user_names[user_id] = ctx.payload.get("name", "Anonymous")
+    # Ensure player state is initialized (connect already does this, but good to be sure)
+    await manager.player_states.acquire(user_id)
+    await manager.send_solo_state_update(user_id, full=True) # Send initial solo state
+    if party is not None: # Another tab of a party member: straight into the party
+        connection.send({"type": "party_sync", "payload": party.sync_tracker.full_payload()})
+    elif remote_party_id is not None and cluster.party_owner(remote_party_id):
+        forward_to_owner(connection, user_id, remote_party_id, "sync_resync", {"scope": "party"})
+    else:
+        connection.send(lobby.snapshot_message())
+    if resume_registry.enabled:
+        session = resume_registry.issue(user_id, manager.user_names[user_id])
+        connection.send({"type": "session", "payload": {
+            "token": session.token, "resume_window": resume_registry.window,
+        }})
+    await broadcast_state_update()
+
+# Create a new party
+@router.on("create_party")
+async def on_create_party(ctx: MessageContext):
+    user_id = ctx.user_id
+    if ctx.party is not None or sessions.remote_party_of(user_id) is not None:
+        return # Already in (or hosting) a party
+    # Retrieve solo player state
+    solo_player_state = manager.player_states.get(user_id)
+
+    party = Party(
+        host_id=user_id,
+        host_name=manager.user_names.get(user_id, "Unknown"),
+        initial_player_state=solo_player_state # Pass solo state to party
+    )
+    sessions.add_party(party)
+    enter_party_topic(user_id, party.party_id)
+
+    # Clear or reset solo player state for the user who created the party
+    if user_id in manager.player_states:
+        manager.player_states[user_id] = PlayerState() # Reset to default
+        # Optionally, send an update for the now-empty solo state
+        # await manager.send_solo_state_update(user_id)
+
+    await party.broadcast_sync(manager, full_to={user_id})
+    await broadcast_state_update()
+
+# Join an existing party
+@router.on("join_party")
+async def on_join_party(ctx: MessageContext):
+    user_id = ctx.user_id
+    target_id = ctx.payload.get("party_id")
+    target = sessions.get_party(target_id)
+    owner = cluster.party_owner(target_id) if target is None else None
+    if owner is not None and target_id != sessions.remote_party_of(user_id):
+        # Party of another worker: it keeps the membership, this one routes the party topic
+        await leave_current_party(user_id) # A user is in one party at a time
+        sessions.join_remote(user_id, target_id)
+        enter_party_topic(user_id, target_id)
+        forward_to_owner(ctx.connection, user_id, target_id, ctx.msg_type, ctx.payload)
+    elif target is not None and target is not ctx.party:
+        await leave_current_party(user_id) # A user is in one party at a time
+        sessions.join(user_id, target)
+        target.mark_dirty()
+        enter_party_topic(user_id, target.party_id)
+        await target.broadcast_sync(manager, full_to={user_id})
+        await broadcast_state_update()
+
+# Leave the current party
+@router.on("leave_party")
+async def on_leave_party(ctx: MessageContext):
+    if await leave_current_party(ctx.user_id): # Disbands the party if the host leaves
+        # If user leaves party, send them their current solo state
+        await manager.send_solo_state_update(ctx.user_id, full=True)
+        await broadcast_state_update()
+
+# Player action from a client
+@router.on("player_action", debounced_state)
+async def on_player_action(ctx: MessageContext):
+    action = ctx.payload.get("action")
+    target_state: PlayerState = ctx.target
+    payload = ctx.payload
+    log.info("player_action", f"🎮 Player action: {action} for {'party ' + ctx.party.party_id if ctx.is_party_action else 'solo user ' + ctx.user_id}",
+             action=action, user_id=ctx.user_id, party_id=ctx.party.party_id if ctx.is_party_action else None)
+    if action in ["play", "pause"]:
+        target_state.is_playing = action == "play"
+        if payload.get("currentTime") is not None: # Align everyone with the actor
+            target_state.current_time = payload["currentTime"]
+    elif action == "seek":
+        target_state.current_time = payload.get("currentTime", 0)
+    elif action == "change_track":
+        new_track_id = payload.get("track_id")
+        if new_track_id in target_state.queue:
+            target_state.current_index = target_state.play_index(new_track_id)
+            target_state.set_current_track()
+            target_state.current_time = 0
+            target_state.is_playing = True
+        else: # Track not in queue, try adding it (e.g. from library click)
+            target_state.append(new_track_id) # Added tracks play last, shuffled or not
+            target_state.current_index = len(target_state.queue) -1
+            target_state.set_current_track()
+            target_state.current_time = 0
+            target_state.is_playing = True
+
+
+    elif action == "next_track":
+        if not target_state.queue: return
+        target_state.advance_track()
+
+    elif action == "prev_track":
+        if not target_state.queue: return
+
+        if target_state.position_at() > 3 or target_state.current_index == 0 : # If played for >3s or first track, restart current
+            target_state.current_time = 0
+        elif target_state.current_index > 0:
+            target_state.current_index -= 1
+        # No wrap-around for previous in this logic, can be added if needed
+
+        target_state.set_current_track()
+        target_state.current_time = 0
+        target_state.is_playing = True # Autoplay previous track
+
+    await publish_target(ctx, lobby_changed=True)
+
+# Sync update from party host/democratic member (Only for parties)
+@router.on("sync_update", in_party)
+async def on_sync_update(ctx: MessageContext):
+    party, user_id, payload = ctx.party, ctx.user_id, ctx.payload
+    is_host_or_democratic_controller = (user_id == party.host_id) or \
+                                     (party.mode == 'democratic' and party.can_accept_action(user_id))
+
+    sync_telemetry.party(party.party_id).count("sync_in")
+
+    if is_host_or_democratic_controller:
+        if party.mode == 'democratic' and user_id != party.host_id:
+            party.update_action_timestamp(user_id) # Update if democratic non-host sends
+
+        # The server timeline is authoritative; the controller's report
+        # only re-anchors it (and triggers a broadcast) when it drifted.
+        reported_time = payload.get("currentTime")
+        reported_playing = payload.get("is_playing", party.is_playing)
+        sampled_at = ctx.connection.clock.to_server_time(payload.get("client_time")) or server_now()
+        drifted = reported_time is not None and \
+            abs(party.position_at(sampled_at) - reported_time) > SYNC_DRIFT_TOLERANCE
+        if drifted or reported_playing != party.is_playing:
+            if drifted:
+                sync_telemetry.party(party.party_id).count("reanchors")
+            party.is_playing = reported_playing
+            if reported_time is not None:
+                party.set_position(reported_time, sampled_at)
+            party.mark_dirty()
+            await party.broadcast_sync(manager)
+
+# Periodic report of where a member's player actually is, for the
+# drift telemetry (GET /stats/sync). Never changes party state.
+@router.on("playback_report", in_party)
+async def on_playback_report(ctx: MessageContext):
+    party, payload, clock = ctx.party, ctx.payload, ctx.connection.clock
+    telemetry = sync_telemetry.party(party.party_id)
+    position = payload.get("position")
+    if position is None or payload.get("track_id") != party.current_track_id \
+            or payload.get("is_playing") != party.is_playing:
+        telemetry.count("mismatched_reports")  # Loading a track, or state not applied yet
+    else:
+        sampled_at = clock.to_server_time(payload.get("client_time")) or server_now()
+        telemetry.record_report(
+            ctx.user_id, position - party.position_at(sampled_at),
+            clock.offset, clock.rtt,
+            corrections=int(payload.get("corrections") or 0),
+        )
+
+# NTP-style clock sync: the client computes its offset from
+# t0/t1/t2 and reports the previous result with the next ping.
+@router.on("clock_ping")
+async def on_clock_ping(ctx: MessageContext):
+    received_at = server_now()
+    payload = ctx.payload
+    if payload.get("offset") is not None and payload.get("rtt") is not None:
+        ctx.connection.clock.add_sample(payload["offset"], payload["rtt"])
+    ctx.connection.send({
+        "type": "clock_pong",
+        "payload": {"t0": payload.get("t0"), "t1": received_at, "t2": server_now()}
+    })
+
+# Heartbeat answer (receiving it already refreshed the liveness deadline)
+@router.on("pong")
+async def on_pong(ctx: MessageContext):
+    ctx.connection.record_pong(ctx.payload.get("t"))
+
+# Lobby list requested explicitly (e.g. after leaving a party)
+@router.on("get_parties")
+async def on_get_parties(ctx: MessageContext):
+    ctx.connection.send(lobby.snapshot_message())
+
+# Client saw a version gap in deltas and needs a full snapshot
+@router.on("sync_resync")
+async def on_sync_resync(ctx: MessageContext):
+    scope = ctx.payload.get("scope")
+    if scope == "party" and ctx.party is not None:
+        await ctx.party.broadcast_sync(manager, full_to={ctx.user_id})
+    elif scope == "lobby":
+        ctx.connection.send(lobby.snapshot_message())
+    else:
+        await manager.send_solo_state_update(ctx.user_id, full=True)
+
+# Set party mode (host only)
+@router.on("set_mode", in_party, party_host)
+async def on_set_mode(ctx: MessageContext):
+    party = ctx.party
+    party.mode = ctx.payload.get("mode", "host")
+    party.mark_dirty()
+    await party.broadcast_sync(manager)
+    await broadcast_state_update() # Update party list display
+
+# Queue actions (add, remove, clear)
+@router.on("queue_action", controlled_state)
+async def on_queue_action(ctx: MessageContext):
+    payload = ctx.payload
+    action = payload.get("action")
+    track_id = payload.get("track_id")
+    position = payload.get("position")
+    target_state: PlayerState = ctx.target
+
+    if action == "add":
+        if track_id:
+            target_state.append(track_id) # Plays after the shuffled entries when shuffled
+            # If queue was empty and this is the first track, set as current
+            if target_state.current_index == -1:
+                target_state.current_index = 0
+                target_state.set_current_track()
+                # target_state.is_playing = True # Optionally auto-play
+
+    elif action == "remove":
+        if position is not None and 0 <= position < len(target_state.queue):
+            removed_current = position == target_state.current_index
+            target_state.remove_at(position) # Also keeps current_index on the same entry
+            if removed_current:
+                # If current track removed, try to play next or stop
+                if target_state.current_index >= len(target_state.queue): # Was last track
+                     target_state.current_index = len(target_state.queue) -1 # Point to new last or -1
+                target_state.set_current_track()
+                if not target_state.current_track_id:
+                    target_state.is_playing = False
+                else: # auto play next if current was removed
+                    target_state.current_time = 0
+                    target_state.is_playing = True
+
+    elif action == "move":
+        to = payload.get("to")
+        queue_size = len(target_state.queue)
+        if position is None or to is None or not (0 <= position < queue_size and 0 <= to < queue_size):
+            return
+        if target_state.is_shuffled: # Play order comes from the seed; reordering would fight it
+            return
+        target_state.queue.move(position, to)
+        # Keep current_index on the same entry
+        current = target_state.current_index
+        if position == current:
+            target_state.current_index = to
+        elif position < current <= to:
+            target_state.current_index -= 1
+        elif to <= current < position:
+            target_state.current_index += 1
+
+    elif action == "clear":
+        target_state.clear_queue()
+        target_state.current_index = -1
+        target_state.set_current_track() # This will set current_track_id to None
+        target_state.is_playing = False
+
+    await publish_target(ctx)
+
+# Toggle Shuffle
+@router.on("toggle_shuffle", controlled_state)
+async def on_toggle_shuffle(ctx: MessageContext):
+    target_state: PlayerState = ctx.target
+    # Only the seed changes; the queue itself is never reordered or copied
+    if target_state.is_shuffled:
+        target_state.unshuffle()
+        if target_state.current_index == -1 and target_state.queue:
+            target_state.current_index = 0
+    else:
+        target_state.shuffle() # Current track first, rest in seeded order
+
+    target_state.set_current_track() # Update current_track_id based on new index
+    await publish_target(ctx)
+
+def valid_repeat_mode(ctx: MessageContext) -> bool:
+    return ctx.payload.get("mode") in ['off', 'all', 'one']
+
+# Set Repeat Mode
+@router.on("set_repeat_mode", valid_repeat_mode, controlled_state)
+async def on_set_repeat_mode(ctx: MessageContext):
+    ctx.target.repeat_mode = ctx.payload.get("mode")
+    await publish_target(ctx)
+
+# Chat message
+@router.on("chat_message", in_party)
+async def on_chat_message(ctx: MessageContext):
+    party = ctx.party
+    text = ctx.payload.get("text", "").strip()
+
+    if text:  # Não enviar mensagens vazias
+        party.chat_seq += 1
+        message_obj = {
+            "author": manager.display_name(ctx.user_id),
+            "text": text,
+            "timestamp": time.time(),
+            "seq": party.chat_seq, # Lets resuming clients ask only for what they missed
+        }
+
+        # Histórico: buffer circular com as últimas CHAT_HISTORY_LIMIT mensagens
+        party.chat_history.append(message_obj)
+
+        # Broadcast da mensagem
+        chat_message = {
+            "type": "chat_message",
+            "payload": message_obj
+        }
+        manager.publish(party_topic(party.party_id), chat_message)
+
+# Set playlist (host or democratic mode)
+@router.on("set_playlist", in_party, party_controller)
+async def on_set_playlist(ctx: MessageContext):
+    party = ctx.party
+    playlist_id = ctx.payload.get("playlist_id")
+
+    if playlist_id:
+        db = SessionLocal()
+        try:
+            # Busca a playlist e suas tracks
+            playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
+            if playlist:
+                playlist_tracks = db.query(PlaylistTrack).filter(
+                    PlaylistTrack.playlist_id == playlist_id
+                ).order_by(PlaylistTrack.position).all()
+
+                if playlist_tracks:
+                    # Load playlist tracks into the queue
+                    party.unshuffle() # Reset shuffle when loading new playlist
+                    party.queue = [pt.track_id for pt in playlist_tracks]
+                    party.current_index = 0 if party.queue else -1
+                    party.set_current_track()
+                    party.is_playing = True if party.current_track_id else False
+                    party.current_time = 0.0
+                    party.mark_dirty()
+
+                    log.info("playlist_loaded", f"🎵 Playlist '{playlist.name}' loaded into party queue by {manager.display_name(ctx.user_id)}",
+                             playlist_id=playlist.id, party_id=party.party_id, user_id=ctx.user_id, tracks=len(party.queue))
 
-            # Set party mode (host only)
-            elif msg_type == "set_mode" and user_party_id and user_party_id in parties:
-                party = parties[user_party_id]
-                if user_id == party.host_id: # Only host can change mode
-                    party.mode = payload.get("mode", "host")
                     await party.broadcast_sync(manager)
-                    await broadcast_state_update() # Update party list display
-
-            # Queue actions (add, remove, clear)
-            elif msg_type == "queue_action":
-                action = payload.get("action")
-                track_id = payload.get("track_id")
-                position = payload.get("position")
-                
-                target_state: PlayerState | None = None
-                is_party_action = False
-
-                if user_party_id and user_party_id in parties:
-                    party = parties[user_party_id]
-                    # Check permissions for party queue modification
-                    if (user_id == party.host_id) or (party.mode == 'democratic'):
-                        target_state = party
-                        is_party_action = True
-                    else:
-                        print(f"🚫 Party queue action rejected: {action} from {user_id} (permissions)")
-                        # Optionally send a rejection message or just ignore
-                        continue
-                elif not user_party_id and user_id in manager.player_states: # Solo user
-                    target_state = manager.player_states[user_id]
-
-                if target_state:
-                    if action == "add":
-                        if track_id:
-                            target_state.queue.append(track_id)
-                            if target_state.is_shuffled: # If shuffled, also add to original_queue
-                                target_state.original_queue.append(track_id)
-                            # If queue was empty and this is the first track, set as current
-                            if target_state.current_index == -1:
-                                target_state.current_index = 0
-                                target_state.set_current_track()
-                                # target_state.is_playing = True # Optionally auto-play
-                    
-                    elif action == "remove":
-                        if position is not None and 0 <= position < len(target_state.queue):
-                            removed_track_id = target_state.queue.pop(position)
-                            if target_state.is_shuffled:
-                                if removed_track_id in target_state.original_queue:
-                                    target_state.original_queue.remove(removed_track_id)
-
-                            # Adjust current_index if the removed track was before or at current_index
-                            if position < target_state.current_index:
-                                target_state.current_index -= 1
-                            elif position == target_state.current_index:
-                                # If current track removed, try to play next or stop
-                                if target_state.current_index >= len(target_state.queue): # Was last track
-                                     target_state.current_index = len(target_state.queue) -1 # Point to new last or -1
-                                target_state.set_current_track()
-                                if not target_state.current_track_id:
-                                    target_state.is_playing = False
-                                else: # auto play next if current was removed
-                                    target_state.current_time = 0
-                                    target_state.is_playing = True
-
-
-                    elif action == "clear":
-                        target_state.queue.clear()
-                        target_state.original_queue.clear()
-                        target_state.current_index = -1
-                        target_state.set_current_track() # This will set current_track_id to None
-                        target_state.is_playing = False
-                    
-                    if is_party_action:
-                        await parties[user_party_id].broadcast_sync(manager)
-                    else:
-                        await manager.send_solo_state_update(user_id)
-
-            # Toggle Shuffle
-            elif msg_type == "toggle_shuffle":
-                target_state: PlayerState | None = None
-                is_party_action = False
-                if user_party_id and user_party_id in parties:
-                    party = parties[user_party_id]
-                    if (user_id == party.host_id) or (party.mode == 'democratic'):
-                        target_state = party
-                        is_party_action = True
-                elif not user_party_id and user_id in manager.player_states:
-                    target_state = manager.player_states[user_id]
-
-                if target_state:
-                    target_state.is_shuffled = not target_state.is_shuffled
-                    current_track_playing_id = target_state.current_track_id
-
-                    if target_state.is_shuffled:
-                        target_state.original_queue = target_state.queue[:]
-
-                        # Shuffle queue but keep current track at index 0 if playing
-                        if current_track_playing_id and current_track_playing_id in target_state.queue:
-                            playing_track = target_state.queue.pop(target_state.current_index)
-                            random.shuffle(target_state.queue)
-                            target_state.queue.insert(0, playing_track)
-                            target_state.current_index = 0
-                        else:
-                            random.shuffle(target_state.queue)
-                            target_state.current_index = 0 if target_state.queue else -1
-                    else: # Unshuffle
-                        target_state.queue = target_state.original_queue[:]
-                        if current_track_playing_id and current_track_playing_id in target_state.queue:
-                            target_state.current_index = target_state.queue.index(current_track_playing_id)
-                        elif target_state.queue: # If no specific track was playing or it's not in original, pick first
-                            target_state.current_index = 0
-                        else: # Queue is empty
-                            target_state.current_index = -1
-
-                    target_state.set_current_track() # Update current_track_id based on new index
-
-                    if is_party_action:
-                        await parties[user_party_id].broadcast_sync(manager)
-                    else:
-                        await manager.send_solo_state_update(user_id)
-
-            # Set Repeat Mode
-            elif msg_type == "set_repeat_mode":
-                new_mode = payload.get("mode")
-                if new_mode not in ['off', 'all', 'one']: continue
-
-                target_state: PlayerState | None = None
-                is_party_action = False
-                if user_party_id and user_party_id in parties:
-                    party = parties[user_party_id]
-                    if (user_id == party.host_id) or (party.mode == 'democratic'):
-                        target_state = party
-                        is_party_action = True
-                elif not user_party_id and user_id in manager.player_states:
-                    target_state = manager.player_states[user_id]
-
-                if target_state:
-                    target_state.repeat_mode = new_mode
-                    if is_party_action:
-                        await parties[user_party_id].broadcast_sync(manager)
-                    else:
-                        await manager.send_solo_state_update(user_id)
-
-            # Chat message
-            elif msg_type == "chat_message" and user_party_id and user_party_id in parties:
-                party = parties[user_party_id]
-                text = payload.get("text", "").strip()
-                
-                if text:  # Não enviar mensagens vazias
-                    message_obj = {
-                        "author": manager.user_names.get(user_id, "Unknown"),
-                        "text": text,
-                        "timestamp": time.time()
-                    }
-                    
-                    # Opcional: salvar no histórico
-                    party.chat_history.append(message_obj)
-                    # Manter apenas as últimas 100 mensagens
-                    if len(party.chat_history) > 100:
-                        party.chat_history = party.chat_history[-100:]
-                    
-                    # Broadcast da mensagem
-                    chat_message = {
-                        "type": "chat_message",
-                        "payload": message_obj
-                    }
-                    for member_id in party.members:
-                        if member_id in manager.active_connections:
-                            await manager.active_connections[member_id].send_json(chat_message)
-
-            # Set playlist (host or democratic mode)
-            elif msg_type == "set_playlist" and user_party_id and user_party_id in parties:
-                party = parties[user_party_id]
-                # Verifica permissões: host ou modo democrático
-                can_control = (user_id == party.host_id) or (party.mode == 'democratic')
-                
-                if can_control:
-                    playlist_id = payload.get("playlist_id")
-                    
-                    if playlist_id:
-                        db = SessionLocal()
-                        try:
-                            # Busca a playlist e suas tracks
-                            playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-                            if playlist:
-                                playlist_tracks = db.query(PlaylistTrack).filter(
-                                    PlaylistTrack.playlist_id == playlist_id
-                                ).order_by(PlaylistTrack.position).all()
-                                
-                                if playlist_tracks:
-                                    # Load playlist tracks into the queue
-                                    party.queue = [pt.track_id for pt in playlist_tracks]
-                                    party.original_queue = party.queue[:] # Store for unshuffling
-                                    party.is_shuffled = False # Reset shuffle when loading new playlist
-                                    party.current_index = 0 if party.queue else -1
-                                    party.set_current_track()
-                                    party.is_playing = True if party.current_track_id else False
-                                    party.current_time = 0.0
-                                    
-                                    print(f"🎵 Playlist '{playlist.name}' loaded into party queue by {manager.user_names.get(user_id, 'Unknown')}")
-                                    
-                                    await party.broadcast_sync(manager)
-                                    await broadcast_state_update() # Update party list display if needed
-                        finally:
-                            db.close()
-                # If solo user wants to play a playlist, this logic needs to be handled client-side
-                # or via a new specific solo_playlist_play message.
-                # For now, "set_playlist" is a party-only concept on backend.
-                # Solo users would typically add tracks from a playlist to their queue one by one or via a "play all" client-side.
+                    await broadcast_state_update() # Update party list display if needed
+        finally:
+            db.close()
+    # If solo user wants to play a playlist, this logic needs to be handled client-side
+    # or via a new specific solo_playlist_play message.
+    # For now, "set_playlist" is a party-only concept on backend.
+    # Solo users would typically add tracks from a playlist to their queue one by one or via a "play all" client-side.
+
 
+@app.websocket("/ws/{user_id}")
+async def websocket_endpoint(websocket: WebSocket, user_id: str):
+    connection = await manager.connect(websocket, user_id)
+    resumable = False
+
+    try:
+        while True:
+            try:
+                msg_type, payload = decode_inbound(await connection.receive_message())
+            except MessageDecodeError as e:
+                invalid_messages.inc()
+                connection.send({"type": "error", "payload": {"message": str(e), "code": "INVALID_MESSAGE"}})
+                continue
+            await handle_message(connection, user_id, msg_type, payload)
 
     except WebSocketDisconnect:
-        # Handle user disconnecting
-        if user_party_id and user_party_id in parties:
-            party = parties[user_party_id]
-            if user_id in party.members:
-                party.members.remove(user_id)
-            if not party.members or user_id == party.host_id : # If party empty or host left
-                if user_id == party.host_id and party.members: # Host left, but members remain
-                    # Simplistic: disband. Could also implement host migration.
-                    print(f"Host {user_id} left party {party.party_id}, disbanding.")
-                del parties[user_party_id]
-            else: # Member left, party continues
-                await party.broadcast_sync(manager)
-        # Note: Solo player state in manager.player_states[user_id] persists after disconnect.
+        # Handle user disconnecting. Only the user's last connection counts
+        # (other tabs keep the session going). A resumable session keeps the
+        # party membership and lobby presence for the resume window; the leave
+        # path then runs in finish_disconnect() unless the client comes back.
+        if sessions.is_last_connection(user_id, connection):
+            if resume_registry.suspend(user_id, lambda session: asyncio.create_task(finish_disconnect(session))):
+                resumable = True
+            else:
+                await leave_current_party(user_id)
+        # Note: Solo player state in manager.player_states[user_id] persists until its TTL runs out.
     finally:
-        manager.disconnect(user_id) # Removes from active_connections and user_names
-        await broadcast_state_update() # Update lists for all clients
+        manager.disconnect(user_id, connection, keep_presence=resumable) # Removes the connection (and, with the last one, user_names)
+        if not resumable:
+            await broadcast_state_update() # Update lists for all clients
 
 
 # --- Standard HTTP Routes ---
 
+# Log the LAN address at startup (found off the event loop; 0 skips it, e.g. in containers)
+SHOW_NETWORK_URL = os.getenv("SHOW_NETWORK_URL", "1") == "1"
+NETWORK_URL_TIMEOUT = 2.0
+
 def get_host_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.settimeout(NETWORK_URL_TIMEOUT)
         s.connect(("8.8.8.8", 80)); ip = s.getsockname()[0]; s.close()
         return ip
     except Exception: return "localhost"
 
+async def log_network_url():
+    """Runs after startup: never delays serving, gives up on hosts without a route out."""
+    try:
+        host_ip = await asyncio.wait_for(asyncio.to_thread(get_host_ip), NETWORK_URL_TIMEOUT)
+    except asyncio.TimeoutError:
+        return
+    log.info("network_url", f"  - Network: http://{host_ip}:8000", network=f"http://{host_ip}:8000")
+
 @app.on_event("startup")
 async def startup_event():
-    host_ip = get_host_ip()
-    print("---")
-    print(f"  - Local:   http://localhost:8000")
-    print(f"  - Network: http://{host_ip}:8000")
-    print("---")
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    init_db()
+    log.info("server_started", "  - Local:   http://localhost:8000", local="http://localhost:8000")
+    if SHOW_NETWORK_URL:
+        asyncio.create_task(log_network_url())
     
-    # Inicia a limpeza automática de ações antigas
-    asyncio.create_task(cleanup_old_actions())
-    print("🧹 Sistema de limpeza automática iniciado")
+    if SYNC_TELEMETRY_LOG_INTERVAL > 0:
+        asyncio.create_task(log_sync_telemetry())
+    await cluster.start()
+    if LOOP_LAG_INTERVAL > 0:
+        asyncio.create_task(monitor_loop_lag(LOOP_LAG_INTERVAL))
+    loop_watchdog.start()
+    profiler.instrument_routes(app) # Sync endpoints run in threads: sampled there when their request is
+    profiler.attach(asyncio.get_running_loop())
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, profiler.toggle) # kill -USR2 <pid>
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        pass # No SIGUSR2 (Windows) or not the main thread; /admin/profiling still works
+    if cluster.distributed:
+        log.info("cluster_joined", f"🔗 Worker {cluster.worker_id} no pub/sub {cluster.backend.stats().get('broker', '')}",
+                 worker_id=cluster.worker_id)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await cluster.close() # Peers drop this worker's parties and users right away
+    loop_watchdog.stop()
+    profiler.disable()
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
@@ -802,6 +1654,7 @@ async def upload_audio(file: UploadFile = File(...)):
     db = SessionLocal()
     track = Track(title=os.path.splitext(file.filename)[0], filename=os.path.basename(output_path))
     db.add(track); db.commit(); db.refresh(track); db.close()
+    track_cache.put(track)
     return {"id": track.id, "title": track.title}
 
 @app.post("/import_from_url")
@@ -811,7 +1664,7 @@ async def import_from_url(request: URLImportRequest):
     """
     try:
         # Importar track usando o módulo importer
-        track = import_from_youtube(str(request.url))
+        track = import_from_youtube(str(request.url)) # Also updates track_cache
         return {
             "id": track.id, 
             "title": track.title,
@@ -821,6 +1674,121 @@ async def import_from_url(request: URLImportRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Falha na importação: {str(e)}")
 
+@app.get("/stats/websockets")
+async def websocket_stats():
+    """Outbound queue depths per WebSocket connection (on the loop: it walks live connections)"""
+    stats = manager.queue_stats()
+    stats["lobby"] = lobby.stats()
+    stats["timers"] = timer_wheel.stats()
+    stats["heartbeat"] = heartbeat_stats.stats()
+    stats["resume"] = resume_registry.stats()
+    stats["sessions"] = sessions.stats()
+    stats["cluster"] = cluster.stats()
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition of the server metrics (on the loop: it reads connections, parties and routes)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats/loop")
+def loop_stats():
+    """Event loop stalls caught by the watchdog, with the blocking stack and the message type/route"""
+    return loop_watchdog.stats()
+
+# --- Admin (profiling) ---
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(request: Request):
+    """X-Admin-Token must match ADMIN_TOKEN; without one configured, only local requests are allowed."""
+    if ADMIN_TOKEN:
+        if request.headers.get("x-admin-token") != ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="Token de administração inválido")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1", "localhost"):
+        raise HTTPException(status_code=403, detail="Defina ADMIN_TOKEN para acesso remoto")
+
+@app.get("/admin/profiling")
+def profiling_status(request: Request):
+    """Profiler state and the endpoints/message types profiled so far"""
+    require_admin(request)
+    return profiler.stats()
+
+@app.post("/admin/profiling")
+def update_profiling(update: ProfilingUpdateRequest, request: Request):
+    """Turns profiling on/off and sets the sampled fraction and the stack sampling period"""
+    require_admin(request)
+    if update.sample_rate is not None and not 0 <= update.sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate deve estar entre 0 e 1")
+    interval = update.interval_ms / 1000 if update.interval_ms is not None else None
+    if update.enabled is False:
+        profiler.disable()
+    if update.enabled or (update.enabled is None and profiler.enabled):
+        profiler.enable(update.sample_rate, interval)
+    else:
+        if update.sample_rate is not None:
+            profiler.rate = update.sample_rate
+        if interval is not None:
+            profiler.interval = max(interval, 0.001)
+    return profiler.stats()
+
+@app.delete("/admin/profiling")
+def reset_profiling(request: Request):
+    """Drops the profiles collected so far"""
+    require_admin(request)
+    profiler.reset()
+    return profiler.stats()
+
+@app.get("/admin/profiling/folded", response_class=PlainTextResponse)
+def profiling_folded(request: Request, key: Optional[str] = None):
+    """
+    Collected stacks in folded format, for flamegraph.pl / speedscope /
+    inferno. `key` (e.g. "ws chat_message", "http GET /stream/{track_id}")
+    restricts it to one endpoint or message type.
+    """
+    require_admin(request)
+    filename = "profile.folded" if not key else f"profile-{''.join(c if c.isalnum() else '_' for c in key)}.folded"
+    return PlainTextResponse(profiler.folded(key), headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/stats/messages")
+def message_stats():
+    """Handling time (ms) and fan-out per inbound message type, heaviest first"""
+    return router.stats()
+
+@app.get("/stats/sync")
+def sync_stats():
+    """Per-party drift distribution (seconds), seek/re-anchor counts and sync message rates"""
+    return {
+        "drift_tolerance": SYNC_DRIFT_TOLERANCE,
+        "parties": sync_telemetry.stats(),
+    }
+
+@app.get("/stats/memory")
+async def memory_stats():
+    """
+    Approximate memory per subsystem (deep size, extrapolated from a sample) and process RSS.
+    On the loop: deep_sizeof walks live parties, connections and queues, which must not change under it.
+    """
+    solo_states = manager.player_states
+    connections = list(sessions.all_connections())
+    parties = sessions.parties
+    chat = [message for party in parties.values() for message in party.chat_history]
+    subsystems = {
+        "solo_states": {**measure(solo_states.values(), len(solo_states)), **solo_states.stats()},
+        "parties": measure(parties.values(), len(parties)),
+        "chat_history": measure(chat, len(chat)),
+        "connections": measure(connections, len(connections)),
+    }
+    singletons = {
+        "subscriptions": (manager.subscribers, manager.subscriptions, manager.user_names),
+        "lobby": lobby,
+        "track_cache": track_cache,
+        "sync_telemetry": sync_telemetry,
+    }
+    for name, obj in singletons.items():
+        subsystems[name] = {"approx_bytes": deep_sizeof(obj)}
+    return {"process": process_memory(), "subsystems": subsystems}
+
 @app.get("/library")
 def get_library():
     db = SessionLocal()
@@ -1048,9 +2016,10 @@ async def update_user_nickname(user_id: int, request: NicknameUpdateRequest):
         })
         
         # Atualiza o nome do host se ele estiver em uma festa
-        for party in parties.values():
-            if party.host_id == user_id_str:
-                party.host_name = request.nickname
+        party = sessions.hosted_by(user_id_str)
+        if party is not None:
+            party.host_name = request.nickname
+            party.mark_dirty()
 
         await broadcast_state_update()
 
@@ -1069,21 +2038,9 @@ async def delete_user(user_id: int):
 
         user_id_str = str(user_id)
 
-        # Disband any parties hosted by the user
-        parties_to_disband = [p.party_id for p in parties.values() if p.host_id == user_id_str]
-        for party_id in parties_to_disband:
-            del parties[party_id]
-
-        # Remove user from any parties they are a member of
-        for party in parties.values():
-            if user_id_str in party.members:
-                party.members.remove(user_id_str)
-                # If the party becomes empty, remove it
-                if not party.members:
-                    del parties[party.party_id]
-                else:
-                    # Notify remaining members
-                    await party.broadcast_sync(manager)
+        # Leave the user's party: disbanded if they host it (or it ends up empty), members notified otherwise
+        await leave_current_party(user_id_str)
+        resume_registry.discard(user_id_str)
         
         # O cascade no modelo User cuidará da exclusão de playlists
         db.delete(user)
@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
-"""Cross-platform helper to build and run the Music Stream Docker container."""
+"""
+Cross-platform helper to build and run Torbware Records.
+
+Docker Compose (V2 plugin or V1) first, then plain Docker, then Python
+directly (start_server.py). The container runs serve.py, the production
+profile; --python runs the development profile (auto-reload).
+"""
 
 import os
 import subprocess
@@ -8,96 +14,126 @@ import argparse
 from shutil import which
 
 HERE = os.path.abspath(os.path.dirname(__file__))
+IMAGE = "torbware-records"
+CONTAINER = "torbware-records-app"
+# Seconds Docker waits after SIGTERM: above serve.py's GRACEFUL_TIMEOUT, so streams drain
+STOP_TIMEOUT = "30"
 
 def has_docker():
-    """Checks if Docker is installed and available in the PATH."""
-    return which("docker") is not None
-
-def has_docker_compose_v1():
-    """Checks if docker-compose (V1) is installed."""
-    return which("docker-compose") is not None
+    """Checks if Docker is installed and the daemon answers."""
+    if which("docker") is None:
+        return False
+    return subprocess.run(["docker", "info"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
 
-def has_docker_compose_v2():
-    """Checks if the docker compose plugin (V2) is available."""
+def compose_command():
+    """docker compose (V2 plugin) or docker-compose (V1), None if neither is available."""
     try:
         subprocess.check_call(["docker", "compose", "version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return True
+        return ["docker", "compose"]
     except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+        pass
+    return ["docker-compose"] if which("docker-compose") else None
 
 def run(cmd, cwd=HERE):
     """Prints and runs a command."""
     print(f"$ {' '.join(cmd)}")
     subprocess.check_call(cmd, cwd=cwd)
 
+def docker_volume_path(path):
+    """Host path in the form Docker expects (drive letters on Windows)."""
+    if sys.platform != "win32":
+        return path
+    drive, path_no_drive = os.path.splitdrive(path)
+    path_no_drive = path_no_drive.replace(os.sep, "/")
+    return f"/{drive.rstrip(':').lower()}{path_no_drive}"
+
+def run_with_docker_compose(quick):
+    compose = compose_command()
+    if compose is None:
+        print("❌ No Docker Compose found")
+        return False
+    try:
+        run(compose + ["up", "-d"] + ([] if quick else ["--build"]))
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Docker Compose failed: {e}")
+        return False
+
+def run_with_docker_direct(quick):
+    """Plain Docker: build (unless --quick), replace the container, mount the project."""
+    try:
+        if quick:
+            print(f"Attempting to start existing container '{CONTAINER}'...")
+            run(["docker", "start", CONTAINER])
+            return True
+        run(["docker", "build", "-t", IMAGE, "."])
+        subprocess.run(["docker", "stop", CONTAINER], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run(["docker", "rm", CONTAINER], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        run([
+            "docker", "run", "-d",
+            "--name", CONTAINER,
+            "-p", "8000:8000",
+            "-v", f"{docker_volume_path(HERE)}:/app",
+            "--stop-timeout", STOP_TIMEOUT,
+            "--restart", "unless-stopped",
+            IMAGE
+        ])
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Docker direct failed: {e}")
+        return False
+
+def run_with_python_direct():
+    """Runs the server in this machine's Python (development profile)."""
+    try:
+        try:
+            import fastapi, uvicorn  # noqa: F401
+        except ImportError:
+            print("Installing requirements...")
+            run([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+        run([sys.executable, "start_server.py"])
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Python direct failed: {e}")
+        return False
+    except KeyboardInterrupt:
+        print("\n🛑 Application stopped by user")
+        return True
+
 def main():
     """Main script execution."""
-    parser = argparse.ArgumentParser(description="Build and run the Music Stream Docker container.")
+    parser = argparse.ArgumentParser(description="Build and run Torbware Records.")
     parser.add_argument(
         "--quick",
         action="store_true",
-        help="Quickly restart the container without forcing an image rebuild. "
-             "Useful for code changes that don't involve new dependencies."
+        help="Restart without forcing an image rebuild (code changes without new dependencies)."
     )
+    parser.add_argument("--docker-only", action="store_true", help="Skip Docker Compose and use Docker directly")
+    parser.add_argument("--python", action="store_true", help="Run with Python directly (development mode)")
     args = parser.parse_args()
 
-    if not has_docker():
-        print("Docker is required but not found. Please install Docker Desktop or Docker Engine.", file=sys.stderr)
-        sys.exit(1)
+    print("🎵 Torbware Records")
+    print("=" * 50)
 
-    compose_up_command = ["up", "-d"]
-    if not args.quick:
-        compose_up_command.append("--build")
-    else:
-        print("--- Quick mode enabled: Skipping forced image build. ---")
+    if args.python:
+        sys.exit(0 if run_with_python_direct() else 1)
 
-    try:
-        compose_cmd_base = None
-        if has_docker_compose_v1():
-            compose_cmd_base = ["docker-compose"]
-        elif has_docker_compose_v2():
-            compose_cmd_base = ["docker", "compose"]
-
-        if compose_cmd_base:
-            run(compose_cmd_base + compose_up_command)
-        else:
-            print("Warning: docker-compose not found. Falling back to plain Docker commands.", file=sys.stderr)
-            image = "music_stream_app:latest"
-            container_name = "music_stream_app"
-
-            if not args.quick:
-                run(["docker", "build", "-t", image, "."])
-                # Stop and remove existing container to avoid conflicts
-                subprocess.run(["docker", "stop", container_name], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                subprocess.run(["docker", "rm", container_name], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                
-                volume_path = HERE
-                if sys.platform == "win32":
-                    drive, path_no_drive = os.path.splitdrive(HERE)
-                    volume_path = f"/{drive.rstrip(':').lower()}{path_no_drive.replace('\\', '/')}"
-
-                run([
-                    "docker", "run", "-d",
-                    "--name", container_name,
-                    "-p", "8000:8000",
-                    "-v", f"{volume_path}:/app",
-                    image
-                ])
-            else:
-                # Just try to start the existing container
-                print(f"Attempting to start existing container '{container_name}'...")
-                try:
-                    run(["docker", "start", container_name])
-                except subprocess.CalledProcessError:
-                    print(f"Failed to start existing container '{container_name}'. It might not exist.", file=sys.stderr)
-                    print("Please run the script without --quick first to create it.", file=sys.stderr)
-                    sys.exit(1)
-
-        print("\nContainer running at http://localhost:8000")
-
-    except subprocess.CalledProcessError as e:
-        print(f"\nAn error occurred: {e}", file=sys.stderr)
+    if not has_docker():
+        print("⚠️ Docker is not installed or not running, running with Python directly...")
+        sys.exit(0 if run_with_python_direct() else 1)
+
+    success = False if args.docker_only else run_with_docker_compose(args.quick)
+    if not success:
+        success = run_with_docker_direct(args.quick)
+    if not success:
+        print("\n⚠️ All Docker methods failed. Trying Python direct mode...")
+        success = run_with_python_direct()
+
+    if not success:
+        print("\n❌ All deployment methods failed!", file=sys.stderr)
         sys.exit(1)
+    print("\n🎉 Container running at http://localhost:8000")
+    print(f"📋 Logs: docker logs {CONTAINER}  (compose: docker compose logs)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
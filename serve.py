@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Launch profile of the server (used by the Docker image and by start_server.py).
+
+Production by default: no reloader, uvloop and httptools when installed,
+keep-alive longer than a reverse proxy's idle timeout, a deep accept
+backlog, a concurrency cap that answers 503 instead of falling over, and
+a graceful shutdown: on SIGTERM uvicorn stops accepting, lets /stream
+responses in flight finish (up to GRACEFUL_TIMEOUT), closes WebSockets
+with 1012 so clients reconnect, then runs the app's shutdown hooks.
+
+Everything comes from the environment:
+
+    HOST, PORT               bind address (0.0.0.0:8000)
+    WEB_CONCURRENCY          worker processes (1; more need PUBSUB_URL for shared parties)
+    KEEPALIVE_TIMEOUT        idle keep-alive seconds (75)
+    BACKLOG                  listen backlog (2048)
+    LIMIT_CONCURRENCY        connections + tasks before 503s (4096; 0 = no limit)
+    GRACEFUL_TIMEOUT         seconds to drain on shutdown (25; keep below the container stop timeout)
+    ACCESS_LOG               1 to log every request (off: /stream range requests are too chatty)
+    FORWARDED_ALLOW_IPS      proxies trusted for X-Forwarded-* (127.0.0.1)
+    RELOAD                   1 for development: auto-reload, a single worker
+
+    python serve.py
+"""
+import importlib.util
+import os
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "75"))
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+LIMIT_CONCURRENCY = int(os.getenv("LIMIT_CONCURRENCY", "4096"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "25"))
+ACCESS_LOG = os.getenv("ACCESS_LOG", "0") == "1"
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+RELOAD = os.getenv("RELOAD", "0") == "1"
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def server_options(reload: bool = RELOAD, port: int = PORT) -> dict:
+    """Keyword arguments for uvicorn.run()."""
+    options = {
+        "host": HOST,
+        "port": port,
+        "loop": "uvloop" if _installed("uvloop") else "asyncio",
+        "http": "httptools" if _installed("httptools") else "h11",
+        "ws": "websockets" if _installed("websockets") else "auto",
+        "timeout_keep_alive": KEEPALIVE_TIMEOUT,
+        "backlog": BACKLOG,
+        "limit_concurrency": LIMIT_CONCURRENCY or None,
+        "timeout_graceful_shutdown": GRACEFUL_TIMEOUT,
+        "access_log": ACCESS_LOG,
+        "proxy_headers": True,
+        "forwarded_allow_ips": FORWARDED_ALLOW_IPS,
+        "lifespan": "on",
+    }
+    if reload:
+        options["reload"] = True
+    elif WORKERS > 1:
+        options["workers"] = WORKERS
+    return options
+
+
+def run(reload: bool = RELOAD, port: int = PORT):
+    import uvicorn
+
+    options = server_options(reload, port)
+    if options.get("workers", 1) > 1 and not os.getenv("PUBSUB_URL"):
+        print(f"⚠️  {options['workers']} workers sem PUBSUB_URL: cada festa só alcança quem caiu no mesmo worker")
+    print(f"🚀 {'Desenvolvimento (reload)' if reload else 'Produção'}: {options['host']}:{port}, "
+          f"loop {options['loop']}, http {options['http']}, workers {options.get('workers', 1)}")
+    uvicorn.run("main:app", **options)
+
+
+if __name__ == "__main__":
+    run()
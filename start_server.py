@@ -7,7 +7,6 @@ Para desenvolvimento e teste local com acesso de rede
 import os
 import sys
 import socket
-import subprocess
 import webbrowser
 from pathlib import Path
 
@@ -102,20 +101,12 @@ def main():
     print("=" * 50)
     
     try:
-        # Inicia o servidor
-        subprocess.run([
-            sys.executable, "-m", "uvicorn", 
-            "main:app",
-            "--host", "0.0.0.0",  # Permite acesso de qualquer IP
-            "--port", str(port),
-            "--reload",  # Auto-reload para desenvolvimento
-        ], check=True)
+        # Inicia o servidor com o perfil de serve.py; aqui o reload fica ligado (RELOAD=0 desliga)
+        import serve
+        serve.run(reload=os.getenv("RELOAD", "1") == "1", port=port)
         
     except KeyboardInterrupt:
         print("\n\n🛑 Servidor parado pelo usuário")
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ Erro ao iniciar servidor: {e}")
-        sys.exit(1)
     except Exception as e:
         print(f"\n❌ Erro inesperado: {e}")
         sys.exit(1)
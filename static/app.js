@@ -40,10 +40,34 @@ let currentVolume = 100;
 let isMuted = false;
 let shouldAutoPlay = false;  // Controla reprodução automática após carregamento
 
+// Versioned state sync: last full payload + version per stream, deltas are applied on top
+let partySyncState = { version: 0, payload: null };
+let soloSyncState = { version: 0, payload: null };
+let lobbySyncState = { version: 0, entries: null }; // entries: Map of 'user:<id>' / 'party:<id>'
+
+// Clock sync with the server (NTP-style). serverNow() ~= server monotonic clock
+let clockSync = { offset: 0, rtt: null, samples: [], lastSample: null };
+let clockSyncInterval = null;
+let timelineAlignInterval = null;
+const HOST_SYNC_INTERVAL_MS = 5000; // Server extrapolates the timeline between reports
+// Playback reports for the server's drift telemetry (GET /stats/sync)
+let playbackReportInterval = null;
+let syncCorrections = 0; // Seeks made to catch up with the party since the last report
+const PLAYBACK_REPORT_INTERVAL_MS = 10000;
+// Server heartbeat: answer pings, and reconnect if the server goes quiet
+// for three of its ping intervals (socket died without a close, e.g. Wi-Fi roam)
+let lastServerMessageAt = 0;
+let serverHeartbeatInterval = null; // Seconds, announced in each ping
+let heartbeatWatchdog = null;
+// Session resumption: after a dropped connection the client presents this token
+// and gets back its party plus only the events it missed (kept in memory only,
+// a page reload starts a new session)
+let resumeToken = null;
+let lastChatSeq = 0; // seq of the last chat message received in the current party
+
 // Unified Player State
 let playerState = {
-    queue: [],
-    original_queue: [], // For unshuffling
+    queue: [], // In play order (derived from the server's queue + shuffle seed)
     current_index: -1,
     current_track_id: null,
     current_time: 0.0,
@@ -160,18 +184,38 @@ function connectWebSocket() {
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const wsUrl = `${wsProtocol}//${window.location.host}/ws/${userId}`;
     
+    // Opt-in compact binary encoding: localStorage.setItem('wsEncoding', 'msgpack').
+    // The server picks it via the subprotocol, or falls back to JSON.
+    const wantsMsgpack = localStorage.getItem('wsEncoding') === 'msgpack' && window.MessagePack;
     console.log('🔌 Conectando WebSocket:', wsUrl);
-    ws = new WebSocket(wsUrl);
+    ws = wantsMsgpack ? new WebSocket(wsUrl, ['msgpack', 'json']) : new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
         console.log('🔌 WebSocket connected');
         reconnectAttempts = 0;
         updateConnectionStatus(true);
-        sendMessage('user_join', { name: userName });
+        if (resumeToken) {
+            sendMessage('resume', {
+                token: resumeToken,
+                party_id: currentPartyId,
+                party_version: partySyncState.version,
+                chat_seq: lastChatSeq,
+                solo_version: soloSyncState.version,
+                lobby_version: lobbySyncState.version
+            });
+        } else {
+            sendMessage('user_join', { name: userName });
+        }
+        startClockSync();
+        startHeartbeatWatchdog();
     };
 
     ws.onmessage = (event) => {
-        const message = JSON.parse(event.data);
+        lastServerMessageAt = Date.now();
+        const message = typeof event.data === 'string'
+            ? JSON.parse(event.data)
+            : window.MessagePack.decode(new Uint8Array(event.data));
         handleWebSocketMessage(message);
     };
 
@@ -198,12 +242,26 @@ function handleWebSocketMessage(message) {
     console.log('📨 WebSocket message:', message.type, message.payload);
     
     switch (message.type) {
-        case 'state_update':
+        case 'state_update': {
+            const entries = new Map();
+            (message.payload.users || []).forEach(u => entries.set(`user:${u.id}`, u));
+            (message.payload.parties || []).forEach(p => entries.set(`party:${p.party_id}`, p));
+            lobbySyncState = { version: message.payload.version || 0, entries };
             handleStateUpdate(message.payload);
             break;
+        }
+        case 'state_update_delta':
+            handleStateUpdateDelta(message.payload);
+            break;
         case 'party_sync':
+            partySyncState = { version: message.payload.version || 0, payload: message.payload };
             handlePartySync(message.payload);
             break;
+        case 'party_sync_delta': {
+            const merged = applySyncDelta(partySyncState, message.payload, 'party');
+            if (merged) handlePartySync(merged);
+            break;
+        }
         case 'party_left':
             console.log('🚪 Party left confirmation');
             currentPartyId = null;
@@ -238,8 +296,30 @@ function handleWebSocketMessage(message) {
             showNotification('Festa criada com sucesso!', 'success');
             break;
         case 'chat_message':
+            if (message.payload.seq) lastChatSeq = Math.max(lastChatSeq, message.payload.seq);
             handleChatMessage(message.payload);
             break;
+        case 'session':
+            resumeToken = message.payload.token;
+            break;
+        case 'resumed':
+            console.log('🔁 Sessão retomada');
+            // The party ended while we were away
+            if (currentPartyId && message.payload.party_id !== currentPartyId) forceLeaveParty();
+            break;
+        case 'resume_failed':
+            // Window expired (or server restarted): start over as a new session
+            resumeToken = null;
+            if (currentPartyId) forceLeaveParty();
+            sendMessage('user_join', { name: userName });
+            break;
+        case 'clock_pong':
+            handleClockPong(message.payload);
+            break;
+        case 'ping':
+            serverHeartbeatInterval = message.payload.interval || null;
+            sendMessage('pong', { t: message.payload.t });
+            break;
         // 'queue_update' is effectively replaced by 'party_sync' or 'solo_state_update'
         // as these will contain the full player state including the queue.
         // If a specific 'queue_update' message is still sent by backend for parties for some reason,
@@ -254,8 +334,14 @@ function handleWebSocketMessage(message) {
         //     }
         //     break;
         case 'solo_state_update':
+            soloSyncState = { version: message.payload.version || 0, payload: message.payload };
             handleSoloStateUpdate(message.payload);
             break;
+        case 'solo_state_delta': {
+            const merged = applySyncDelta(soloSyncState, message.payload, 'solo');
+            if (merged) handleSoloStateUpdate(merged);
+            break;
+        }
         case 'action_rejected':
             console.log('🚫 Ação rejeitada:', message.payload);
             showNotification('Ação muito rápida, aguarde um momento', 'warning');
@@ -274,9 +360,188 @@ function handleWebSocketMessage(message) {
     }
 }
 
+// --- Clock Sync ---
+
+function nowSeconds() {
+    return (performance.timeOrigin + performance.now()) / 1000;
+}
+
+function serverNow() {
+    return nowSeconds() + clockSync.offset;
+}
+
+function sendClockPing() {
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+    const payload = { t0: nowSeconds() };
+    if (clockSync.lastSample) { // Lets the server convert our timestamps too
+        payload.offset = clockSync.lastSample.offset;
+        payload.rtt = clockSync.lastSample.rtt;
+    }
+    wsSend({ type: 'clock_ping', payload });
+}
+
+function handleClockPong(pong) {
+    const t3 = nowSeconds();
+    const rtt = (t3 - pong.t0) - (pong.t2 - pong.t1);
+    const offset = ((pong.t1 - pong.t0) + (pong.t2 - t3)) / 2;
+    clockSync.lastSample = { offset, rtt };
+    clockSync.samples.push(clockSync.lastSample);
+    if (clockSync.samples.length > 8) clockSync.samples.shift();
+    // The lowest round-trip sample is the least distorted by queueing
+    const best = clockSync.samples.reduce((a, b) => (b.rtt < a.rtt ? b : a));
+    clockSync.offset = best.offset;
+    clockSync.rtt = best.rtt;
+}
+
+function startClockSync() {
+    if (clockSyncInterval) clearInterval(clockSyncInterval);
+    clockSync.samples = [];
+    [0, 250, 500, 1000].forEach(delay => setTimeout(sendClockPing, delay)); // Quick initial estimate
+    clockSyncInterval = setInterval(sendClockPing, 15000);
+    if (!playbackReportInterval) {
+        playbackReportInterval = setInterval(sendPlaybackReport, PLAYBACK_REPORT_INTERVAL_MS);
+    }
+}
+
+// Tells the server where our player actually is, so it can measure party drift
+function sendPlaybackReport() {
+    if (!currentPartyId || !playerState.current_track_id || !ws || ws.readyState !== WebSocket.OPEN) return;
+    sendMessage('playback_report', {
+        position: player.currentTime,
+        client_time: nowSeconds(),
+        is_playing: !player.paused,
+        track_id: playerState.current_track_id,
+        corrections: syncCorrections,
+    });
+    syncCorrections = 0;
+}
+
+// Where the party should be right now, extrapolated from the server timeline
+function expectedPartyPosition() {
+    if (!playerState.is_playing || playerState.time_anchor === undefined || playerState.time_anchor === null) {
+        return playerState.current_time;
+    }
+    return playerState.current_time + Math.max(0, serverNow() - playerState.time_anchor);
+}
+
+// Members re-check their position against the timeline between (now sparse) syncs
+function alignToPartyTimeline() {
+    if (!currentPartyId || (isHost && currentPartyMode === 'host')) return;
+    if (!playerState.current_track_id || !playerState.is_playing || player.paused || isSyncing) return;
+    if (Date.now() - lastPlayerAction < 2000) return;
+    const expected = expectedPartyPosition();
+    if (Math.abs(player.currentTime - expected) > 1.0) {
+        console.log(`⏰ Timeline drift: ${player.currentTime.toFixed(2)}s -> ${expected.toFixed(2)}s`);
+        player.currentTime = expected;
+        syncCorrections++;
+    }
+}
+
+// --- Shuffle ---
+// Mirror of app/shuffle.py: the server only sends the queue in the order tracks
+// were added plus a shuffle seed, and both sides derive the same play order.
+
+function fmix32(h) {
+    h ^= h >>> 16;
+    h = Math.imul(h, 0x85EBCA6B);
+    h ^= h >>> 13;
+    h = Math.imul(h, 0xC2B2AE35);
+    h ^= h >>> 16;
+    return h >>> 0;
+}
+
+function shuffleKey(seed, seq) {
+    const h = fmix32((seed ^ Math.imul(seq, 0x9E3779B1)) >>> 0);
+    return fmix32((h ^ seed) >>> 0);
+}
+
+// Indexes into `queue` in play order. `seqs` are the entries' sequence numbers
+// (increasing in queue order): the anchor entry first, the entries numbered
+// below `boundary` by keyed hash, then entries added after shuffling in queue order
+function shuffledOrder(seqs, seed, anchor, boundary) {
+    const pinned = [];
+    const keyed = [];
+    const tail = [];
+    seqs.forEach((seq, i) => {
+        if (seq === anchor) pinned.push(i);
+        else if (seq < boundary) keyed.push([shuffleKey(seed, seq), i]);
+        else tail.push(i);
+    });
+    keyed.sort((a, b) => a[0] - b[0]); // Keys never tie: shuffleKey is a bijection of seq
+    return pinned.concat(keyed.map(k => k[1]), tail);
+}
+
+// Runs (payload.queue_seqs: start, count, start, count...) back to one sequence number per entry
+function expandSeqRuns(runs) {
+    const seqs = [];
+    for (let i = 0; i < runs.length; i += 2) {
+        for (let seq = runs[i]; seq < runs[i] + runs[i + 1]; seq++) seqs.push(seq);
+    }
+    return seqs;
+}
+
+// Track ids in play order for a solo/party state payload (current_index indexes this)
+function playOrderFromPayload(payload) {
+    const queue = payload.queue || [];
+    if (payload.shuffle_seed === null || payload.shuffle_seed === undefined || !payload.queue_seqs) return queue.slice();
+    const seqs = expandSeqRuns(payload.queue_seqs);
+    return shuffledOrder(seqs, payload.shuffle_seed, payload.shuffle_anchor, payload.shuffle_boundary || 0)
+        .map(i => queue[i]);
+}
+
+// Applies a field-level delta to the last known full state. Returns the merged
+// payload, or null (and asks the server for a full snapshot) on a version gap.
+function applySyncDelta(syncState, delta, scope) {
+    const samePartyStream = scope !== 'party' || (syncState.payload && syncState.payload.party_id === delta.party_id);
+    if (!syncState.payload || !samePartyStream || delta.base_version !== syncState.version) {
+        console.warn(`🔁 Sync gap (${scope}): have v${syncState.version}, delta ${delta.base_version}->${delta.version}. Requesting snapshot.`);
+        sendMessage('sync_resync', { scope });
+        return null;
+    }
+    const merged = { ...syncState.payload, ...delta.changes, version: delta.version };
+    syncState.payload = merged;
+    syncState.version = delta.version;
+    return merged;
+}
+
+// Lobby deltas carry changed 'user:<id>' / 'party:<id>' entries (null = removed)
+function handleStateUpdateDelta(delta) {
+    if (!lobbySyncState.entries || delta.base_version !== lobbySyncState.version) {
+        sendMessage('sync_resync', { scope: 'lobby' });
+        return;
+    }
+    for (const [key, value] of Object.entries(delta.changes)) {
+        if (value === null) lobbySyncState.entries.delete(key);
+        else lobbySyncState.entries.set(key, value);
+    }
+    lobbySyncState.version = delta.version;
+
+    const users = [];
+    const parties = [];
+    lobbySyncState.entries.forEach((value, key) => (key.startsWith('user:') ? users : parties).push(value));
+    handleStateUpdate({ users, parties });
+}
+
+// Encodes with whatever the server accepted during the handshake
+function wsSend(message) {
+    ws.send(ws.protocol === 'msgpack' ? window.MessagePack.encode(message) : JSON.stringify(message));
+}
+
+function startHeartbeatWatchdog() {
+    lastServerMessageAt = Date.now();
+    if (heartbeatWatchdog) clearInterval(heartbeatWatchdog);
+    heartbeatWatchdog = setInterval(() => {
+        if (!serverHeartbeatInterval || !ws || ws.readyState !== WebSocket.OPEN) return;
+        if (Date.now() - lastServerMessageAt > serverHeartbeatInterval * 3000) {
+            console.warn('💔 Servidor sem resposta, reconectando');
+            ws.close(); // onclose schedules the reconnect
+        }
+    }, 5000);
+}
+
 function sendMessage(type, payload) {
     if (ws && ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify({ type, payload }));
+        wsSend({ type, payload });
     } else {
         showNotification('Sem conexão. Tentando reconectar...', 'warning');
     }
@@ -423,8 +688,7 @@ function handleSoloStateUpdate(soloStatePayload) {
     }
 
     // Update global playerState
-    playerState.queue = soloStatePayload.queue || [];
-    playerState.original_queue = soloStatePayload.original_queue || [];
+    playerState.queue = playOrderFromPayload(soloStatePayload);
     playerState.current_index = soloStatePayload.current_index !== undefined ? soloStatePayload.current_index : -1;
     playerState.current_track_id = soloStatePayload.current_track_id || null;
     playerState.current_time = soloStatePayload.current_time || 0;
@@ -474,8 +738,9 @@ function handlePartySync(partyPayload) {
         if (partyPayload.party_id && partyPayload.members.some(m => m.id === userId)) {
             console.log(`Joining party ${partyPayload.party_id} via sync.`);
             currentPartyId = partyPayload.party_id;
+            lastChatSeq = 0;
              // Clear solo state variables as we are now in a party
-            playerState = { ...playerState, queue: [], original_queue: [], current_index: -1, current_track_id: null, current_time: 0.0, is_playing: false, is_shuffled: false, repeat_mode: 'off' };
+            playerState = { ...playerState, queue: [], current_index: -1, current_track_id: null, current_time: 0.0, is_playing: false, is_shuffled: false, repeat_mode: 'off' };
 
         } else {
             console.warn('⚠️ Recebido sync de festa diferente ou não sou membro! Forçando saída se necessário...');
@@ -487,14 +752,18 @@ function handlePartySync(partyPayload) {
     lastSyncReceived = Date.now();
 
     // Update global playerState from partyPayload
-    playerState.queue = partyPayload.queue || [];
-    playerState.original_queue = partyPayload.original_queue || [];
+    playerState.queue = playOrderFromPayload(partyPayload);
     playerState.current_index = partyPayload.current_index !== undefined ? partyPayload.current_index : -1;
     playerState.current_track_id = partyPayload.current_track_id || null;
     playerState.current_time = partyPayload.current_time || 0;
+    playerState.time_anchor = partyPayload.time_anchor;
     playerState.is_playing = partyPayload.is_playing || false;
     playerState.repeat_mode = partyPayload.repeat_mode || 'off';
     playerState.is_shuffled = partyPayload.is_shuffled || false;
+
+    if (!timelineAlignInterval) {
+        timelineAlignInterval = setInterval(alignToPartyTimeline, 1000);
+    }
     
     currentPartyMode = partyPayload.mode; // Keep this for party-specific UI logic
     isHost = partyPayload.host_id === userId; // Keep this
@@ -528,10 +797,11 @@ function handlePartySync(partyPayload) {
                     sendMessage('sync_update', { // Host sends its current state
                         currentTime: player.currentTime,
                         is_playing: !player.paused,
+                        client_time: nowSeconds(), // When currentTime was sampled, for latency correction
                         // track_id: playerState.current_track_id // Not needed, server knows party's track
                     });
                 }
-            }, 1500);
+            }, HOST_SYNC_INTERVAL_MS);
         }
         return; // Host doesn't apply detailed sync for time/play state from server
     }
@@ -552,14 +822,16 @@ function handlePartySync(partyPayload) {
     const gentleSync = partyPayload.mode === 'democratic' && timeSinceAction < 2000; // More gentle if user acted recently in democratic
     const timeTolerance = gentleSync ? 4.0 : 1.5;
 
+    const expectedPosition = expectedPartyPosition();
     if (playerState.current_track_id) { // Only sync time/play if a track is supposed to be active
-        const timeDifference = Math.abs(player.currentTime - playerState.current_time);
+        const timeDifference = Math.abs(player.currentTime - expectedPosition);
         if (timeDifference > timeTolerance) {
             if (timeSinceAction < 2000 && timeDifference < 8.0 && partyPayload.mode === 'democratic') { // User made recent action
                  console.log(`⏰ SKIP democratic seek: Ação recente (${timeSinceAction}ms) e diferença pequena (${timeDifference.toFixed(2)}s)`);
             } else {
-                console.log(`⏰ Ajustando tempo (party): ${player.currentTime.toFixed(2)}s -> ${playerState.current_time.toFixed(2)}s`);
-                player.currentTime = playerState.current_time;
+                console.log(`⏰ Ajustando tempo (party): ${player.currentTime.toFixed(2)}s -> ${expectedPosition.toFixed(2)}s`);
+                player.currentTime = expectedPosition;
+                syncCorrections++;
             }
         }
 
@@ -1257,10 +1529,7 @@ function addToQueue(trackId) {
 
     // Optimistically update local playerState for solo users for faster UI feedback
     if (!currentPartyId) {
-        playerState.queue.push(trackId);
-        if (playerState.is_shuffled) {
-            playerState.original_queue.push(trackId);
-        }
+        playerState.queue.push(trackId); // Added tracks play last, shuffled or not
         if (playerState.current_index === -1 && playerState.queue.length === 1) { // If it's the first track
             playerState.current_index = 0;
             playerState.current_track_id = trackId;
@@ -1350,14 +1619,7 @@ function playTrackFromQueue(trackId) {
 function removeFromQueue(positionInQueue) {
     // Optimistically update UI for solo mode
     if (!currentPartyId) {
-        const removedTrackId = playerState.queue[positionInQueue];
-        playerState.queue.splice(positionInQueue, 1);
-        if (playerState.is_shuffled && removedTrackId) {
-            const originalIndex = playerState.original_queue.indexOf(removedTrackId);
-            if (originalIndex > -1) {
-                playerState.original_queue.splice(originalIndex, 1);
-            }
-        }
+        playerState.queue.splice(positionInQueue, 1); // Removing never reorders the rest, even shuffled
 
         // Adjust current_index if necessary
         if (positionInQueue < playerState.current_index) {
@@ -1382,7 +1644,6 @@ function clearQueue() {
     if (confirm('Tem certeza que deseja limpar toda a fila?')) {
         if (!currentPartyId) { // Optimistic UI for solo
             playerState.queue = [];
-            playerState.original_queue = [];
             playerState.current_index = -1;
             playerState.current_track_id = null;
             playerState.is_playing = false;
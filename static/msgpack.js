@@ -0,0 +1,145 @@
+// Minimal MessagePack codec for the WebSocket wire encoding (see connectWebSocket).
+// Covers what the protocol uses: nil, booleans, numbers, strings, binary,
+// arrays and string-keyed maps. Exposed as window.MessagePack.
+(function () {
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    function encode(value) {
+        let buffer = new Uint8Array(256);
+        let view = new DataView(buffer.buffer);
+        let offset = 0;
+
+        function ensure(size) {
+            if (offset + size <= buffer.length) return;
+            let length = buffer.length * 2;
+            while (length < offset + size) length *= 2;
+            const grown = new Uint8Array(length);
+            grown.set(buffer);
+            buffer = grown;
+            view = new DataView(buffer.buffer);
+        }
+        function u8(b) { ensure(1); buffer[offset++] = b; }
+        function u16(n) { ensure(2); view.setUint16(offset, n); offset += 2; }
+        function u32(n) { ensure(4); view.setUint32(offset, n); offset += 4; }
+        function bytes(data) { ensure(data.length); buffer.set(data, offset); offset += data.length; }
+
+        function header(length, fix, fixLimit, code16, code32, code8) {
+            if (length < fixLimit) u8(fix | length);
+            else if (code8 !== undefined && length < 0x100) { u8(code8); u8(length); }
+            else if (length < 0x10000) { u8(code16); u16(length); }
+            else { u8(code32); u32(length); }
+        }
+
+        function write(v) {
+            if (v === null || v === undefined) u8(0xc0);
+            else if (v === false) u8(0xc2);
+            else if (v === true) u8(0xc3);
+            else if (typeof v === 'number') {
+                if (Number.isInteger(v) && v >= -0x80000000 && v <= 0xffffffff) {
+                    if (v >= 0 && v < 0x80) u8(v);
+                    else if (v < 0 && v >= -32) u8(v & 0xff);
+                    else if (v >= 0) {
+                        if (v < 0x100) { u8(0xcc); u8(v); }
+                        else if (v < 0x10000) { u8(0xcd); u16(v); }
+                        else { u8(0xce); u32(v); }
+                    } else {
+                        ensure(5); buffer[offset++] = 0xd2; view.setInt32(offset, v); offset += 4;
+                    }
+                } else {
+                    ensure(9); buffer[offset++] = 0xcb; view.setFloat64(offset, v); offset += 8;
+                }
+            } else if (typeof v === 'string') {
+                const data = textEncoder.encode(v);
+                header(data.length, 0xa0, 32, 0xda, 0xdb, 0xd9);
+                bytes(data);
+            } else if (v instanceof Uint8Array) {
+                header(v.length, 0, 0, 0xc5, 0xc6, 0xc4);
+                bytes(v);
+            } else if (Array.isArray(v)) {
+                header(v.length, 0x90, 16, 0xdc, 0xdd);
+                v.forEach(write);
+            } else if (typeof v === 'object') {
+                const keys = Object.keys(v).filter(k => v[k] !== undefined);
+                header(keys.length, 0x80, 16, 0xde, 0xdf);
+                keys.forEach(k => { write(k); write(v[k]); });
+            } else {
+                throw new Error(`MessagePack: cannot encode ${typeof v}`);
+            }
+        }
+
+        write(value);
+        return buffer.subarray(0, offset);
+    }
+
+    function decode(data) {
+        const bytes = data instanceof Uint8Array ? data : new Uint8Array(data);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function str(length) {
+            const s = textDecoder.decode(bytes.subarray(offset, offset + length));
+            offset += length;
+            return s;
+        }
+        function bin(length) {
+            const b = bytes.slice(offset, offset + length);
+            offset += length;
+            return b;
+        }
+        function array(length) {
+            const out = new Array(length);
+            for (let i = 0; i < length; i++) out[i] = read();
+            return out;
+        }
+        function map(length) {
+            const out = {};
+            for (let i = 0; i < length; i++) { const k = read(); out[k] = read(); }
+            return out;
+        }
+        function take(size, getter) {
+            const v = getter(offset);
+            offset += size;
+            return v;
+        }
+
+        function read() {
+            const b = bytes[offset++];
+            if (b < 0x80) return b;
+            if (b < 0x90) return map(b & 0x0f);
+            if (b < 0xa0) return array(b & 0x0f);
+            if (b < 0xc0) return str(b & 0x1f);
+            if (b >= 0xe0) return b - 0x100;
+            switch (b) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return bin(take(1, o => view.getUint8(o)));
+                case 0xc5: return bin(take(2, o => view.getUint16(o)));
+                case 0xc6: return bin(take(4, o => view.getUint32(o)));
+                case 0xca: return take(4, o => view.getFloat32(o));
+                case 0xcb: return take(8, o => view.getFloat64(o));
+                case 0xcc: return take(1, o => view.getUint8(o));
+                case 0xcd: return take(2, o => view.getUint16(o));
+                case 0xce: return take(4, o => view.getUint32(o));
+                case 0xcf: return Number(take(8, o => view.getBigUint64(o)));
+                case 0xd0: return take(1, o => view.getInt8(o));
+                case 0xd1: return take(2, o => view.getInt16(o));
+                case 0xd2: return take(4, o => view.getInt32(o));
+                case 0xd3: return Number(take(8, o => view.getBigInt64(o)));
+                case 0xd9: return str(take(1, o => view.getUint8(o)));
+                case 0xda: return str(take(2, o => view.getUint16(o)));
+                case 0xdb: return str(take(4, o => view.getUint32(o)));
+                case 0xdc: return array(take(2, o => view.getUint16(o)));
+                case 0xdd: return array(take(4, o => view.getUint32(o)));
+                case 0xde: return map(take(2, o => view.getUint16(o)));
+                case 0xdf: return map(take(4, o => view.getUint32(o)));
+                default: throw new Error(`MessagePack: unsupported type 0x${b.toString(16)}`);
+            }
+        }
+
+        return read();
+    }
+
+    window.MessagePack = { encode, decode };
+})();
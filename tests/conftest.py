@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# A throwaway library database and media folder, set before app.database is imported
+_workdir = tempfile.mkdtemp(prefix="torbware-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_workdir, 'library.db')}")
+os.environ.setdefault("MEDIA_DIR", os.path.join(_workdir, "media"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,43 @@
+import sys
+import threading
+
+from app.metrics import MetricsRegistry
+
+
+def test_counter_increments_from_threads_are_not_lost():
+    counter = MetricsRegistry(prefix="test").counter("hits_total", "Hits", ["kind"])
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Switch threads as often as possible
+    try:
+        threads = [threading.Thread(target=lambda: [counter.inc(labels=("a",)) for _ in range(100000)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert counter.value(("a",)) == 400000
+
+
+def test_heartbeat_and_slow_client_families_are_exported():
+    import app.outbound  # noqa: F401  Registers ws_slow_client_disconnects_total
+    from app.heartbeat import heartbeat_stats
+    from app.metrics import metrics
+
+    heartbeat_stats.record_pong(0.03)
+    heartbeat_stats.record_zombie()
+    text = metrics.render()
+    for name in ("ws_heartbeat_pings_total", "ws_heartbeat_pongs_total", "ws_zombie_disconnects_total",
+                 "ws_heartbeat_rtt_seconds", "ws_slow_client_disconnects_total"):
+        assert f"# TYPE {metrics.prefix}_{name}" in text
+    assert f'{metrics.prefix}_ws_heartbeat_rtt_seconds_bucket{{le="0.05"}}' in text
+
+
+def test_failing_gauge_function_is_left_out_of_the_scrape():
+    registry = MetricsRegistry(prefix="test")
+    registry.gauge("broken", "Raises", fn=lambda: {}["missing"])
+    registry.histogram("latency_seconds", "Latency").observe(0.01)
+    text = registry.render()
+    assert "test_broken" not in text
+    assert "test_latency_seconds_count 1" in text
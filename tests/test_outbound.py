@@ -0,0 +1,16 @@
+from app.outbound import SharedMessage, encode_frame
+from app.wire import JSON_CODEC
+
+
+def test_frame_size_counts_utf8_bytes():
+    data, size = encode_frame({"type": "chat_message", "payload": {"text": "canção 🎵"}})
+    assert size == len(data.encode("utf-8")) > len(data)
+    data, size = encode_frame({"type": "ping"})
+    assert size == len(data)
+
+
+def test_shared_message_is_encoded_and_measured_once():
+    message = SharedMessage({"type": "chat_message", "payload": {"text": "olá"}})
+    frame = encode_frame(message)
+    assert encode_frame(message) is frame
+    assert message._encoded[JSON_CODEC.name] == frame
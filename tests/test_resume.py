@@ -0,0 +1,37 @@
+import random
+
+from app.delta_sync import DeltaTracker
+from app.resume import EventLog
+
+
+def random_state(rng: random.Random) -> dict:
+    state = {key: rng.randint(0, 3) for key in "abcdef" if rng.random() < 0.8}
+    state["queue"] = [rng.randint(1, 5) for _ in range(rng.randint(0, 4))]
+    return state
+
+
+def test_replayed_delta_brings_an_old_state_to_the_current_one():
+    rng = random.Random(7)
+    tracker, log = DeltaTracker(), EventLog(size=16)
+    history = {}
+    for _ in range(200):
+        changes = tracker.update(random_state(rng))
+        if changes:
+            log.append(tracker.version, changes.keys())
+            history[tracker.version] = dict(tracker.snapshot)
+        for base in range(max(1, tracker.version - 20), tracker.version + 1):
+            delta = log.changes_since(base, tracker.version, tracker.snapshot)
+            if base < tracker.version - 16:
+                assert delta is None
+                continue
+            state = dict(history[base])
+            state.update(delta)
+            assert {k: v for k, v in state.items() if v is not None} == tracker.snapshot
+
+
+def test_log_keeps_field_names_only():
+    tracker, log = DeltaTracker(), EventLog()
+    queue = list(range(1000))
+    log.append(1, tracker.update({"queue": queue, "current_index": 0}).keys())
+    assert all(isinstance(key, str) for _, keys in log._entries for key in keys)
+    assert log.changes_since(0, 1, tracker.snapshot)["queue"] is queue
@@ -0,0 +1,108 @@
+import json
+import random
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import main
+from app.shuffle import ShuffleOrder, expand_runs
+
+APP_JS = Path(__file__).resolve().parent.parent / "static" / "app.js"
+
+
+def play_order(state):
+    """Track ids in play order, through the server's own index mapping."""
+    return [state.queue[state.queue_index(i)] for i in range(len(state.queue))]
+
+
+def entries_in_play_order(state):
+    """Entry identities (seqs) in play order."""
+    return [state.queue.seq_at(state.queue_index(i)) for i in range(len(state.queue))]
+
+
+def shuffled_state(track_ids, seed=12345, current=0):
+    state = main.PlayerState()
+    state.queue = track_ids
+    state.current_index = current
+    state.set_current_track()
+    state.shuffle(seed)
+    return state
+
+
+def test_shuffle_pins_the_current_entry_and_covers_every_entry():
+    state = shuffled_state([5, 6, 7, 8, 9, 10], current=3)
+    order = play_order(state)
+    assert order[0] == 8
+    assert sorted(order) == [5, 6, 7, 8, 9, 10]
+    assert state.current_index == 0
+
+
+def test_removing_one_copy_of_a_duplicated_track_keeps_the_rest_in_place():
+    rng = random.Random(3)
+    for _ in range(50):
+        state = shuffled_state([rng.randint(1, 8) for _ in range(60)], seed=rng.getrandbits(32),
+                               current=rng.randrange(60))
+        for _ in range(30):
+            before = entries_in_play_order(state)
+            play_index = rng.randrange(len(before))
+            state.remove_at(play_index)
+            assert entries_in_play_order(state) == before[:play_index] + before[play_index + 1:]
+
+
+def test_incremental_order_matches_a_rebuild():
+    rng = random.Random(9)
+    state = shuffled_state([rng.randint(1, 20) for _ in range(200)], current=17)
+    for _ in range(300):
+        if rng.random() < 0.5 and state.queue:
+            state.remove_at(rng.randrange(len(state.queue)))
+        else:
+            state.append(rng.randint(1, 20))
+        order = state.shuffle_order()
+        rebuilt = ShuffleOrder(state.shuffle_seed, state.shuffle_anchor, state.shuffle_boundary,
+                               state.queue.seqs())
+        assert [order.seq_at(i) for i in range(len(order))] == [rebuilt.seq_at(i) for i in range(len(rebuilt))]
+        assert expand_runs(order.runs()) == state.queue.seqs()
+
+
+def test_added_tracks_play_last_and_play_index_finds_the_first_copy_to_play():
+    state = shuffled_state([1, 2, 3, 2, 4])
+    state.append(2)
+    order = play_order(state)
+    assert order[-1] == 2
+    assert state.play_index(2) == order.index(2)
+
+
+def test_unshuffle_stays_on_the_same_entry():
+    state = shuffled_state(list(range(1, 30)), current=4)
+    state.current_index = 7
+    entry = state.queue.seq_at(state.queue_index(7))
+    state.unshuffle()
+    assert state.queue.seq_at(state.current_index) == entry
+    assert play_order(state) == list(range(1, 30))
+
+
+def test_snapshot_and_party_copy_keep_the_order():
+    state = shuffled_state([3, 1, 4, 1, 5, 9, 2, 6], current=2)
+    state.remove_at(3)
+    state.append(7)
+    restored = main.PlayerState.from_snapshot(state.to_snapshot())
+    assert play_order(restored) == play_order(state)
+    party = main.Party("host", "Host", state)
+    assert play_order(party) == play_order(state)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_client_derives_the_same_order():
+    source = APP_JS.read_text(encoding="utf-8")
+    shuffle_js = source[source.index("function fmix32("):source.index("// Applies a field-level delta")]
+    rng = random.Random(5)
+    state = shuffled_state([rng.randint(1, 10) for _ in range(80)], seed=0xDEADBEEF, current=11)
+    for _ in range(20):
+        state.remove_at(rng.randrange(len(state.queue)))
+        state.append(rng.randint(1, 10))
+    payload = state.to_dict()
+    script = shuffle_js + f"\nconsole.log(JSON.stringify(playOrderFromPayload({json.dumps(payload)})));"
+    result = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True)
+    assert json.loads(result.stdout) == play_order(state)
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.database import Base, engine
+from app.solo_states import SoloStateStore
+
+
+class State:
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+
+    def to_snapshot(self):
+        return {"queue": [1, 2, 3]}
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def make_store(index_delay: float = 0.0):
+    store = SoloStateStore(State, State, ttl=0, spill=True)
+    loads = []
+    load_index = store._load_index
+
+    def slow_load_index():
+        loads.append(threading.get_ident())
+        index = load_index()
+        time.sleep(index_delay)  # Rows written from here on are not in `index`
+        return index
+
+    store._load_index = slow_load_index
+    return store, loads
+
+
+def test_concurrent_first_connects_share_one_index_load():
+    async def scenario():
+        seed, _ = make_store()
+        seed._write({"a": {"queue": [1]}, "b": {"queue": [2]}})  # Spilled by an earlier run
+        store, loads = make_store(index_delay=0.05)
+        states = await asyncio.gather(*(store.acquire(user_id) for user_id in ("a", "b", "c")))
+        return states, loads
+
+    states, loads = asyncio.run(scenario())
+    assert len(loads) == 1
+    assert [state.snapshot for state in states] == [{"queue": [1]}, {"queue": [2]}, None]
+
+
+def test_flush_during_an_index_load_is_not_lost():
+    async def scenario():
+        store, _ = make_store(index_delay=0.1)
+        store["late"] = State()
+        store._evict("late")  # Pending spill, written while the index loads
+        connecting = asyncio.create_task(store.acquire("someone"))
+        await asyncio.sleep(0.02)
+        await store.flush()
+        await connecting
+        return await store.acquire("late")
+
+    assert asyncio.run(scenario()).snapshot == {"queue": [1, 2, 3]}
+
+
+def slow_loads(store, delay: float):
+    load = store._load
+
+    def slow_load(user_id):
+        snapshot = load(user_id)
+        time.sleep(delay)
+        return snapshot
+
+    store._load = slow_load
+
+
+def test_concurrent_connects_of_a_spilled_user_get_the_restored_state():
+    async def scenario():
+        store, _ = make_store()
+        store._write({"a": {"queue": [7]}})
+        slow_loads(store, 0.05)
+        return await asyncio.gather(store.acquire("a"), store.acquire("a"), store.acquire("a"))
+
+    states = asyncio.run(scenario())
+    assert states[0].snapshot == {"queue": [7]}
+    assert all(state is states[0] for state in states)
+
+
+def test_restored_state_wins_over_one_created_during_the_load():
+    async def scenario():
+        store, _ = make_store()
+        store._write({"a": {"queue": [7]}})
+        slow_loads(store, 0.05)
+        connecting = asyncio.create_task(store.acquire("a"))
+        await asyncio.sleep(0.01)
+        store["a"] = State()  # Created fresh while the row loads
+        state = await connecting
+        return state, store["a"]
+
+    state, stored = asyncio.run(scenario())
+    assert state is stored
+    assert stored.snapshot == {"queue": [7]}
+
+
+def test_write_replaces_an_existing_row():
+    store, _ = make_store()
+    store._write({"a": {"queue": [1]}})
+    store._write({"a": {"queue": [2]}, "b": {"queue": [3]}})
+    assert store._load("a") == {"queue": [2]}
+    assert store._load("b") == {"queue": [3]}
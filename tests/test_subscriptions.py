@@ -0,0 +1,11 @@
+import main
+
+
+def test_drop_topic_leaves_no_empty_subscription_sets():
+    manager = main.ConnectionManager(main.SessionRegistry())
+    manager.subscribe("a", "party:1")
+    manager.subscribe("b", "party:1")
+    manager.subscribe("b", "lobby")
+    assert manager.drop_topic("party:1") == {"a", "b"}
+    assert "party:1" not in manager.subscribers
+    assert manager.subscriptions == {"b": {"lobby"}}
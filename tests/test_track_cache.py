@@ -0,0 +1,60 @@
+import pytest
+
+from app.database import Base, SessionLocal, Track, engine
+from app.track_cache import TrackMetadataCache
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def add_track(title: str) -> Track:
+    db = SessionLocal()
+    try:
+        track = Track(title=title, filename=f"{title}.m4a")
+        db.add(track)
+        db.commit()
+        db.refresh(track)
+        return track
+    finally:
+        db.close()
+
+
+def test_hit_is_served_from_memory():
+    cache = TrackMetadataCache()
+    track = add_track("one")
+    assert cache.get_title(track.id) == "one"
+    assert cache.get_title(track.id) == "one"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_put_replaces_a_cached_miss():
+    cache = TrackMetadataCache()
+    assert cache.get_title(1, "none") == "none"
+    generation = cache.generation
+    track = add_track("imported")
+    cache.put(track)
+    assert cache.get_title(track.id) == "imported"
+    assert cache.generation > generation
+
+
+def test_miss_expires_for_tracks_added_elsewhere():
+    cache = TrackMetadataCache(miss_ttl=0)
+    assert cache.get(1) is None
+    generation = cache.generation
+    add_track("from another worker")  # No put(): this process never heard of it
+    assert cache.get_title(1) == "from another worker"
+    assert cache.generation > generation  # Memoized payloads built on the miss get rebuilt
+
+
+def test_miss_is_cached_within_ttl():
+    cache = TrackMetadataCache(miss_ttl=60)
+    assert cache.get(1) is None
+    add_track("late")
+    assert cache.get(1) is None
+    assert cache.misses == 1
+    cache.invalidate(1)
+    assert cache.get_title(1) == "late"
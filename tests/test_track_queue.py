@@ -0,0 +1,40 @@
+import random
+
+from app.track_queue import TrackQueue
+
+
+def test_matches_list_under_random_operations():
+    rng = random.Random(7)
+    queue, reference = TrackQueue(), []
+    for _ in range(5000):
+        roll = rng.random()
+        if roll < 0.4 or not reference:
+            position, track_id = rng.randint(0, len(reference)), rng.randint(1, 30)
+            queue.insert(position, track_id)
+            reference.insert(position, track_id)
+        elif roll < 0.7:
+            position = rng.randrange(len(reference))
+            assert queue.pop(position) == reference.pop(position)
+        elif roll < 0.9:
+            source, destination = rng.randrange(len(reference)), rng.randrange(len(reference))
+            queue.move(source, destination)
+            reference.insert(destination, reference.pop(source))
+        else:
+            track_id = rng.choice(reference)
+            assert queue.index(track_id) == reference.index(track_id)
+        if rng.random() < 0.3:
+            assert queue.to_list() == reference
+    assert queue.to_list() == reference
+
+
+def test_published_lists_are_never_modified():
+    queue = TrackQueue([1, 2, 3])
+    first = queue.to_list()
+    queue.append(4)
+    second = queue.to_list()
+    queue.pop(0)
+    queue.move(0, 2)
+    queue.clear()
+    assert first == [1, 2, 3]
+    assert second == [1, 2, 3, 4]
+    assert queue.to_list() == []